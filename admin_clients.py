@@ -5,30 +5,19 @@ from fastapi import APIRouter, Depends, Query, HTTPException
 from fastapi.responses import HTMLResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, or_
-from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm import aliased, joinedload, selectinload
 
-from models import Order, OrderStatusHistory, Employee, Settings
+from models import Order, OrderStatusHistory, Employee
 from templates import ADMIN_HTML_TEMPLATE, ADMIN_CLIENTS_LIST_BODY, ADMIN_CLIENT_DETAIL_BODY
-from dependencies import get_db_session, check_credentials
+from dependencies import get_db_session, get_read_db_session, check_credentials
+from settings_cache import settings_cache
+from csv_export import csv_response, stream_query, export_filename, export_button
+from pagination import fetch_keyset_page, estimated_total, keyset_links
 
 router = APIRouter()
 
-@router.get("/admin/clients", response_class=HTMLResponse)
-async def admin_clients_list(
-    page: int = Query(1, ge=1),
-    q: str = Query(None, alias="search"),
-    filter_type: str = Query("all", alias="type"), # all, delivery, in_house
-    session: AsyncSession = Depends(get_db_session),
-    username: str = Depends(check_credentials)
-):
-    """Відображає сторінку клієнтів з можливістю пошуку, фільтрації та пагінації."""
-    settings = await session.get(Settings, 1)
-    if not settings:
-        settings = Settings()
-
-    per_page = 20
-    offset = (page - 1) * per_page
-
+def _client_query(q: str | None, filter_type: str):
+    """Агрегація клієнтів за номером телефону (спільна для сторінки і CSV-експорту)."""
     # --- Фільтрація за типом (Розділення списків) ---
     if filter_type == 'delivery':
         type_condition = Order.order_type.in_(['delivery', 'pickup'])
@@ -38,51 +27,80 @@ async def admin_clients_list(
         type_condition = True # Показувати всіх
     # ------------------------------------------------
 
-    # Підзапит для отримання останнього імені клієнта для кожного номера телефону
-    latest_name_subquery = (
-        select(
-            Order.phone_number,
-            Order.customer_name,
-            func.row_number().over(
-                partition_by=Order.phone_number,
-                order_by=Order.id.desc()
-            ).label("rn")
-        )
-        .where(Order.phone_number.isnot(None))
-        .subquery()
+    # Останнє ім'я клієнта - корельований підзапит: рахується лише для груп, що потрапили на сторінку,
+    # а не вікном по всій таблиці orders
+    latest = aliased(Order)
+    latest_name = (
+        select(latest.customer_name)
+        .where(latest.phone_number == Order.phone_number)
+        .order_by(latest.id.desc())
+        .limit(1)
+        .correlate(Order)
+        .scalar_subquery()
     )
 
-    # Основний запит для агрегації даних про клієнтів
+    # Основний запит для агрегації даних про клієнтів. Групи йдуть у порядку телефону:
+    # GROUP BY читає індекс orders.phone_number, і keyset-курсор стоїть у WHERE до агрегації
     client_query = (
         select(
             Order.phone_number,
             func.count(Order.id).label("order_count"),
             func.sum(Order.total_price).label("total_spent"),
-            latest_name_subquery.c.customer_name.label("customer_name")
+            latest_name.label("customer_name")
         )
-        .join(latest_name_subquery, Order.phone_number == latest_name_subquery.c.phone_number)
         .where(
-            latest_name_subquery.c.rn == 1,
+            Order.phone_number.isnot(None),
             type_condition # Застосування фільтру по типу
         )
-        .group_by(Order.phone_number, latest_name_subquery.c.customer_name)
-        .order_by(func.count(Order.id).desc())
+        .group_by(Order.phone_number)
+        .order_by(Order.phone_number)
     )
 
     if q:
-        client_query = client_query.where(
+        client_query = client_query.having(
             or_(
-                latest_name_subquery.c.customer_name.ilike(f"%{q}%"),
+                latest_name.ilike(f"%{q}%"),
                 Order.phone_number.ilike(f"%{q}%")
             )
         )
 
-    total_res = await session.execute(select(func.count()).select_from(client_query.subquery()))
-    total = total_res.scalar_one()
-    pages = (total // per_page) + (1 if total % per_page > 0 else 0)
+    return client_query
 
-    clients_res = await session.execute(client_query.limit(per_page).offset(offset))
-    clients = clients_res.mappings().all()
+
+@router.get("/admin/clients", response_class=HTMLResponse)
+async def admin_clients_list(
+    after: str = Query(None),
+    before: str = Query(None),
+    q: str = Query(None, alias="search"),
+    filter_type: str = Query("all", alias="type"), # all, delivery, in_house
+    session: AsyncSession = Depends(get_read_db_session),
+    primary: AsyncSession = Depends(get_db_session),
+    username: str = Depends(check_credentials)
+):
+    """Відображає сторінку клієнтів з можливістю пошуку, фільтрації та пагінації."""
+    settings = await settings_cache.get(primary)
+
+    per_page = 20
+
+    client_query = _client_query(q, filter_type)
+
+    # Точна кількість груп вимагає агрегації всієї таблиці - кешується на PAGINATION_COUNT_TTL
+    total = await estimated_total(
+        session, None, ("clients", q, filter_type),
+        select(func.count()).select_from(client_query.subquery())
+    )
+
+    # Keyset по телефону: умова курсора в WHERE, до GROUP BY
+    if before:
+        client_query = client_query.where(Order.phone_number < before)
+    elif after:
+        client_query = client_query.where(Order.phone_number > after)
+    page = await fetch_keyset_page(
+        session, client_query.order_by(None), per_page,
+        (Order.phone_number,), (Order.phone_number.desc(),),
+        backward=bool(before), has_cursor=bool(after), mappings=True
+    )
+    clients = page.items
 
     rows = "".join([f"""
     <tr>
@@ -96,14 +114,10 @@ async def admin_clients_list(
     </tr>""" for c in clients])
 
     # Пагінація (зберігаємо тип фільтру та пошуковий запит)
-    links = []
-    for i in range(1, pages + 1):
-        search_part = f'&search={q}' if q else ''
-        type_part = f'&type={filter_type}'
-        class_part = 'active' if i == page else ''
-        links.append(f'<a href="/admin/clients?page={i}{search_part}{type_part}" class="{class_part}">{i}</a>')
-    
-    pagination = f"<div class='pagination'>{' '.join(links)}</div>"
+    pagination = keyset_links(
+        "/admin/clients", [("search", q), ("type", filter_type)], page,
+        lambda c: c['phone_number'], total, "клієнтів"
+    )
 
     # --- HTML Вкладки (Tabs) ---
     tabs_html = f"""
@@ -111,6 +125,7 @@ async def admin_clients_list(
         <a href="/admin/clients?type=all" class="{'active' if filter_type == 'all' else ''}">Всі</a>
         <a href="/admin/clients?type=delivery" class="{'active' if filter_type == 'delivery' else ''}">Доставка/Самовивіз</a>
         <a href="/admin/clients?type=in_house" class="{'active' if filter_type == 'in_house' else ''}">В закладі</a>
+        <span style="margin-left:auto;">{export_button('/admin/clients/export', [('search', q), ('type', filter_type)])}</span>
     </div>
     """
 
@@ -119,7 +134,7 @@ async def admin_clients_list(
     body_content = ADMIN_CLIENTS_LIST_BODY.format(
         search_query=q or '',
         rows=rows or "<tr><td colspan='5'>Клієнтів не знайдено</td></tr>",
-        pagination=pagination if pages > 1 else ""
+        pagination=pagination
     )
     body_content = body_content.replace('</form>', f'<input type="hidden" name="type" value="{filter_type}"></form>')
 
@@ -138,6 +153,25 @@ async def admin_clients_list(
     ))
 
 
+@router.get("/admin/clients/export")
+async def admin_clients_export(
+    q: str = Query(None, alias="search"),
+    filter_type: str = Query("all", alias="type"),
+    username: str = Depends(check_credentials)
+):
+    """CSV усіх клієнтів з урахуванням пошуку і вкладки (без пагінації, потоково)."""
+    query = _client_query(q, filter_type)
+
+    def row_fn(row):
+        return (row.customer_name or "Не вказано", row.phone_number, row.order_count, row.total_spent)
+
+    return csv_response(
+        export_filename("clients", filter_type),
+        ["Клієнт", "Телефон", "Замовлень", "Сума"],
+        stream_query(query, row_fn)
+    )
+
+
 @router.get("/admin/client/{phone_number}", response_class=HTMLResponse)
 async def admin_client_detail(
     phone_number: str,
@@ -145,9 +179,7 @@ async def admin_client_detail(
     username: str = Depends(check_credentials)
 ):
     """Відображає детальну інформацію про клієнта та його історію замовлень."""
-    settings = await session.get(Settings, 1)
-    if not settings:
-        settings = Settings()
+    settings = await settings_cache.get(session)
     
     orders_res = await session.execute(
         select(Order)
@@ -16,6 +16,8 @@ from sqlalchemy import select
 from models import Settings
 from templates import ADMIN_HTML_TEMPLATE, ADMIN_DESIGN_SETTINGS_BODY
 from dependencies import get_db_session, check_credentials
+from page_cache import storefront_cache
+from settings_cache import settings_cache
 
 router = APIRouter()
 
@@ -276,5 +278,7 @@ async def save_design_settings(
     settings.telegram_welcome_message = telegram_welcome_message
 
     await session.commit()
+    await settings_cache.refresh(session)
+    storefront_cache.invalidate()
     
     return RedirectResponse(url="/admin/design_settings?saved=true", status_code=303)
\ No newline at end of file
@@ -12,11 +12,14 @@ from sqlalchemy import select, func, or_
 from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 
-from models import Employee, Role, Order, Settings, CashShift, OrderStatus
+from models import Employee, Role, Order, CashShift
 # Імпортуємо Warehouse для вибору цеху
 from inventory_models import Warehouse
 from templates import ADMIN_HTML_TEMPLATE
 from dependencies import get_db_session, check_credentials
+from settings_cache import settings_cache
+from status_registry import status_registry
+from shift_roster import shift_roster
 from auth_utils import get_password_hash
 
 router = APIRouter()
@@ -31,7 +34,7 @@ async def admin_employees(
     username: str = Depends(check_credentials)
 ):
     """Відображає список співробітників."""
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     # Обробка помилок видалення
     error_msg = ""
@@ -268,7 +271,7 @@ async def get_edit_employee_form(
     session: AsyncSession = Depends(get_db_session), 
     username: str = Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     employee = await session.get(Employee, employee_id, options=[joinedload(Employee.role)])
     if not employee: 
         raise HTTPException(status_code=404, detail="Співробітника не знайдено")
@@ -377,6 +380,7 @@ async def edit_employee(
         except IntegrityError: 
             await session.rollback()
             raise HTTPException(status_code=400, detail="Цей номер телефону вже зайнятий")
+        shift_roster.invalidate()
             
     return RedirectResponse(url="/admin/employees", status_code=303)
 
@@ -391,8 +395,7 @@ async def delete_employee(
         if employee.cash_balance > 0:
              return RedirectResponse(url="/admin/employees?error=has_debt", status_code=303)
 
-        final_statuses_res = await session.execute(select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True)))
-        final_status_ids = final_statuses_res.scalars().all()
+        final_status_ids = (await status_registry.get(session)).final_ids
 
         active_assignments = await session.execute(
             select(func.count(Order.id)).where(
@@ -414,6 +417,7 @@ async def delete_employee(
         except IntegrityError:
             await session.rollback()
             return RedirectResponse(url="/admin/employees?error=integrity", status_code=303)
+        shift_roster.invalidate()
 
     return RedirectResponse(url="/admin/employees", status_code=303)
 
@@ -426,7 +430,7 @@ async def admin_roles(
     username: str = Depends(check_credentials)
 ):
     """Відображає список ролей."""
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     roles_res = await session.execute(select(Role).order_by(Role.id))
     roles = roles_res.scalars().all()
     
@@ -586,7 +590,7 @@ async def get_edit_role_form(
     session: AsyncSession = Depends(get_db_session), 
     username: str = Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     role = await session.get(Role, role_id)
     if not role: raise HTTPException(404, "Роль не знайдено")
     
@@ -666,6 +670,7 @@ async def edit_role(
         role.can_receive_kitchen_orders = can_receive_kitchen_orders
         role.can_receive_bar_orders = can_receive_bar_orders
         await session.commit()
+        shift_roster.invalidate()
     return RedirectResponse(url="/admin/roles", status_code=303)
 
 @router.get("/admin/delete_role/{role_id}")
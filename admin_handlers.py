@@ -18,6 +18,7 @@ import os
 from decimal import Decimal
 
 from models import Order, Product, Category, OrderStatus, Employee, Role, Settings, OrderStatusHistory, OrderItem, BalanceHistory
+from status_registry import status_registry
 from courier_handlers import _generate_waiter_order_view
 from notification_manager import notify_all_parties_on_status_change, create_staff_notification
 # --- КАСА & СКЛАД ---
@@ -93,10 +94,7 @@ async def _generate_order_admin_view(order: Order, session: AsyncSession):
                   f"<b>Статус:</b> {status_name}{reason_html}")
 
     kb_admin = InlineKeyboardBuilder()
-    statuses_res = await session.execute(
-        select(OrderStatus).where(OrderStatus.visible_to_operator == True).order_by(OrderStatus.id)
-    )
-    statuses = statuses_res.scalars().all()
+    statuses = (await status_registry.get(session)).visible_to("operator")
     
     status_buttons = [
         InlineKeyboardButton(text=f"{'✅ ' if s.id == order.status_id else ''}{s.name}", callback_data=f"change_order_status_{order.id}_{s.id}")
@@ -647,8 +645,7 @@ def register_admin_handlers(dp: Dispatcher):
             if new_courier.telegram_user_id:
                 try:
                     kb_courier = InlineKeyboardBuilder()
-                    statuses_res = await session.execute(select(OrderStatus).where(OrderStatus.visible_to_courier == True).order_by(OrderStatus.id))
-                    statuses = statuses_res.scalars().all()
+                    statuses = (await status_registry.get(session)).visible_to("courier")
                     kb_courier.row(*[InlineKeyboardButton(text=s.name, callback_data=f"courier_set_status_{order.id}_{s.id}") for s in statuses])
                     
                     map_url = f"http://googleusercontent.com/maps/google.com/0{quote_plus(order.address)}" if order.address else "#"
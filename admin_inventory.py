@@ -17,12 +17,18 @@ from inventory_models import (
     IngredientRecipeItem
 )
 # Додали Order в імпорт
-from models import Product, Settings, Order
-from dependencies import get_db_session, check_credentials
+from models import Product, Order
+from dependencies import get_db_session, get_read_db_session, check_credentials
+from settings_cache import settings_cache
 from templates import ADMIN_HTML_TEMPLATE
 # Імпортуємо функції сервісу
 from inventory_service import apply_doc_stock_changes, process_inventory_check
 from cash_service import add_shift_transaction, get_any_open_shift
+from menu_cache import menu_cache
+from tech_card_plans import deduction_plans
+from cost_rollup import cost_rollup
+from stock_ledger import stock_as_of, usage_for_period, ledger_start
+from csv_export import csv_response, stream_query, export_filename, export_button
 
 router = APIRouter(prefix="/admin/inventory", tags=["inventory"])
 
@@ -111,8 +117,8 @@ def get_active_classes():
 # --- DASHBOARD ---
 @router.get("/dashboard", response_class=HTMLResponse)
 @router.get("/", response_class=HTMLResponse)
-async def inv_dashboard(session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+async def inv_dashboard(session: AsyncSession = Depends(get_read_db_session), primary: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
+    settings = await settings_cache.get(primary)
     
     total_cost_res = await session.execute(
         select(func.sum(Stock.quantity * Ingredient.current_cost))
@@ -189,7 +195,7 @@ async def warehouses_list(
     session: AsyncSession = Depends(get_db_session),
     user=Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     warehouses = (await session.execute(
         select(Warehouse).options(joinedload(Warehouse.linked_warehouse)).order_by(Warehouse.name)
@@ -292,6 +298,7 @@ async def add_warehouse(
         linked_warehouse_id=linked_id
     ))
     await session.commit()
+    deduction_plans.invalidate()
     return RedirectResponse("/admin/inventory/warehouses", 303)
 
 @router.get("/warehouses/delete/{w_id}")
@@ -304,12 +311,13 @@ async def delete_warehouse(w_id: int, session: AsyncSession = Depends(get_db_ses
             
         await session.delete(w)
         await session.commit()
+        deduction_plans.invalidate()
     return RedirectResponse("/admin/inventory/warehouses", 303)
 
 # --- SUPPLIERS ---
 @router.get("/suppliers", response_class=HTMLResponse)
 async def suppliers_list(session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     suppliers = (await session.execute(select(Supplier).order_by(Supplier.name))).scalars().all()
     
     rows = ""
@@ -360,7 +368,7 @@ async def add_supplier(name: str = Form(...), contact_person: str = Form(None),
 # --- MODIFIERS ---
 @router.get("/modifiers", response_class=HTMLResponse)
 async def modifiers_list(session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     mods = (await session.execute(
         select(Modifier)
@@ -449,6 +457,8 @@ async def add_modifier(
         warehouse_id=warehouse_id
     ))
     await session.commit()
+    menu_cache.invalidate()
+    deduction_plans.invalidate()
     return RedirectResponse("/admin/inventory/modifiers", 303)
 
 @router.get("/modifiers/delete/{mod_id}")
@@ -457,12 +467,14 @@ async def delete_modifier(mod_id: int, session: AsyncSession = Depends(get_db_se
     if mod:
         await session.delete(mod)
         await session.commit()
+        menu_cache.invalidate()
+        deduction_plans.invalidate()
     return RedirectResponse("/admin/inventory/modifiers", 303)
 
 # --- PACKAGING RULES (RULES) ---
 @router.get("/rules", response_class=HTMLResponse)
 async def rules_list(session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     rules = (await session.execute(
         select(AutoDeductionRule)
@@ -550,6 +562,7 @@ async def add_rule(
         quantity=quantity, warehouse_id=warehouse_id
     ))
     await session.commit()
+    deduction_plans.invalidate()
     return RedirectResponse("/admin/inventory/rules", 303)
 
 @router.get("/rules/delete/{r_id}")
@@ -558,12 +571,13 @@ async def delete_rule(r_id: int, session: AsyncSession = Depends(get_db_session)
     if r:
         await session.delete(r)
         await session.commit()
+        deduction_plans.invalidate()
     return RedirectResponse("/admin/inventory/rules", 303)
 
 # --- INGREDIENTS ---
 @router.get("/ingredients", response_class=HTMLResponse)
 async def ingredients_page(q: str = Query(None), session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     query = select(Ingredient).options(joinedload(Ingredient.unit)).order_by(Ingredient.name)
     if q: query = query.where(Ingredient.name.ilike(f"%{q}%"))
@@ -641,7 +655,7 @@ async def add_ing(
 # --- РЕДАКТИРОВАНИЕ РЕЦЕПТА ПОЛУФАБРИКАТА ---
 @router.get("/ingredients/{pf_id}/recipe", response_class=HTMLResponse)
 async def edit_pf_recipe(pf_id: int, session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     pf = await session.get(Ingredient, pf_id, options=[
         joinedload(Ingredient.recipe_components).joinedload(IngredientRecipeItem.child_ingredient).joinedload(Ingredient.unit),
@@ -658,13 +672,14 @@ async def edit_pf_recipe(pf_id: int, session: AsyncSession = Depends(get_db_sess
     rows = ""
     total_cost_per_unit = 0
     
+    costs = await cost_rollup.get(session)
+
     # Розрахунок вартості рецепта на 1 одиницю П/Ф
     for item in pf.recipe_components:
-        cost = float(item.gross_amount) * float(item.child_ingredient.current_cost or 0)
+        raw_price = float(costs.ingredient_cost(item.child_ingredient_id))
+        cost = float(item.gross_amount) * raw_price
         total_cost_per_unit += cost
         
-        raw_price = float(item.child_ingredient.current_cost or 0)
-        
         rows += f"""
         <tr>
             <td>{item.child_ingredient.name}</td>
@@ -711,6 +726,7 @@ async def edit_pf_recipe(pf_id: int, session: AsyncSession = Depends(get_db_sess
 async def add_pf_component(pf_id: int, child_id: int = Form(...), gross: float = Form(...), session: AsyncSession = Depends(get_db_session)):
     session.add(IngredientRecipeItem(parent_ingredient_id=pf_id, child_ingredient_id=child_id, gross_amount=gross))
     await session.commit()
+    cost_rollup.invalidate()
     return RedirectResponse(f"/admin/inventory/ingredients/{pf_id}/recipe", 303)
 
 @router.get("/ingredients/recipe/del/{item_id}")
@@ -720,36 +736,78 @@ async def del_pf_component(item_id: int, session: AsyncSession = Depends(get_db_
         pf_id = item.parent_ingredient_id
         await session.delete(item)
         await session.commit()
+        cost_rollup.invalidate()
         return RedirectResponse(f"/admin/inventory/ingredients/{pf_id}/recipe", 303)
     return RedirectResponse("/admin/inventory/ingredients", 303)
 
+def _parse_day(value: str, end_of_day: bool = False) -> datetime:
+    """Дата з параметра запиту (YYYY-MM-DD); некоректна - 400, а не помилка сервера."""
+    try:
+        day = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(400, f"Некоректна дата: {value}")
+    return day.replace(hour=23, minute=59, second=59) if end_of_day else day
+
+
+def _no_ledger_data(start: Optional[datetime]) -> str:
+    since = f"з {start:%d.%m.%Y %H:%M}" if start else "після першого знімка залишків"
+    return f"<div class='inv-badge badge-gray' style='margin-bottom:15px;'>Журнал руху ведеться {since} - за раніші дати даних немає.</div>"
+
+
 # --- STOCK ---
 @router.get("/stock", response_class=HTMLResponse)
-async def stock_page(warehouse_id: int = Query(None), session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+async def stock_page(warehouse_id: int = Query(None), as_of: str = Query(None), session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
+    settings = await settings_cache.get(session)
     warehouses = (await session.execute(select(Warehouse))).scalars().all()
     
-    query = select(Stock).options(joinedload(Stock.warehouse), joinedload(Stock.ingredient).joinedload(Ingredient.unit))
-    if warehouse_id: query = query.where(Stock.warehouse_id == warehouse_id)
-    stocks = (await session.execute(query.order_by(Stock.warehouse_id))).scalars().all()
+    notice = ""
+    if as_of:
+        # Залишки на кінець дня: знімок + журнал руху
+        at = _parse_day(as_of, end_of_day=True)
+        balances = await stock_as_of(session, at, warehouse_id)
+        if balances is None:
+            notice = _no_ledger_data(await ledger_start(session))
+            balances = {}
+        wh_names = {w.id: w.name for w in warehouses}
+        ing_ids = {ing_id for _, ing_id in balances}
+        ings = {i.id: i for i in (await session.execute(
+            select(Ingredient).options(joinedload(Ingredient.unit)).where(Ingredient.id.in_(ing_ids))
+        )).scalars().all()}
+        lines = [(wh_names.get(wh_id, '-'), ings[ing_id], qty) for (wh_id, ing_id), qty in sorted(balances.items()) if ing_id in ings]
+    else:
+        query = select(Stock).options(joinedload(Stock.warehouse), joinedload(Stock.ingredient).joinedload(Ingredient.unit))
+        if warehouse_id: query = query.where(Stock.warehouse_id == warehouse_id)
+        stocks = (await session.execute(query.order_by(Stock.warehouse_id))).scalars().all()
+        lines = [(s.warehouse.name, s.ingredient, s.quantity) for s in stocks]
     
-    wh_links = f"<a href='/admin/inventory/stock' class='{'active' if not warehouse_id else ''}' style='margin-right:10px; font-weight:bold;'>Всі</a>"
+    as_of_param = f"&as_of={as_of}" if as_of else ""
+    wh_links = f"<a href='/admin/inventory/stock{'?as_of=' + as_of if as_of else ''}' class='{'active' if not warehouse_id else ''}' style='margin-right:10px; font-weight:bold;'>Всі</a>"
     for w in warehouses:
         cls = "active" if warehouse_id == w.id else ""
-        wh_links += f"<a href='/admin/inventory/stock?warehouse_id={w.id}' class='{cls}' style='margin-right:10px; text-decoration:none; color:#333; padding:5px 10px; border-radius:5px; background:#eee;'>{w.name}</a>"
+        wh_links += f"<a href='/admin/inventory/stock?warehouse_id={w.id}{as_of_param}' class='{cls}' style='margin-right:10px; text-decoration:none; color:#333; padding:5px 10px; border-radius:5px; background:#eee;'>{w.name}</a>"
+    
+    date_form = f"""
+    <form action="/admin/inventory/stock" method="get" style="display:inline-flex; gap:8px; align-items:center; float:right;">
+        {f'<input type="hidden" name="warehouse_id" value="{warehouse_id}">' if warehouse_id else ''}
+        <label>На дату:</label>
+        <input type="date" name="as_of" value="{as_of or ''}" style="padding:5px; border-radius:6px; border:1px solid #ccc;">
+        <button type="submit" class="button-sm"><i class="fa-solid fa-filter"></i></button>
+    </form>
+    """
     
     rows = ""
     total_val = 0
-    for s in stocks:
-        val = float(s.quantity) * float(s.ingredient.current_cost)
+    for wh_name, ing, qty in lines:
+        val = float(qty) * float(ing.current_cost)
         total_val += val
-        qty_style = "color:#ef4444; font-weight:bold;" if s.quantity < 0 else "color:#0f172a; font-weight:bold;"
-        rows += f"<tr><td>{s.warehouse.name}</td><td>{s.ingredient.name}</td><td style='{qty_style}'>{s.quantity:.3f} {s.ingredient.unit.name}</td><td>{s.ingredient.current_cost:.2f}</td><td>{val:.2f} грн</td></tr>"
+        qty_style = "color:#ef4444; font-weight:bold;" if qty < 0 else "color:#0f172a; font-weight:bold;"
+        rows += f"<tr><td>{wh_name}</td><td>{ing.name}</td><td style='{qty_style}'>{qty:.3f} {ing.unit.name}</td><td>{ing.current_cost:.2f}</td><td>{val:.2f} грн</td></tr>"
         
     body = f"""
     {get_nav('stock')}
     <div class="card">
-        <div style="margin-bottom:20px; border-bottom:1px solid #eee; padding-bottom:10px;">{wh_links}</div>
+        <div style="margin-bottom:20px; border-bottom:1px solid #eee; padding-bottom:10px;">{date_form}{wh_links}</div>
+        {notice}
         <div class="inv-table-wrapper">
             <table class="inv-table">
                 <thead><tr><th>Склад</th><th>Товар</th><th>Залишок</th><th>Ціна</th><th>Сума</th></tr></thead>
@@ -765,7 +823,7 @@ async def stock_page(warehouse_id: int = Query(None), session: AsyncSession = De
 # --- ІНВЕНТАРИЗАЦІЯ (CHECKS) ---
 @router.get("/checks", response_class=HTMLResponse)
 async def inventory_checks_list(session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     query = select(InventoryDoc).options(joinedload(InventoryDoc.source_warehouse))\
         .where(InventoryDoc.doc_type == 'inventory')\
@@ -873,7 +931,7 @@ async def view_inventory_check(
     session: AsyncSession = Depends(get_db_session), 
     user=Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     doc = await session.get(InventoryDoc, doc_id, options=[
         joinedload(InventoryDoc.items).joinedload(InventoryDocItem.ingredient).joinedload(Ingredient.unit),
@@ -1127,7 +1185,7 @@ async def update_inventory_check(
 # --- DOCS ---
 @router.get("/docs", response_class=HTMLResponse)
 async def docs_page(type: str = Query(None), session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     query = select(InventoryDoc).options(joinedload(InventoryDoc.supplier), joinedload(InventoryDoc.source_warehouse), joinedload(InventoryDoc.target_warehouse)).order_by(desc(InventoryDoc.created_at))
     if type: query = query.where(InventoryDoc.doc_type == type)
@@ -1215,7 +1273,7 @@ async def docs_page(type: str = Query(None), session: AsyncSession = Depends(get
 
 @router.get("/docs/create", response_class=HTMLResponse)
 async def create_doc_page(session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     warehouses = (await session.execute(select(Warehouse))).scalars().all()
     suppliers = (await session.execute(select(Supplier))).scalars().all()
     
@@ -1333,7 +1391,7 @@ async def delete_document(doc_id: int, session: AsyncSession = Depends(get_db_se
 
 @router.get("/docs/{doc_id}", response_class=HTMLResponse)
 async def view_doc(doc_id: int, session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     doc = await session.get(InventoryDoc, doc_id, options=[
         joinedload(InventoryDoc.items).joinedload(InventoryDocItem.ingredient).joinedload(Ingredient.unit),
@@ -1588,7 +1646,7 @@ async def pay_document(doc_id: int, amount: Decimal = Form(...), session: AsyncS
 # --- TECH CARDS ---
 @router.get("/tech_cards", response_class=HTMLResponse)
 async def tc_list(session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     tcs = (await session.execute(select(TechCard).options(joinedload(TechCard.product)))).scalars().all()
     
     rows = "".join([f"""
@@ -1623,6 +1681,7 @@ async def create_tc(product_id: int = Form(...), session: AsyncSession = Depends
     tc = TechCard(product_id=product_id)
     session.add(tc)
     await session.commit()
+    deduction_plans.invalidate()
     await session.refresh(tc)
     return RedirectResponse(f"/admin/inventory/tech_cards/{tc.id}", 303)
 
@@ -1632,6 +1691,8 @@ async def delete_tech_card(tc_id: int, session: AsyncSession = Depends(get_db_se
     if tc:
         await session.delete(tc)
         await session.commit()
+        deduction_plans.invalidate()
+        cost_rollup.invalidate()
     return RedirectResponse("/admin/inventory/tech_cards", status_code=303)
 
 # --- РЕДАГУВАННЯ ТЕХКАРТИ (З ЦІНОЮ ТА ПРИБУТКОМ) ---
@@ -1640,7 +1701,7 @@ async def edit_tc(
     tc_id: int, 
     session: AsyncSession = Depends(get_db_session), 
     user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     # Завантажуємо техкарту разом з продуктом
     tc = await session.get(TechCard, tc_id, options=[joinedload(TechCard.product), joinedload(TechCard.components).joinedload(TechCardItem.ingredient).joinedload(Ingredient.unit)])
     
@@ -1652,10 +1713,12 @@ async def edit_tc(
     
     comp_rows = ""
     cost = 0.0
+    costs = await cost_rollup.get(session)
     
     if tc:
         for c in tc.components:
-            ing_cost = float(c.ingredient.current_cost or 0)
+            # Для напівфабрикатів - собівартість, розгорнута по рецепту
+            ing_cost = float(costs.ingredient_cost(c.ingredient_id))
             sub = float(c.gross_amount) * ing_cost
             cost += sub
             takeaway_icon = "<span class='inv-badge badge-blue'><i class='fa-solid fa-box'></i> Тільки винос</span>" if c.is_takeaway else ""
@@ -1765,6 +1828,7 @@ async def update_tc_product_price(
     if tc and tc.product:
         tc.product.price = price
         await session.commit()
+        menu_cache.invalidate()
     return RedirectResponse(f"/admin/inventory/tech_cards/{tc_id}", 303)
 
 @router.post("/tc/{tc_id}/add")
@@ -1784,6 +1848,8 @@ async def add_tc_comp(
         is_takeaway=is_takeaway
     ))
     await session.commit()
+    deduction_plans.invalidate()
+    cost_rollup.invalidate()
     return RedirectResponse(f"/admin/inventory/tech_cards/{tc_id}", 303)
 
 @router.get("/tc/del/{item_id}")
@@ -1792,25 +1858,56 @@ async def del_tc_comp(item_id: int, session: AsyncSession = Depends(get_db_sessi
     tc_id = item.tech_card_id
     await session.delete(item)
     await session.commit()
+    deduction_plans.invalidate()
+    cost_rollup.invalidate()
     return RedirectResponse(f"/admin/inventory/tech_cards/{tc_id}", 303)
 
 # --- ЗВІТ ПО РУХУ ІНГРЕДІЄНТА ---
+USAGE_TYPE_LABELS = {
+    'supply': ('📥 Прихід', 'green'),
+    'writeoff': ('🗑️ Списання', 'red'),
+    'deduction': ('🤖 Авто-списання', 'gray'),
+    'transfer': ('🔄 Переміщення', 'blue'),
+    'return': ('♻️ Повернення', 'orange'),
+    'inventory': ('📝 Інвентаризація', 'orange')
+}
+
 @router.get("/reports/usage", response_class=HTMLResponse)
 async def inventory_usage_report(
     ingredient_id: int = Query(None),
     date_from: str = Query(None),
     date_to: str = Query(None),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_db_session),
+    primary: AsyncSession = Depends(get_db_session),
     user=Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(primary)
     
     ingredients = (await session.execute(select(Ingredient).order_by(Ingredient.name))).scalars().all()
     ing_options = "".join([f'<option value="{i.id}" {"selected" if ingredient_id == i.id else ""}>{html.escape(i.name)}</option>' for i in ingredients])
     
     report_rows = ""
+    summary_html = ""
     
     if ingredient_id:
+        # Підсумок за період - із журналу руху (знімок + дельти), без перебору накладних
+        if date_from:
+            period_from = _parse_day(date_from)
+            period_to = _parse_day(date_to, end_of_day=True) if date_to else datetime.now()
+            usage = await usage_for_period(session, period_from, period_to, ingredient_ids=[ingredient_id])
+            if usage is None:
+                summary_html = _no_ledger_data(await ledger_start(session))
+            else:
+                opening, incoming, outgoing, closing = usage.get(ingredient_id, (Decimal(0),) * 4)
+                summary_html = f"""
+                <div style="display:flex; gap:15px; flex-wrap:wrap; margin-bottom:20px;">
+                    <div class="inv-badge badge-gray">На початок: <b>{opening:.3f}</b></div>
+                    <div class="inv-badge badge-green">Надійшло: <b>{incoming:.3f}</b></div>
+                    <div class="inv-badge badge-red">Вибуло: <b>{outgoing:.3f}</b></div>
+                    <div class="inv-badge badge-blue">На кінець: <b>{closing:.3f}</b></div>
+                </div>
+                """
+        
         query = select(InventoryDocItem).join(InventoryDoc).options(
             joinedload(InventoryDocItem.doc)
         ).where(
@@ -1819,10 +1916,10 @@ async def inventory_usage_report(
         )
         
         if date_from:
-            dt_from = datetime.strptime(date_from, "%Y-%m-%d")
+            dt_from = _parse_day(date_from)
             query = query.where(InventoryDoc.created_at >= dt_from)
         if date_to:
-            dt_to = datetime.strptime(date_to, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
+            dt_to = _parse_day(date_to, end_of_day=True)
             query = query.where(InventoryDoc.created_at <= dt_to)
             
         query = query.order_by(desc(InventoryDoc.created_at))
@@ -1832,15 +1929,7 @@ async def inventory_usage_report(
         for item in items:
             doc = item.doc
             
-            type_map = {
-                'supply': ('📥 Прихід', 'green'),
-                'writeoff': ('🗑️ Списання', 'red'),
-                'deduction': ('🤖 Авто-списання', 'gray'),
-                'transfer': ('🔄 Переміщення', 'blue'),
-                'return': ('♻️ Повернення', 'orange'),
-                'inventory': ('📝 Інвентаризація', 'orange')
-            }
-            type_label, color = type_map.get(doc.doc_type, (doc.doc_type, 'black'))
+            type_label, color = USAGE_TYPE_LABELS.get(doc.doc_type, (doc.doc_type, 'black'))
             
             details = html.escape(doc.comment or '-')
             if doc.linked_order_id:
@@ -1893,6 +1982,8 @@ async def inventory_usage_report(
             </div>
         </form>
         
+        {summary_html}
+        {f"<div style='text-align:right; margin-bottom:10px;'>{export_button('/admin/inventory/reports/usage/export', [('ingredient_id', ingredient_id), ('date_from', date_from), ('date_to', date_to)])}</div>" if ingredient_id else ""}
         <div class="inv-table-wrapper">
             <table class="inv-table">
                 <thead>
@@ -1913,10 +2004,45 @@ async def inventory_usage_report(
     """
     return HTMLResponse(ADMIN_HTML_TEMPLATE.format(title="Звіт по руху", body=body, site_title=settings.site_title, **get_active_classes()))
 
+@router.get("/reports/usage/export")
+async def inventory_usage_export(
+    ingredient_id: int = Query(...),
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    user=Depends(check_credentials)
+):
+    query = select(
+        InventoryDoc.created_at, InventoryDoc.doc_type, InventoryDoc.source_warehouse_id,
+        InventoryDocItem.quantity, InventoryDocItem.price,
+        InventoryDoc.id, InventoryDoc.linked_order_id, InventoryDoc.comment
+    ).join(InventoryDoc, InventoryDocItem.doc_id == InventoryDoc.id).where(
+        InventoryDocItem.ingredient_id == ingredient_id,
+        InventoryDoc.is_processed == True
+    )
+    if date_from:
+        query = query.where(InventoryDoc.created_at >= datetime.strptime(date_from, "%Y-%m-%d"))
+    if date_to:
+        query = query.where(InventoryDoc.created_at <= datetime.strptime(date_to, "%Y-%m-%d").replace(hour=23, minute=59, second=59))
+    query = query.order_by(InventoryDoc.created_at)
+
+    def row_fn(row):
+        created_at, doc_type, source_wh_id, qty, price, doc_id, order_id, comment = row
+        # Знак - як у звіті на сторінці; для інвентаризації - фактичний залишок
+        if doc_type in ('writeoff', 'deduction') or (doc_type == 'transfer' and source_wh_id):
+            qty = -qty
+        type_label = USAGE_TYPE_LABELS.get(doc_type, (doc_type,))[0].split(" ", 1)[-1]
+        return (created_at.strftime('%d.%m.%Y %H:%M'), type_label, qty, price, doc_id, order_id, comment)
+
+    return csv_response(
+        export_filename(f"usage_{ingredient_id}", date_from, date_to),
+        ["Дата", "Операція", "Кількість", "Ціна", "Документ", "Замовлення", "Коментар"],
+        stream_query(query, row_fn)
+    )
+
 # --- ЗВІТ ПО РЕНТАБЕЛЬНОСТІ ---
 @router.get("/reports/profitability", response_class=HTMLResponse)
-async def report_profitability(session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+async def report_profitability(session: AsyncSession = Depends(get_read_db_session), primary: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
+    settings = await settings_cache.get(primary)
     
     products_res = await session.execute(
         select(Product)
@@ -1924,22 +2050,12 @@ async def report_profitability(session: AsyncSession = Depends(get_db_session),
         .options(joinedload(Product.category))
     )
     products = products_res.scalars().all()
+    costs = await cost_rollup.get(primary)
     
     data = []
     
     for p in products:
-        tc = await session.scalar(
-            select(TechCard)
-            .where(TechCard.product_id == p.id)
-            .options(joinedload(TechCard.components).joinedload(TechCardItem.ingredient))
-        )
-        
-        cost_price = 0.0
-        if tc:
-            for item in tc.components:
-                ing_cost = float(item.ingredient.current_cost or 0)
-                amount = float(item.gross_amount or 0)
-                cost_price += ing_cost * amount
+        cost_price = float(costs.product_cost(p.id))
         
         sale_price = float(p.price)
         margin = sale_price - cost_price
@@ -2020,10 +2136,11 @@ async def report_suppliers(
     date_from: str = Query(None),
     date_to: str = Query(None),
     sort_by: str = Query("date_desc"),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_db_session),
+    primary: AsyncSession = Depends(get_db_session),
     user=Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(primary)
     
     suppliers = (await session.execute(select(Supplier).order_by(Supplier.name))).scalars().all()
     sup_opts = f"<option value=''>-- Всі постачальники --</option>"
@@ -2150,6 +2267,7 @@ async def report_suppliers(
             </div>
         </form>
 
+        <div style="text-align:right; margin-bottom:10px;">{export_button('/admin/inventory/reports/suppliers/export', [('supplier_id', supplier_id), ('date_from', date_from), ('date_to', date_to), ('sort_by', sort_by)])}</div>
         <div class="inv-table-wrapper">
             <table class="inv-table">
                 <thead>
@@ -2174,10 +2292,52 @@ async def report_suppliers(
     
     return HTMLResponse(ADMIN_HTML_TEMPLATE.format(title="Звіт: Постачальники", body=body, site_title=settings.site_title, **get_active_classes()))
 
+@router.get("/reports/suppliers/export")
+async def report_suppliers_export(
+    supplier_id: int = Query(None),
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    sort_by: str = Query("date_desc"),
+    user=Depends(check_credentials)
+):
+    # Суми накладних рахуються в SQL, щоб не вантажити позиції в пам'ять
+    doc_total = func.coalesce(func.sum(InventoryDocItem.quantity * InventoryDocItem.price), 0).label("total")
+    query = select(
+        InventoryDoc.id, InventoryDoc.created_at, Supplier.name, doc_total,
+        InventoryDoc.paid_amount, InventoryDoc.is_processed, InventoryDoc.comment
+    ).outerjoin(Supplier, InventoryDoc.supplier_id == Supplier.id).outerjoin(
+        InventoryDocItem, InventoryDocItem.doc_id == InventoryDoc.id
+    ).where(InventoryDoc.doc_type == 'supply').group_by(InventoryDoc.id, Supplier.name)
+
+    if supplier_id:
+        query = query.where(InventoryDoc.supplier_id == supplier_id)
+    if date_from:
+        query = query.where(InventoryDoc.created_at >= datetime.strptime(date_from, "%Y-%m-%d"))
+    if date_to:
+        query = query.where(InventoryDoc.created_at <= datetime.strptime(date_to, "%Y-%m-%d").replace(hour=23, minute=59, second=59))
+
+    order_by = {
+        'date_asc': InventoryDoc.created_at,
+        'amount_desc': desc(doc_total),
+        'amount_asc': doc_total,
+    }.get(sort_by, desc(InventoryDoc.created_at))
+    query = query.order_by(order_by)
+
+    def row_fn(row):
+        doc_id, created_at, supplier_name, total, paid, is_processed, comment = row
+        paid = paid or Decimal(0)
+        return (doc_id, created_at.strftime('%d.%m.%Y %H:%M'), supplier_name or "Невідомий", total, paid, total - paid, "Так" if is_processed else "Ні", comment)
+
+    return csv_response(
+        export_filename("suppliers", date_from, date_to),
+        ["ID", "Дата", "Постачальник", "Сума накладної", "Сплачено", "Борг", "Проведено", "Коментар"],
+        stream_query(query, row_fn)
+    )
+
 # --- ВИРОБНИЦТВО ---
 @router.get("/production", response_class=HTMLResponse)
 async def production_page(session: AsyncSession = Depends(get_db_session), user=Depends(check_credentials)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     # Список П/Ф для выбора
     pfs = (await session.execute(
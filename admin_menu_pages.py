@@ -9,9 +9,11 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
-from models import MenuItem, Settings
+from models import MenuItem
 from templates import ADMIN_HTML_TEMPLATE
 from dependencies import get_db_session, check_credentials
+from settings_cache import settings_cache
+from page_cache import storefront_cache
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -22,7 +24,7 @@ async def admin_menu_items(
     username: str = Depends(check_credentials)
 ):
     """Відображає список інформаційних сторінок (меню)."""
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     # Отримуємо всі сторінки, відсортовані за порядком
     menu_items_res = await session.execute(select(MenuItem).order_by(MenuItem.sort_order, MenuItem.title))
@@ -161,6 +163,7 @@ async def add_menu_item(
         show_in_qr=show_in_qr
     ))
     await session.commit()
+    storefront_cache.invalidate()
     return RedirectResponse(url="/admin/menu", status_code=303)
 
 @router.get("/admin/menu/edit/{item_id}", response_class=HTMLResponse)
@@ -169,7 +172,7 @@ async def get_edit_menu_item_form(
     session: AsyncSession = Depends(get_db_session), 
     username: str = Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     item = await session.get(MenuItem, item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Сторінку не знайдено")
@@ -243,6 +246,7 @@ async def edit_menu_item(
         item.show_in_telegram = show_in_telegram
         item.show_in_qr = show_in_qr
         await session.commit()
+        storefront_cache.invalidate()
     return RedirectResponse(url="/admin/menu", status_code=303)
 
 @router.get("/admin/menu/delete/{item_id}")
@@ -255,4 +259,5 @@ async def delete_menu_item(
     if item:
         await session.delete(item)
         await session.commit()
+        storefront_cache.invalidate()
     return RedirectResponse(url="/admin/menu", status_code=303)
\ No newline at end of file
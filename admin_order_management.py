@@ -13,9 +13,11 @@ from urllib.parse import quote_plus
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 import re
 
-from models import Order, OrderStatus, Employee, Role, OrderStatusHistory, Settings, Product, OrderItem
+from models import Order, OrderStatus, Employee, Role, OrderStatusHistory, Product, OrderItem
 from templates import ADMIN_HTML_TEMPLATE, ADMIN_ORDER_MANAGE_BODY
 from dependencies import get_db_session, check_credentials
+from settings_cache import settings_cache
+from status_registry import status_registry
 from notification_manager import notify_all_parties_on_status_change
 # --- КАСА: Імпорт сервісів ---
 from cash_service import link_order_to_shift, register_employee_debt, unregister_employee_debt
@@ -30,7 +32,7 @@ async def get_manage_order_page(
     username: str = Depends(check_credentials)
 ):
     """Відображає сторінку керування для конкретного замовлення."""
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     order = await session.get(
         Order,
@@ -271,8 +273,7 @@ async def web_assign_courier(
         if new_courier.telegram_user_id and admin_bot:
             try:
                 kb_courier = InlineKeyboardBuilder()
-                statuses_res = await session.execute(select(OrderStatus).where(OrderStatus.visible_to_courier == True).order_by(OrderStatus.id))
-                statuses = statuses_res.scalars().all()
+                statuses = (await status_registry.get(session)).visible_to("courier")
                 kb_courier.row(*[InlineKeyboardButton(text=s.name, callback_data=f"courier_set_status_{order.id}_{s.id}") for s in statuses])
                 
                 map_url = "#"
@@ -14,44 +14,52 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from sqlalchemy.orm import joinedload, selectinload
 
-from models import Product, Category, Settings, product_modifier_association
+from models import Product, Category, product_modifier_association
 from inventory_models import Modifier, Warehouse # Added Warehouse
 from templates import ADMIN_HTML_TEMPLATE
 from dependencies import get_db_session, check_credentials
+from settings_cache import settings_cache
+from menu_cache import menu_cache
+from tech_card_plans import deduction_plans
+from pagination import fetch_keyset_page, estimated_total, keyset_links
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 @router.get("/admin/products", response_class=HTMLResponse)
 async def admin_products(
-    page: int = Query(1, ge=1), 
+    after: Optional[int] = Query(None),
+    before: Optional[int] = Query(None),
     q: str = Query(None, alias="search"), 
     session: AsyncSession = Depends(get_db_session), 
     username: str = Depends(check_credentials)
 ):
     """Відображає список страв (товарів) з пагінацією та пошуком."""
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     per_page = 10
-    offset = (page - 1) * per_page
 
-    query = select(Product).options(joinedload(Product.category)).order_by(Product.id.desc())
+    query = select(Product).options(joinedload(Product.category))
     
     # Фільтрація пошуку
     if q:
         query = query.where(Product.name.ilike(f"%{q}%"))
 
-    # Підрахунок загальної кількості
+    # Загальна кількість: оцінка планувальника, з пошуком - кешований count
     count_query = select(func.count(Product.id))
     if q:
         count_query = count_query.where(Product.name.ilike(f"%{q}%"))
-        
-    total_res = await session.execute(count_query)
-    total = total_res.scalar_one_or_none() or 0
-    
-    products_res = await session.execute(query.limit(per_page).offset(offset))
-    products = products_res.scalars().all()
-
-    pages = (total // per_page) + (1 if total % per_page > 0 else 0)
+    total = await estimated_total(session, None if q else "products", ("products", q), count_query)
+
+    # Keyset по Product.id замість OFFSET
+    if before is not None:
+        query = query.where(Product.id > before)
+    elif after is not None:
+        query = query.where(Product.id < after)
+    page = await fetch_keyset_page(
+        session, query, per_page, (Product.id.desc(),), (Product.id.asc(),),
+        backward=before is not None, has_cursor=after is not None
+    )
+    products = page.items
 
     # --- NEW: Load warehouses for mapping and options ---
     warehouses_res = await session.execute(select(Warehouse).where(Warehouse.is_production == True).order_by(Warehouse.name))
@@ -126,13 +134,7 @@ async def admin_products(
     # -------------------------------------------------------
 
     # Пагінація
-    links_products = []
-    for i in range(1, pages + 1):
-        search_part = f'&search={q}' if q else ''
-        class_part = 'active' if i == page else ''
-        links_products.append(f'<a href="/admin/products?page={i}{search_part}" class="{class_part}">{i}</a>')
-    
-    pagination = f"<div class='pagination'>{' '.join(links_products)}</div>"
+    pagination = keyset_links("/admin/products", [("search", q)], page, lambda p: str(p.id), total, "страв")
     
     # --- CSS Styles ---
     styles = """
@@ -219,7 +221,7 @@ async def admin_products(
                 </tbody>
             </table>
         </div>
-        {pagination if pages > 1 else ''}
+        {pagination}
     </div>
 
     <div class="modal-overlay" id="add-product-modal">
@@ -323,6 +325,8 @@ async def add_product(
 
     session.add(product)
     await session.commit()
+    menu_cache.invalidate()
+    deduction_plans.invalidate()
     return RedirectResponse(url="/admin/products", status_code=303)
 
 @router.get("/admin/edit_product/{product_id}", response_class=HTMLResponse)
@@ -331,7 +335,7 @@ async def get_edit_product_form(
     session: AsyncSession = Depends(get_db_session), 
     username: str = Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     # Завантажуємо продукт разом з його модифікаторами
     product = await session.get(Product, product_id, options=[selectinload(Product.modifiers)])
     if not product: 
@@ -471,6 +475,8 @@ async def edit_product(
             logger.error(f"Не вдалося зберегти нове зображення {path}: {e}")
 
     await session.commit()
+    menu_cache.invalidate()
+    deduction_plans.invalidate()
     return RedirectResponse(url="/admin/products", status_code=303)
 
 @router.get("/admin/product/toggle_active/{product_id}")
@@ -483,6 +489,7 @@ async def toggle_product_active(
     if product:
         product.is_active = not product.is_active
         await session.commit()
+        menu_cache.invalidate()
     return RedirectResponse(url="/admin/products", status_code=303)
 
 @router.get("/admin/delete_product/{product_id}")
@@ -496,6 +503,8 @@ async def delete_product(
         image_to_delete = product.image_url
         await session.delete(product)
         await session.commit()
+        menu_cache.invalidate()
+        deduction_plans.invalidate()
         
         if image_to_delete and os.path.exists(image_to_delete):
             try: 
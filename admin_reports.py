@@ -10,12 +10,15 @@ from sqlalchemy import select, func, and_, case, desc
 from sqlalchemy.orm import joinedload
 
 # Импортируем все необходимые модели, включая CashShift
-from models import Order, OrderStatus, CashTransaction, Employee, OrderItem, Role, Settings, CashShift
+from models import Order, CashTransaction, Employee, Role, CashShift, DailySales, DailyProductSales
 from templates import (
     ADMIN_HTML_TEMPLATE, ADMIN_REPORT_CASH_FLOW_BODY, 
     ADMIN_REPORT_WORKERS_BODY, ADMIN_REPORT_ANALYTICS_BODY
 )
-from dependencies import get_db_session, check_credentials
+from dependencies import get_db_session, get_read_db_session, check_credentials
+from settings_cache import settings_cache
+from status_registry import status_registry
+from csv_export import csv_response, stream_query, export_filename, export_button
 
 router = APIRouter()
 
@@ -31,28 +34,29 @@ async def get_date_range(date_from_str: str | None, date_to_str: str | None):
     
     return d_from, d_to, dt_from, dt_to
 
+def _export_bar(path: str, d_from: date, d_to: date) -> str:
+    return f"<div style='text-align:right; margin-bottom:10px;'>{export_button(path, [('date_from', d_from), ('date_to', d_to)])}</div>"
+
 # --- 1. ОТЧЕТ: Движение средств ---
 @router.get("/admin/reports/cash_flow", response_class=HTMLResponse)
 async def report_cash_flow(
     date_from: str = Query(None),
     date_to: str = Query(None),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_db_session),
+    primary: AsyncSession = Depends(get_db_session),
     username: str = Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(primary)
     d_from, d_to, dt_from, dt_to = await get_date_range(date_from, date_to)
 
-    completed_statuses = await session.execute(select(OrderStatus.id).where(OrderStatus.is_completed_status == True))
-    completed_ids = completed_statuses.scalars().all()
-
+    # Виручка - з денних підсумків (daily_sales), а не з усіх замовлень періоду
     sales_query = select(
-        Order.payment_method,
-        func.sum(Order.total_price)
+        DailySales.payment_method,
+        func.sum(DailySales.revenue)
     ).where(
-        Order.created_at >= dt_from,
-        Order.created_at <= dt_to,
-        Order.status_id.in_(completed_ids)
-    ).group_by(Order.payment_method)
+        DailySales.sale_date.between(d_from, d_to),
+        DailySales.outcome == 'completed'
+    ).group_by(DailySales.payment_method)
 
     sales_res = await session.execute(sales_query)
     sales_data = sales_res.all()
@@ -105,8 +109,7 @@ async def report_cash_flow(
         """
 
     # --- ДОБАВЛЕНО: Таблица отмененных заказов (Прозрачность) ---
-    cancelled_statuses = await session.execute(select(OrderStatus.id).where(OrderStatus.is_cancelled_status == True))
-    canc_ids = cancelled_statuses.scalars().all()
+    canc_ids = (await status_registry.get(primary)).cancelled_ids
     
     canc_query = select(Order).where(
         Order.created_at >= dt_from,
@@ -152,7 +155,7 @@ async def report_cash_flow(
     )
     
     # Добавляем таблицу отмен к основному телу
-    body = body_content + canc_table
+    body = _export_bar("/admin/reports/cash_flow/export", d_from, d_to) + body_content + canc_table
 
     return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
         title="Отчет: Движение средств",
@@ -164,55 +167,56 @@ async def report_cash_flow(
 
 
 # --- 2. ОТЧЕТ: Персонал (Общий) ---
-@router.get("/admin/reports/workers", response_class=HTMLResponse)
-async def report_workers(
-    date_from: str = Query(None),
-    date_to: str = Query(None),
-    session: AsyncSession = Depends(get_db_session),
-    username: str = Depends(check_credentials)
-):
-    settings = await session.get(Settings, 1) or Settings()
-    d_from, d_to, dt_from, dt_to = await get_date_range(date_from, date_to)
-    
-    completed_statuses = await session.execute(select(OrderStatus.id).where(OrderStatus.is_completed_status == True))
-    completed_ids = completed_statuses.scalars().all()
+def _worker_stats_queries(d_from: date, d_to: date):
+    """Курьеры и официанты (только in_house) из дневных итогов daily_sales."""
+    in_period = (
+        DailySales.sale_date.between(d_from, d_to),
+        DailySales.outcome == 'completed'
+    )
 
     # Курьеры
-    courier_stats = await session.execute(
+    couriers = (
         select(
             Employee.full_name,
             Role.name.label("role_name"),
-            func.count(Order.id).label("count"),
-            func.sum(Order.total_price).label("total")
+            func.sum(DailySales.orders_count).label("count"),
+            func.sum(DailySales.revenue).label("total")
         )
-        .join(Employee, Order.completed_by_courier_id == Employee.id)
+        .join(Employee, DailySales.courier_id == Employee.id)
         .join(Role, Employee.role_id == Role.id)
-        .where(
-            Order.created_at >= dt_from,
-            Order.created_at <= dt_to,
-            Order.status_id.in_(completed_ids)
-        )
+        .where(*in_period)
         .group_by(Employee.id, Employee.full_name, Role.name)
     )
     
     # Официанты (только in_house)
-    waiter_stats = await session.execute(
+    waiters = (
         select(
             Employee.full_name,
             Role.name.label("role_name"),
-            func.count(Order.id).label("count"),
-            func.sum(Order.total_price).label("total")
+            func.sum(DailySales.orders_count).label("count"),
+            func.sum(DailySales.revenue).label("total")
         )
-        .join(Employee, Order.accepted_by_waiter_id == Employee.id)
+        .join(Employee, DailySales.waiter_id == Employee.id)
         .join(Role, Employee.role_id == Role.id)
-        .where(
-            Order.created_at >= dt_from,
-            Order.created_at <= dt_to,
-            Order.status_id.in_(completed_ids),
-            Order.order_type == 'in_house'
-        )
+        .where(*in_period, DailySales.order_type == 'in_house')
         .group_by(Employee.id, Employee.full_name, Role.name)
     )
+    return couriers, waiters
+
+@router.get("/admin/reports/workers", response_class=HTMLResponse)
+async def report_workers(
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    session: AsyncSession = Depends(get_read_db_session),
+    primary: AsyncSession = Depends(get_db_session),
+    username: str = Depends(check_credentials)
+):
+    settings = await settings_cache.get(primary)
+    d_from, d_to, dt_from, dt_to = await get_date_range(date_from, date_to)
+    
+    courier_query, waiter_query = _worker_stats_queries(d_from, d_to)
+    courier_stats = await session.execute(courier_query)
+    waiter_stats = await session.execute(waiter_query)
 
     all_stats = list(courier_stats.all()) + list(waiter_stats.all())
     all_stats.sort(key=lambda x: x.total or 0, reverse=True)
@@ -233,7 +237,7 @@ async def report_workers(
         </tr>
         """
 
-    body = ADMIN_REPORT_WORKERS_BODY.format(
+    body = _export_bar("/admin/reports/workers/export", d_from, d_to) + ADMIN_REPORT_WORKERS_BODY.format(
         date_from=d_from,
         date_to=d_to,
         rows=rows or "<tr><td colspan='5'>Нет данных за выбранный период</td></tr>"
@@ -249,30 +253,28 @@ async def report_workers(
 
 
 # --- 3. ОТЧЕТ: Аналитика блюд ---
+def _product_sales_query(d_from: date, d_to: date):
+    return select(
+        DailyProductSales.product_name,
+        func.sum(DailyProductSales.quantity).label("total_qty"),
+        func.sum(DailyProductSales.revenue).label("total_revenue")
+    ).where(
+        DailyProductSales.sale_date.between(d_from, d_to),
+        DailyProductSales.outcome == 'completed'
+    ).group_by(DailyProductSales.product_name).order_by(desc("total_revenue"))
+
 @router.get("/admin/reports/analytics", response_class=HTMLResponse)
 async def report_analytics(
     date_from: str = Query(None),
     date_to: str = Query(None),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_db_session),
+    primary: AsyncSession = Depends(get_db_session),
     username: str = Depends(check_credentials)
 ):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(primary)
     d_from, d_to, dt_from, dt_to = await get_date_range(date_from, date_to)
     
-    completed_statuses = await session.execute(select(OrderStatus.id).where(OrderStatus.is_completed_status == True))
-    completed_ids = completed_statuses.scalars().all()
-
-    query = select(
-        OrderItem.product_name,
-        func.sum(OrderItem.quantity).label("total_qty"),
-        func.sum(OrderItem.quantity * OrderItem.price_at_moment).label("total_revenue")
-    ).join(Order, OrderItem.order_id == Order.id).where(
-        Order.created_at >= dt_from,
-        Order.created_at <= dt_to,
-        Order.status_id.in_(completed_ids)
-    ).group_by(OrderItem.product_name).order_by(desc("total_revenue"))
-
-    res = await session.execute(query)
+    res = await session.execute(_product_sales_query(d_from, d_to))
     data = res.all()
 
     total_period_revenue = sum(row.total_revenue for row in data) if data else Decimal(1)
@@ -300,7 +302,7 @@ async def report_analytics(
         </tr>
         """
 
-    body = ADMIN_REPORT_ANALYTICS_BODY.format(
+    body = _export_bar("/admin/reports/analytics/export", d_from, d_to) + ADMIN_REPORT_ANALYTICS_BODY.format(
         date_from=d_from,
         date_to=d_to,
         rows=rows or "<tr><td colspan='5'>Нет продаж за выбранный период</td></tr>"
@@ -316,37 +318,35 @@ async def report_analytics(
 
 
 # --- 4. НОВЫЙ ИНФОРМАТИВНЫЙ ОТЧЕТ: Курьеры ---
+def _courier_report_query(d_from: date, d_to: date):
+    # Только завершенные заказы (денні підсумки daily_sales)
+    # Запрос с разбивкой по методам оплаты (Cash vs Card) и общим итогам
+    return select(
+        Employee.full_name,
+        func.sum(DailySales.orders_count).label("total_orders"),
+        func.sum(DailySales.revenue).label("total_revenue"),
+        func.sum(case((DailySales.payment_method == 'cash', DailySales.revenue), else_=0)).label("cash_total"),
+        func.sum(case((DailySales.payment_method == 'card', DailySales.revenue), else_=0)).label("card_total")
+    ).join(
+        Employee, DailySales.courier_id == Employee.id
+    ).where(
+        DailySales.sale_date.between(d_from, d_to),
+        DailySales.outcome == 'completed'
+    ).group_by(Employee.id, Employee.full_name).order_by(desc("total_orders"))
+
 @router.get("/admin/reports/couriers", response_class=HTMLResponse)
 async def report_couriers(
     date_from: str = Query(None),
     date_to: str = Query(None),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_db_session),
+    primary: AsyncSession = Depends(get_db_session),
     username: str = Depends(check_credentials)
 ):
     """Расширенный отчет по эффективности курьеров."""
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(primary)
     d_from, d_to, dt_from, dt_to = await get_date_range(date_from, date_to)
     
-    # Только завершенные заказы
-    completed_statuses = await session.execute(select(OrderStatus.id).where(OrderStatus.is_completed_status == True))
-    completed_ids = completed_statuses.scalars().all()
-
-    # Запрос с разбивкой по методам оплаты (Cash vs Card) и общим итогам
-    query = select(
-        Employee.full_name,
-        func.count(Order.id).label("total_orders"),
-        func.sum(Order.total_price).label("total_revenue"),
-        func.sum(case((Order.payment_method == 'cash', Order.total_price), else_=0)).label("cash_total"),
-        func.sum(case((Order.payment_method == 'card', Order.total_price), else_=0)).label("card_total")
-    ).join(
-        Employee, Order.completed_by_courier_id == Employee.id
-    ).where(
-        Order.created_at >= dt_from,
-        Order.created_at <= dt_to,
-        Order.status_id.in_(completed_ids)
-    ).group_by(Employee.id, Employee.full_name).order_by(desc("total_orders"))
-
-    res = await session.execute(query)
+    res = await session.execute(_courier_report_query(d_from, d_to))
     courier_data = res.all()
 
     rows = ""
@@ -411,7 +411,7 @@ async def report_couriers(
     </div>
     """
 
-    body = COURIER_REPORT_TEMPLATE.format(
+    body = _export_bar("/admin/reports/couriers/export", d_from, d_to) + COURIER_REPORT_TEMPLATE.format(
         date_from_val=d_from,
         date_to_val=d_to,
         rows=rows,
@@ -424,4 +424,85 @@ async def report_couriers(
         site_title=settings.site_title,
         reports_active="active",
         **{k: "" for k in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "settings_active", "design_active", "inventory_active"]}
-    ))
\ No newline at end of file
+    ))
+
+
+# --- ЭКСПОРТ CSV (потоково, из реплики) ---
+TRANSACTION_TYPE_LABELS = {'in': "Внесение", 'out': "Расход/Изъятие", 'handover': "Сдача выручки"}
+
+@router.get("/admin/reports/cash_flow/export")
+async def export_cash_flow(
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    username: str = Depends(check_credentials)
+):
+    d_from, d_to, dt_from, dt_to = await get_date_range(date_from, date_to)
+    query = select(
+        CashTransaction.created_at,
+        CashTransaction.transaction_type,
+        CashTransaction.amount,
+        Employee.full_name,
+        CashTransaction.comment
+    ).outerjoin(CashShift, CashTransaction.shift_id == CashShift.id).outerjoin(
+        Employee, CashShift.employee_id == Employee.id
+    ).where(
+        CashTransaction.created_at >= dt_from,
+        CashTransaction.created_at <= dt_to
+    ).order_by(CashTransaction.created_at)
+
+    def row_fn(row):
+        created_at, tx_type, amount, emp_name, comment = row
+        return (created_at.strftime('%d.%m.%Y %H:%M'), TRANSACTION_TYPE_LABELS.get(tx_type, tx_type), amount, emp_name or "Система", comment)
+
+    return csv_response(
+        export_filename("cash_flow", d_from, d_to),
+        ["Дата", "Тип", "Сумма", "Сотрудник", "Комментарий"],
+        stream_query(query, row_fn)
+    )
+
+@router.get("/admin/reports/workers/export")
+async def export_workers(
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    username: str = Depends(check_credentials)
+):
+    d_from, d_to, _, _ = await get_date_range(date_from, date_to)
+    courier_query, waiter_query = _worker_stats_queries(d_from, d_to)
+
+    def row_fn(row):
+        total = row.total or Decimal(0)
+        count = row.count or 0
+        return (row.full_name, row.role_name, count, total, (total / count).quantize(Decimal("0.01")) if count else 0)
+
+    return csv_response(
+        export_filename("workers", d_from, d_to),
+        ["Сотрудник", "Роль", "Заказов", "Сумма", "Средний чек"],
+        stream_query(courier_query, row_fn),
+        stream_query(waiter_query, row_fn)
+    )
+
+@router.get("/admin/reports/analytics/export")
+async def export_analytics(
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    username: str = Depends(check_credentials)
+):
+    d_from, d_to, _, _ = await get_date_range(date_from, date_to)
+    return csv_response(
+        export_filename("analytics", d_from, d_to),
+        ["Блюдо", "Количество", "Выручка"],
+        stream_query(_product_sales_query(d_from, d_to))
+    )
+
+@router.get("/admin/reports/couriers/export")
+async def export_couriers(
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    username: str = Depends(check_credentials)
+):
+    d_from, d_to, _, _ = await get_date_range(date_from, date_to)
+    return csv_response(
+        export_filename("couriers", d_from, d_to),
+        ["Курьер", "Заказов", "Выручка", "Наличные", "Карта"],
+        stream_query(_courier_report_query(d_from, d_to))
+    )
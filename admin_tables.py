@@ -10,9 +10,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
-from models import Table, Employee, Role, Settings
+from models import Table, Employee, Role
 from templates import ADMIN_HTML_TEMPLATE, ADMIN_TABLES_BODY
 from dependencies import get_db_session, check_credentials
+from settings_cache import settings_cache
 
 router = APIRouter()
 
@@ -23,7 +24,7 @@ async def admin_tables_list(
     username: str = Depends(check_credentials)
 ):
     """Відображає сторінку управління столиками."""
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     tables_res = await session.execute(
         select(Table).options(
@@ -48,6 +48,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_staff_token(token: Optional[str]) -> Optional[int]:
+    """Возвращает ID сотрудника из JWT токена или None, если токен невалиден."""
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = payload.get("sub")
+        return int(user_id) if user_id is not None else None
+    except (JWTError, ValueError):
+        return None
+
 # --- ЗАВИСИМОСТИ (DEPENDENCIES) ---
 
 async def get_current_staff(
@@ -7,6 +7,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, desc, update
 from sqlalchemy.orm import joinedload
 from models import CashShift, CashTransaction, Order, Employee, BalanceHistory
+from status_registry import status_registry
 
 logger = logging.getLogger(__name__)
 
@@ -33,9 +34,7 @@ async def attach_orphaned_orders(session: AsyncSession, shift_id: int):
     Це виправляє проблему втрати виручки, якщо замовлення було закрито, коли каса не працювала.
     """
     # Знаходимо ID статусів, які вважаються завершеними (успішними)
-    from models import OrderStatus
-    completed_statuses = await session.execute(select(OrderStatus.id).where(OrderStatus.is_completed_status == True))
-    completed_ids = completed_statuses.scalars().all()
+    completed_ids = (await status_registry.get(session)).completed_ids
     
     if not completed_ids:
         return
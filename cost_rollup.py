@@ -0,0 +1,221 @@
+# cost_rollup.py
+
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from inventory_models import Ingredient, IngredientRecipeItem, TechCard, TechCardItem
+from models import async_session_maker
+from event_bus import event_bus, ALL_CACHES
+
+logger = logging.getLogger(__name__)
+
+# Більше ID в одній події не передаємо - іншим воркерам простіше перебудувати граф
+ROLLUP_EVENT_MAX_IDS = 500
+
+
+def _dec(value) -> Decimal:
+    return Decimal(str(value or 0))
+
+
+class CostRollup:
+    """
+    Собівартість інгредієнтів і страв, розгорнута по графу
+    сировина -> напівфабрикат (IngredientRecipeItem) -> техкарта.
+    - Напівфабрикат з рецептом коштує суму складових (рекурсивно), без рецепту - current_cost.
+    - Після зміни current_cost (прихід) перераховуються лише предки змінених інгредієнтів
+      і техкарти, які від них залежать.
+    - Зміна структури (рецепти, техкарти) - invalidate(), граф перебудовується при наступному get().
+    """
+
+    def __init__(self):
+        self.version: int = 1
+        self._built_version: int = 0
+        self._lock = asyncio.Lock()
+
+        self._own_cost: Dict[int, Decimal] = {}
+        self._children: Dict[int, List[Tuple[int, Decimal]]] = {}
+        self._parents: Dict[int, Set[int]] = {}
+        self._components: Dict[int, List[Tuple[int, Decimal, bool]]] = {}
+        self._products_by_ingredient: Dict[int, Set[int]] = {}
+
+        self._ingredient_cost: Dict[int, Decimal] = {}
+        # product_id -> (у залі, на винос)
+        self._product_cost: Dict[int, Tuple[Decimal, Decimal]] = {}
+        # Фонові перерахунки після commit: сильні посилання, щоб задачу не зібрав GC
+        self._refresh_tasks: Set[asyncio.Task] = set()
+
+    def invalidate(self, broadcast: bool = True):
+        """Викликати ПІСЛЯ commit змін рецептів напівфабрикатів або техкарт."""
+        self.version += 1
+        if broadcast:
+            event_bus.publish_nowait("cache_invalidate", {"cache": "cost_rollup"})
+
+    async def get(self, session: AsyncSession) -> "CostRollup":
+        if self._built_version == self.version:
+            return self
+
+        async with self._lock:
+            if self._built_version == self.version:
+                return self
+
+            version = self.version
+            costs = (await session.execute(select(Ingredient.id, Ingredient.current_cost))).all()
+            recipe = (await session.execute(
+                select(IngredientRecipeItem.parent_ingredient_id, IngredientRecipeItem.child_ingredient_id, IngredientRecipeItem.gross_amount)
+            )).all()
+            components = (await session.execute(
+                select(TechCard.product_id, TechCardItem.ingredient_id, TechCardItem.gross_amount, TechCardItem.is_takeaway)
+                .join(TechCardItem, TechCardItem.tech_card_id == TechCard.id)
+            )).all()
+
+            self._own_cost = {ing_id: _dec(cost) for ing_id, cost in costs}
+            self._children = {}
+            self._parents = {}
+            for parent_id, child_id, gross in recipe:
+                self._children.setdefault(parent_id, []).append((child_id, _dec(gross)))
+                self._parents.setdefault(child_id, set()).add(parent_id)
+            self._components = {}
+            self._products_by_ingredient = {}
+            for product_id, ing_id, gross, is_takeaway in components:
+                self._components.setdefault(product_id, []).append((ing_id, _dec(gross), bool(is_takeaway)))
+                self._products_by_ingredient.setdefault(ing_id, set()).add(product_id)
+
+            self._ingredient_cost = {}
+            for ing_id in self._own_cost:
+                self._rollup(ing_id, set())
+            self._product_cost = {}
+            for product_id in self._components:
+                self._rollup_product(product_id)
+
+            self._built_version = version
+            logger.info(f"Собівартість розгорнуто (версія {version}): {len(self._own_cost)} інгредієнтів, {len(self._components)} техкарт")
+            return self
+
+    def _rollup(self, ing_id: int, visiting: Set[int]) -> Decimal:
+        cached = self._ingredient_cost.get(ing_id)
+        if cached is not None:
+            return cached
+        children = self._children.get(ing_id)
+        if not children or ing_id in visiting:
+            # Сировина, напівфабрикат без рецепту або цикл у рецептах
+            cost = self._own_cost.get(ing_id, Decimal(0))
+        else:
+            visiting.add(ing_id)
+            cost = sum((gross * self._rollup(child_id, visiting) for child_id, gross in children), Decimal(0))
+            visiting.discard(ing_id)
+        self._ingredient_cost[ing_id] = cost
+        return cost
+
+    def _rollup_product(self, product_id: int):
+        in_house = takeaway = Decimal(0)
+        for ing_id, gross, is_takeaway in self._components.get(product_id, ()):
+            sub = gross * self.ingredient_cost(ing_id)
+            takeaway += sub
+            if not is_takeaway:
+                in_house += sub
+        self._product_cost[product_id] = (in_house, takeaway)
+
+    def _ancestors(self, ingredient_ids: Iterable[int]) -> Set[int]:
+        affected: Set[int] = set()
+        stack = list(ingredient_ids)
+        while stack:
+            ing_id = stack.pop()
+            if ing_id in affected:
+                continue
+            affected.add(ing_id)
+            stack.extend(self._parents.get(ing_id, ()))
+        return affected
+
+    def apply_costs(self, costs: Dict[int, Decimal]):
+        """Нові current_cost: перерахунок лише залежних вузлів."""
+        if not costs:
+            return
+        if self._built_version != self.version:
+            # Граф ще будується (або застарів) - нехай наступний get() перечитає все
+            self.version += 1
+            return
+        self._own_cost.update(costs)
+
+        affected = self._ancestors(costs.keys())
+        for ing_id in affected:
+            self._ingredient_cost.pop(ing_id, None)
+        for ing_id in affected:
+            self._rollup(ing_id, set())
+
+        products: Set[int] = set()
+        for ing_id in affected:
+            products.update(self._products_by_ingredient.get(ing_id, ()))
+        for product_id in products:
+            self._rollup_product(product_id)
+
+    def refresh_ingredients_nowait(self, ingredient_ids: Iterable[int]):
+        task = asyncio.create_task(self.refresh_ingredients(ingredient_ids))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._refresh_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Собівартість: помилка перерахунку цін: {task.exception()}", exc_info=task.exception())
+
+    async def refresh_ingredients(self, ingredient_ids: Iterable[int]):
+        """Перечитує current_cost вказаних інгредієнтів з БД і оновлює граф."""
+        ids = list(ingredient_ids)
+        if not ids:
+            return
+        async with async_session_maker() as session:
+            rows = await session.execute(select(Ingredient.id, Ingredient.current_cost).where(Ingredient.id.in_(ids)))
+            self.apply_costs({ing_id: _dec(cost) for ing_id, cost in rows.all()})
+
+    def ingredient_cost(self, ingredient_id: int) -> Decimal:
+        cost = self._ingredient_cost.get(ingredient_id)
+        return cost if cost is not None else self._own_cost.get(ingredient_id, Decimal(0))
+
+    def product_cost(self, product_id: int, takeaway: bool = True) -> Decimal:
+        """Собівартість порції за техкартою; takeaway=True - разом з упаковкою "на винос"."""
+        in_house_cost, takeaway_cost = self._product_cost.get(product_id, (Decimal(0), Decimal(0)))
+        return takeaway_cost if takeaway else in_house_cost
+
+    def has_recipe(self, ingredient_id: int) -> bool:
+        return bool(self._children.get(ingredient_id))
+
+
+def notify_costs_changed(ingredient_ids: Iterable[int]):
+    """
+    Викликати ПІСЛЯ commit зміни current_cost: граф цього процесу перечитує ціни
+    вказаних інгредієнтів, інші воркери отримують подію cost_changed.
+    """
+    ids = sorted(set(ingredient_ids))
+    if not ids:
+        return
+    if len(ids) > ROLLUP_EVENT_MAX_IDS:
+        cost_rollup.invalidate()
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    cost_rollup.refresh_ingredients_nowait(ids)
+    event_bus.publish_nowait("cost_changed", {"ingredient_ids": ids})
+
+
+# Глобальний екземпляр
+cost_rollup = CostRollup()
+
+
+def _on_remote_invalidate(payload: dict):
+    if payload.get("cache") in ("cost_rollup", ALL_CACHES):
+        cost_rollup.invalidate(broadcast=False)
+
+
+async def _on_remote_costs(payload: dict):
+    await cost_rollup.refresh_ingredients(payload.get("ingredient_ids") or [])
+
+
+event_bus.subscribe("cache_invalidate", _on_remote_invalidate)
+event_bus.subscribe("cost_changed", _on_remote_costs)
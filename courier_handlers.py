@@ -10,7 +10,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.filters import CommandStart
 from aiogram.exceptions import TelegramBadRequest
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload, selectinload
 from typing import Dict, Any, Optional, List
 from urllib.parse import quote_plus
@@ -20,6 +20,9 @@ from decimal import Decimal
 
 # Импорт моделей
 from models import Employee, Order, OrderStatus, Settings, OrderStatusHistory, Table, Category, Product, OrderItem
+from status_registry import status_registry, STATUS_NEW, STATUS_PROCESSING
+from table_service import get_waiter_tables_occupancy
+from shift_roster import shift_roster
 # Импорт модификаторов
 from inventory_models import Modifier
 from notification_manager import notify_new_order_to_staff, notify_all_parties_on_status_change, notify_station_completion
@@ -127,8 +130,7 @@ async def show_workshop_orders(message_or_callback: Message | CallbackQuery, ses
         return await message.answer("❌ За вами не закріплено жодного цеху. Зверніться до адміністратора для налаштування прав.")
 
     # Статуси "В роботі"
-    statuses_res = await session.execute(select(OrderStatus.id).where(OrderStatus.requires_kitchen_notify == True))
-    status_ids = statuses_res.scalars().all()
+    status_ids = (await status_registry.get(session)).kitchen_notify_ids
 
     orders_res = await session.execute(
         select(Order)
@@ -196,10 +198,7 @@ async def show_courier_orders(message_or_callback: Message | CallbackQuery, sess
     if not employee or not employee.role.can_be_assigned:
          return await message.answer("❌ У вас немає прав кур'єра.")
 
-    final_statuses_res = await session.execute(
-        select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True))
-    )
-    final_status_ids = final_statuses_res.scalars().all()
+    final_status_ids = (await status_registry.get(session)).final_ids
 
     orders_res = await session.execute(
         select(Order).options(joinedload(Order.status)).where(
@@ -252,10 +251,7 @@ async def show_waiter_tables(message_or_callback: Message | CallbackQuery, sessi
         text_off = "🔴 Ви не на зміні."
         return await message.answer(text_off) if not is_callback else message_or_callback.answer(text_off, show_alert=True)
 
-    tables_res = await session.execute(
-        select(Table).where(Table.assigned_waiters.any(Employee.id == employee.id)).order_by(Table.name)
-    )
-    tables = tables_res.scalars().all()
+    tables = await get_waiter_tables_occupancy(session, employee.id)
 
     text = "🍽 <b>Закріплені за вами столики:</b>\n\n"
     kb = InlineKeyboardBuilder()
@@ -263,7 +259,11 @@ async def show_waiter_tables(message_or_callback: Message | CallbackQuery, sessi
         text += "За вами не закріплено жодного столика."
     else:
         for table in tables:
-            kb.add(InlineKeyboardButton(text=f"Столик: {html_module.escape(table.name)}", callback_data=f"waiter_view_table_{table.id}"))
+            if table.active_count > 0:
+                label = f"🔴 Столик: {table.name} ({table.active_count} · {table.open_total:.2f} грн)"
+            else:
+                label = f"🟢 Столик: {table.name}"
+            kb.add(InlineKeyboardButton(text=label, callback_data=f"waiter_view_table_{table.id}"))
     kb.adjust(1)
     
     try:
@@ -332,10 +332,7 @@ async def _generate_waiter_order_view(order: Order, session: AsyncSession):
     if not order.accepted_by_waiter_id:
         kb.row(InlineKeyboardButton(text="✅ Прийняти це замовлення", callback_data=f"waiter_accept_order_{order.id}"))
 
-    statuses_res = await session.execute(
-        select(OrderStatus).where(OrderStatus.visible_to_waiter == True).order_by(OrderStatus.id)
-    )
-    statuses = statuses_res.scalars().all()
+    statuses = (await status_registry.get(session)).visible_to("waiter")
     status_buttons = [
         InlineKeyboardButton(text=f"{'✅ ' if s.id == order.status_id else ''}{s.name}", callback_data=f"staff_set_status_{order.id}_{s.id}")
         for s in statuses
@@ -392,6 +389,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
         if is_allowed:
             employee.telegram_user_id = message.from_user.id
             await session.commit()
+            shift_roster.invalidate()
             await state.clear()
             
             keyboard = get_staff_keyboard(employee)
@@ -415,6 +413,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
         
         employee.is_on_shift = is_start
         await session.commit()
+        shift_roster.invalidate()
         
         action = "почали" if is_start else "завершили"
         
@@ -439,6 +438,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
             employee.telegram_user_id = None
             employee.is_on_shift = False
             await session.commit()
+            shift_roster.invalidate()
             await message.answer("👋 Ви вийшли з системи.", reply_markup=get_staff_login_keyboard())
         else:
             await message.answer("❌ Ви не авторизовані.")
@@ -525,8 +525,8 @@ def register_courier_handlers(dp_admin: Dispatcher):
                 f"Сума: {order.total_price} грн{pay_info}\n\n")
         
         kb = InlineKeyboardBuilder()
-        statuses_res = await session.execute(select(OrderStatus).where(OrderStatus.visible_to_courier == True).order_by(OrderStatus.id))
-        status_buttons = [InlineKeyboardButton(text=status.name, callback_data=f"staff_set_status_{order.id}_{status.id}") for status in statuses_res.scalars().all()]
+        courier_statuses = (await status_registry.get(session)).visible_to("courier")
+        status_buttons = [InlineKeyboardButton(text=status.name, callback_data=f"staff_set_status_{order.id}_{status.id}") for status in courier_statuses]
         kb.row(*status_buttons)
         
         if order.is_delivery and order.address:
@@ -647,8 +647,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
         table = await session.get(Table, table_id)
         if not table: return await callback.answer("Столик не знайдено!", show_alert=True)
 
-        final_statuses_res = await session.execute(select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True)))
-        final_statuses = final_statuses_res.scalars().all()
+        final_statuses = (await status_registry.get(session)).final_ids
         
         active_orders_res = await session.execute(select(Order).where(Order.table_id == table_id, Order.status_id.not_in(final_statuses)).options(joinedload(Order.status)))
         active_orders = active_orders_res.scalars().all()
@@ -700,7 +699,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
             return await callback.answer("Вже прийнято іншим.", show_alert=True)
 
         order.accepted_by_waiter_id = employee.id
-        processing_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "В обробці").limit(1))
+        processing_status = (await status_registry.get(session)).by_name(STATUS_PROCESSING)
         if processing_status:
             order.status_id = processing_status.id
             session.add(OrderStatusHistory(order_id=order.id, status_id=processing_status.id, actor_info=f"Офіціант: {employee.full_name}"))
@@ -991,7 +990,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
         if not items_to_create:
              return await callback.answer("Помилка: товари не знайдено.", show_alert=True)
         
-        new_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "Новий").limit(1))
+        new_status = (await status_registry.get(session)).by_name(STATUS_NEW)
         status_id = new_status.id if new_status else 1
 
         order = Order(
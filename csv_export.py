@@ -0,0 +1,85 @@
+# csv_export.py
+
+import csv
+import io
+import re
+from typing import AsyncIterator, Callable, Iterable, Optional, Sequence
+from urllib.parse import urlencode
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy.sql import Select
+
+from models import replica_session_maker, DB_REPORT_STATEMENT_TIMEOUT_MS
+
+# Рядків на один FETCH серверного курсора
+EXPORT_YIELD_PER = 1000
+# Скільки рядків CSV накопичувати перед відправкою частини відповіді
+EXPORT_FLUSH_ROWS = 500
+# Excel з українською/російською локаллю очікує ";" як роздільник
+CSV_DELIMITER = ";"
+# З цих символів Excel/LibreOffice починають формулу: такі текстові клітинки екрануємо апострофом
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# Телефон чи число зі знаком (+380 50 123-45-67, -12.50): без літер формулу не викликати, лишаємо як є
+_PLAIN_NUMBER = re.compile(r"[+-]?[\d\s().,-]+")
+
+
+async def stream_query(stmt: Select, row_fn: Optional[Callable[[Sequence], Sequence]] = None) -> AsyncIterator[Sequence]:
+    """
+    Рядки запиту через серверний курсор (yield_per): у пам'яті лише поточна частина.
+    Сесія відкривається тут, а не через Depends - сесія залежності закривається
+    раніше, ніж StreamingResponse дочитає генератор.
+    """
+    async with replica_session_maker() as session:
+        session.info["statement_timeout_ms"] = DB_REPORT_STATEMENT_TIMEOUT_MS
+        result = await session.stream(stmt.execution_options(yield_per=EXPORT_YIELD_PER))
+        async for partition in result.partitions():
+            for row in partition:
+                yield row_fn(row) if row_fn else tuple(row)
+
+
+def _csv_cell(value):
+    """Клітинка CSV: None - порожньо, текст, схожий на формулу (ім'я, коментар клієнта), - з ' попереду."""
+    if value is None:
+        return ""
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES) and not _PLAIN_NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def csv_response(filename: str, header: Sequence[str], *sources: AsyncIterator[Sequence]) -> StreamingResponse:
+    """Потокова CSV-відповідь (UTF-8 з BOM, щоб Excel правильно відкрив кирилицю)."""
+
+    async def body():
+        buf = io.StringIO()
+        writer = csv.writer(buf, delimiter=CSV_DELIMITER)
+        buf.write("\ufeff")
+        writer.writerow(header)
+        pending = 0
+        for rows in sources:
+            async for row in rows:
+                writer.writerow([_csv_cell(value) for value in row])
+                pending += 1
+                if pending >= EXPORT_FLUSH_ROWS:
+                    yield buf.getvalue().encode("utf-8")
+                    buf.seek(0)
+                    buf.truncate()
+                    pending = 0
+        yield buf.getvalue().encode("utf-8")
+
+    return StreamingResponse(
+        body(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def export_filename(prefix: str, *parts) -> str:
+    suffix = "_".join(str(p) for p in parts if p)
+    return f"{prefix}_{suffix}.csv" if suffix else f"{prefix}.csv"
+
+
+def export_button(path: str, params: Optional[Iterable] = None) -> str:
+    """Кнопка завантаження CSV з тими ж фільтрами, що й у звіті."""
+    query = urlencode([(k, v) for k, v in (params or []) if v not in (None, "")])
+    href = f"{path}?{query}" if query else path
+    return f'<a href="{href}" class="button-sm secondary"><i class="fa-solid fa-file-csv"></i> CSV</a>'
@@ -0,0 +1,159 @@
+# db_metrics.py
+
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.routing import Match
+
+# Маршрут поточного HTTP-запиту (ставить middleware у main.py); фонові задачі - "background"
+current_route: ContextVar[str] = ContextVar("db_current_route", default="background")
+
+# Межі кошиків гістограми, мс
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Одна мітка для запитів, що не збіглися з жодним маршрутом (404, сканери)
+UNMATCHED_ROUTE = "unmatched"
+
+
+def route_label(routes: Iterable, scope: dict) -> str:
+    """
+    Шаблон маршруту, під який потрапляє запит (/admin/order/manage/{order_id}, /menu/table/{access_token}),
+    а не сирий шлях: кількість міток обмежена кількістю маршрутів застосунку.
+    Middleware працює до маршрутизації, тому збіг шукається так само, як це робить Starlette.
+    """
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", None) or UNMATCHED_ROUTE
+    return UNMATCHED_ROUTE
+
+
+class LatencyHistogram:
+    """Гістограма з фіксованими кошиками: пам'ять не росте з кількістю спостережень."""
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect_left(HISTOGRAM_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+
+    def quantile(self, q: float) -> float:
+        """Верхня межа кошика, в який потрапляє квантиль (мс)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return float(HISTOGRAM_BUCKETS_MS[i]) if i < len(HISTOGRAM_BUCKETS_MS) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{b}": n for b, n in zip(HISTOGRAM_BUCKETS_MS, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.quantile(0.50),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class DbMetrics:
+    """Очікування з'єднання з пулу і час запитів до БД - окремо для кожного маршруту."""
+
+    def __init__(self):
+        self.checkout_wait: Dict[str, LatencyHistogram] = {}
+        self.query_time: Dict[str, LatencyHistogram] = {}
+        self.pool_timeouts = 0
+
+    def observe_checkout(self, seconds: float):
+        route = current_route.get()
+        hist = self.checkout_wait.get(route)
+        if hist is None:
+            hist = self.checkout_wait[route] = LatencyHistogram()
+        hist.observe(seconds)
+
+    def observe_query(self, seconds: float):
+        route = current_route.get()
+        hist = self.query_time.get(route)
+        if hist is None:
+            hist = self.query_time[route] = LatencyHistogram()
+        hist.observe(seconds)
+
+    def snapshot(self, engines: Optional[Dict[str, Any]] = None) -> dict:
+        routes = sorted(set(self.checkout_wait) | set(self.query_time))
+        data = {
+            "pool_timeouts": self.pool_timeouts,
+            "routes": {
+                route: {
+                    "checkout_wait": self.checkout_wait[route].snapshot() if route in self.checkout_wait else None,
+                    "query_time": self.query_time[route].snapshot() if route in self.query_time else None,
+                }
+                for route in routes
+            },
+        }
+        data["pools"] = {}
+        for name, engine in (engines or {}).items():
+            pool = engine.sync_engine.pool
+            data["pools"][name] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "idle": pool.checkedin(),
+            }
+        return data
+
+
+# Глобальний екземпляр
+db_metrics = DbMetrics()
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """Пул, що вимірює час очікування вільного з'єднання (включно з відкриттям нового)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            db_metrics.pool_timeouts += 1
+            raise
+        finally:
+            db_metrics.observe_checkout(time.perf_counter() - started)
+
+
+def instrument_engine(engine):
+    """Час виконання кожного запиту - через події курсора синхронного ядра engine."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("db_metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("db_metrics_started")
+        if started:
+            db_metrics.observe_query(time.perf_counter() - started.pop())
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        started = conn.info.get("db_metrics_started") if conn is not None else None
+        if started:
+            db_metrics.observe_query(time.perf_counter() - started.pop())
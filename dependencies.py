@@ -7,7 +7,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from models import async_session_maker
+from models import async_session_maker, replica_session_maker, DB_STATEMENT_TIMEOUT_MS, DB_REPORT_STATEMENT_TIMEOUT_MS
 
 security = HTTPBasic()
 
@@ -38,4 +38,16 @@ def check_credentials(credentials: HTTPBasicCredentials = Depends(security)):
 async def get_db_session() -> Generator[AsyncSession, None, None]:
     """Створює та надає сесію бази даних для ендпоінта."""
     async with async_session_maker() as session:
+        # Запит ендпоінта не може тримати з'єднання довше DB_STATEMENT_TIMEOUT_MS
+        session.info["statement_timeout_ms"] = DB_STATEMENT_TIMEOUT_MS
+        yield session
+
+async def get_read_db_session() -> Generator[AsyncSession, None, None]:
+    """
+    Сесія для звітів лише на читання: репліка (DATABASE_REPLICA_URL) або primary, якщо репліки немає.
+    Дані можуть відставати на лаг реплікації. Тому кеші довідників (settings_cache, status_registry,
+    cost_rollup) завантажуються через звичайну get_db_session, щоб не закешувати застарілий стан.
+    """
+    async with replica_session_maker() as session:
+        session.info["statement_timeout_ms"] = DB_REPORT_STATEMENT_TIMEOUT_MS
         yield session
\ No newline at end of file
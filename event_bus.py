@@ -0,0 +1,197 @@
+# event_bus.py
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Union
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Union[None, Awaitable[None]]]
+
+# Ліміт payload у Postgres NOTIFY - 8000 байт
+PG_NOTIFY_MAX_BYTES = 7900
+
+# cache_invalidate з cache=ALL_CACHES - скинути всі кеші процесу
+ALL_CACHES = "*"
+# Локальна подія після (пере)підключення до брокера: події, надіслані під час розриву, втрачено
+BUS_RECONNECTED = "bus_reconnected"
+
+
+class EventBus:
+    """
+    Шина подій між воркерами (uvicorn --workers N).
+    publish() надсилає подію ІНШИМ воркерам - локальну доставку робить сам відправник.
+    Отримані події передаються обробникам, зареєстрованим через subscribe(kind, handler).
+    """
+
+    def __init__(self):
+        # ID процесу: свої ж повідомлення, що повернулися з брокера, ігноруємо
+        self.origin = uuid.uuid4().hex
+        self._handlers: Dict[str, List[Handler]] = {}
+        # Сильні посилання на фонові задачі: event loop тримає їх лише слабко
+        self._tasks: Set[asyncio.Task] = set()
+
+    def subscribe(self, kind: str, handler: Handler):
+        self._handlers.setdefault(kind, []).append(handler)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, kind: str, payload: dict):
+        pass
+
+    def fits(self, kind: str, payload: dict) -> bool:
+        """Чи пройде подія через брокер без обрізання (локальна шина обмежень не має)."""
+        return True
+
+    def publish_nowait(self, kind: str, payload: dict):
+        """Для синхронного коду (наприклад, invalidate() кешів) всередині event loop."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._spawn(self.publish(kind, payload))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"EventBus: помилка фонової задачі: {task.exception()}", exc_info=task.exception())
+
+    def _encode(self, kind: str, payload: dict) -> str:
+        return json.dumps({"o": self.origin, "k": kind, "p": payload}, ensure_ascii=False, separators=(",", ":"))
+
+    async def _dispatch(self, raw: str):
+        try:
+            envelope = json.loads(raw)
+        except ValueError:
+            logger.warning("EventBus: некоректне повідомлення")
+            return
+        if envelope.get("o") == self.origin:
+            return
+        await self.dispatch_local(envelope.get("k"), envelope.get("p") or {})
+
+    async def dispatch_local(self, kind: str, payload: dict):
+        """Викликає обробники цього процесу без надсилання іншим воркерам."""
+        for handler in self._handlers.get(kind, []):
+            try:
+                result = handler(payload)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"EventBus: помилка обробника '{kind}': {e}", exc_info=True)
+
+
+class LocalEventBus(EventBus):
+    """Один процес: іншим воркерам надсилати нічого."""
+
+
+class PostgresEventBus(EventBus):
+    """
+    Postgres LISTEN/NOTIFY через окремі з'єднання asyncpg (поза пулом SQLAlchemy).
+    Одне з'єднання слухає канал, друге надсилає pg_notify.
+    """
+
+    CHANNEL = "app_events"
+    RECONNECT_DELAY = 5
+
+    def __init__(self, dsn: str):
+        super().__init__()
+        self.dsn = dsn
+        self._listen_conn = None
+        self._publish_conn = None
+        self._publish_lock = asyncio.Lock()
+        self._watchdog: Optional[asyncio.Task] = None
+
+    async def start(self):
+        # Watchdog запускається і тоді, коли перше підключення не вдалося: він і підключить шину
+        self._watchdog = asyncio.create_task(self._watch())
+        try:
+            await self._connect()
+        except Exception as e:
+            await self._close_connections()
+            logger.error(f"EventBus: не вдалося підключитися, повтор через {self.RECONNECT_DELAY} с: {e}")
+
+    async def stop(self):
+        if self._watchdog:
+            self._watchdog.cancel()
+        await self._close_connections()
+
+    async def _connect(self):
+        import asyncpg
+
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        await self._listen_conn.add_listener(self.CHANNEL, self._on_notify)
+        self._publish_conn = await asyncpg.connect(self.dsn)
+        logger.info("EventBus: підключено до Postgres LISTEN/NOTIFY")
+        # NOTIFY, що прийшли без слухача, втрачено: кеші без TTL скидаємо, клієнтам - повна синхронізація
+        await self.dispatch_local("cache_invalidate", {"cache": ALL_CACHES})
+        await self.dispatch_local(BUS_RECONNECTED, {})
+
+    async def _watch(self):
+        # Перепідключення після обриву з'єднання з БД
+        while True:
+            await asyncio.sleep(self.RECONNECT_DELAY)
+            if self._listen_conn is not None and not self._listen_conn.is_closed() \
+                    and self._publish_conn is not None and not self._publish_conn.is_closed():
+                continue
+            logger.warning("EventBus: з'єднання втрачено, перепідключення...")
+            await self._close_connections()
+            try:
+                await self._connect()
+            except Exception as e:
+                logger.error(f"EventBus: не вдалося перепідключитися: {e}")
+
+    async def _close_connections(self):
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None and not conn.is_closed():
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+        self._listen_conn = None
+        self._publish_conn = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._spawn(self._dispatch(payload))
+
+    def fits(self, kind: str, payload: dict) -> bool:
+        return len(self._encode(kind, payload).encode("utf-8")) <= PG_NOTIFY_MAX_BYTES
+
+    async def publish(self, kind: str, payload: dict):
+        raw = self._encode(kind, payload)
+        if len(raw.encode("utf-8")) > PG_NOTIFY_MAX_BYTES:
+            logger.error(f"EventBus: подія '{kind}' завелика для NOTIFY, доставлено лише локально")
+            return
+        conn = self._publish_conn
+        if conn is None or conn.is_closed():
+            logger.warning(f"EventBus: немає з'єднання, подія '{kind}' доставлена лише локально")
+            return
+        try:
+            async with self._publish_lock:
+                await conn.execute("SELECT pg_notify($1, $2)", self.CHANNEL, raw)
+        except Exception as e:
+            logger.error(f"EventBus: помилка NOTIFY: {e}")
+
+
+def _create_event_bus() -> EventBus:
+    """EVENT_BUS=postgres вмикає обмін подіями між воркерами через DATABASE_URL."""
+    backend = os.environ.get("EVENT_BUS", "local").lower()
+    if backend == "postgres":
+        dsn = os.environ.get("DATABASE_URL", "").replace("+asyncpg", "")
+        return PostgresEventBus(dsn)
+    return LocalEventBus()
+
+
+# Глобальний екземпляр
+event_bus = _create_event_bus()
@@ -0,0 +1,101 @@
+# http_cache.py
+
+import gzip
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# brotli - необов'язкова залежність: без неї віддаємо лише gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Занадто малі відповіді не варто стискати
+MIN_COMPRESS_SIZE = 512
+
+
+class CachedPayload:
+    """
+    Готове тіло відповіді з валідаторами та стиснутими варіантами.
+    Створюється один раз на версію даних і віддається без повторної серіалізації.
+    """
+
+    def __init__(self, body: bytes, media_type: str, last_modified: Optional[datetime] = None):
+        self.body = body
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.last_modified = (last_modified or datetime.now(timezone.utc)).replace(microsecond=0)
+
+        self.gzip: Optional[bytes] = None
+        self.br: Optional[bytes] = None
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.gzip = gzip.compress(body, compresslevel=9)
+            if brotli is not None:
+                self.br = brotli.compress(body, quality=11)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified_since(if_modified_since: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified <= since
+
+
+def _variant_etag(etag: str, encoding: Optional[str]) -> str:
+    """Сильний ETag має відрізнятися для кожного Content-Encoding: "<hash>" / "<hash>-gzip" / "<hash>-br"."""
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+
+def cached_response(request: Request, payload: CachedPayload, cache_control: str = "no-cache") -> Response:
+    """
+    Віддає payload з урахуванням If-None-Match / If-Modified-Since (304)
+    та Accept-Encoding (br, gzip). Кожен варіант кодування має власний ETag.
+    """
+    accept_encoding = request.headers.get("accept-encoding", "").lower()
+    if payload.br is not None and "br" in accept_encoding:
+        encoding, content = "br", payload.br
+    elif payload.gzip is not None and "gzip" in accept_encoding:
+        encoding, content = "gzip", payload.gzip
+    else:
+        encoding, content = None, payload.body
+
+    etag = _variant_etag(payload.etag, encoding)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(payload.last_modified, usegmt=True),
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and _not_modified_since(if_modified_since, payload.last_modified):
+            return Response(status_code=304, headers=headers)
+
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type=payload.media_type, headers=headers)
@@ -8,20 +8,24 @@ from decimal import Decimal
 from fastapi import APIRouter, Depends, HTTPException, Request, Body
 from fastapi.responses import HTMLResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload, selectinload
-from aiogram import Bot, html as aiogram_html
-from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
+from aiogram import Bot
 from urllib.parse import quote_plus as url_quote_plus
 
 # Added MenuItem to imports
-from models import Table, Product, Category, Order, Settings, Employee, OrderStatusHistory, OrderStatus, OrderItem, MenuItem
+from models import Table, Product, Order, Employee, OrderStatusHistory, OrderStatus, OrderItem, MenuItem
 from dependencies import get_db_session
+from settings_cache import settings_cache
 from templates import IN_HOUSE_MENU_HTML_TEMPLATE
-from notification_manager import distribute_order_to_production, create_staff_notification
+from notification_manager import create_staff_notification, build_order_delta, build_order_audience
 
 # ДОДАНО: Імпорт менеджера WebSocket
-from websocket_manager import manager
+from websocket_manager import manager, StaffAudience
+from menu_cache import menu_cache
+from http_cache import cached_response
+from status_registry import status_registry
+from notification_outbox import enqueue_notification, OUTBOX_NEW_TABLE_ORDER
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -38,52 +42,11 @@ async def get_in_house_menu(access_token: str, request: Request, session: AsyncS
     if not table:
         raise HTTPException(status_code=404, detail="Столик не знайдено.")
 
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     logo_html = f'<img src="/{settings.logo_url}" alt="Логотип" class="header-logo">' if settings and settings.logo_url else ''
 
-    # Отримуємо меню, яке показується в ресторані
-    categories_res = await session.execute(
-        select(Category)
-        .where(Category.show_in_restaurant == True)
-        .order_by(Category.sort_order, Category.name)
-    )
-    
-    products_res = await session.execute(
-        select(Product)
-        .options(selectinload(Product.modifiers))
-        .join(Category)
-        .where(Product.is_active == True, Category.show_in_restaurant == True)
-    )
-
-    categories = [{"id": c.id, "name": c.name} for c in categories_res.scalars().all()]
-    
-    products = []
-    for p in products_res.scalars().all():
-        mods_list = []
-        if p.modifiers:
-            for m in p.modifiers:
-                price_val = m.price if m.price is not None else 0
-                mods_list.append({
-                    "id": m.id, 
-                    "name": m.name, 
-                    "price": float(price_val)
-                })
-
-        products.append({
-            "id": p.id, 
-            "name": p.name, 
-            "description": p.description, 
-            "price": float(p.price), 
-            "image_url": p.image_url, 
-            "category_id": p.category_id,
-            "modifiers": mods_list
-        })
-
     # Отримуємо історію неоплачених замовлень для цього столика
-    final_statuses_res = await session.execute(
-        select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True))
-    )
-    final_status_ids = final_statuses_res.scalars().all()
+    final_status_ids = (await status_registry.get(session)).final_ids
 
     active_orders_res = await session.execute(
         select(Order)
@@ -119,7 +82,6 @@ async def get_in_house_menu(access_token: str, request: Request, session: AsyncS
             "time": o.created_at.strftime('%H:%M')
         })
 
-    menu_data = json.dumps({"categories": categories, "products": products})
     history_data = json.dumps(history_list) 
 
     site_title = settings.site_title or "Назва"
@@ -164,7 +126,6 @@ async def get_in_house_menu(access_token: str, request: Request, session: AsyncS
         table_name=html_module.escape(table.name),
         table_id=table.id,
         logo_html=logo_html,
-        menu_data=menu_data,
         history_data=history_data,   
         grand_total=float(grand_total),     
         site_title=html_module.escape(site_title),
@@ -196,14 +157,17 @@ async def get_in_house_menu(access_token: str, request: Request, session: AsyncS
         menu_links_html=menu_links_html
     ))
 
+@router.get("/api/menu/restaurant")
+async def get_restaurant_menu_data(request: Request, session: AsyncSession = Depends(get_db_session)):
+    """Меню закладу для QR-сторінки (з ETag, клієнт робить умовний запит)."""
+    snapshot = await menu_cache.get(session)
+    return cached_response(request, snapshot.restaurant)
+
 @router.get("/api/menu/table/{table_id}/updates", response_class=JSONResponse)
 async def get_table_updates(table_id: int, session: AsyncSession = Depends(get_db_session)):
     """Повертає актуальний статус замовлень для оновлення фронтенду."""
     
-    final_statuses_res = await session.execute(
-        select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True))
-    )
-    final_status_ids = final_statuses_res.scalars().all()
+    final_status_ids = (await status_registry.get(session)).final_ids
 
     active_orders_res = await session.execute(
         select(Order)
@@ -267,7 +231,7 @@ async def call_waiter(
     await manager.broadcast_staff({
         "type": "new_order", # Використовуємо 'new_order' для відображення Toast
         "message": f"🔔 СТІЛ {table.name}: Виклик офіціанта!"
-    })
+    }, audience=StaffAudience(employee_ids=[w.id for w in waiters]))
 
     # 3. Telegram Bot
     admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
@@ -309,10 +273,7 @@ async def request_bill(
     table = await session.get(Table, table_id, options=[selectinload(Table.assigned_waiters)])
     if not table: raise HTTPException(status_code=404, detail="Столик не знайдено.")
 
-    final_statuses_res = await session.execute(
-        select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True))
-    )
-    final_status_ids = final_statuses_res.scalars().all()
+    final_status_ids = (await status_registry.get(session)).final_ids
 
     active_orders_res = await session.execute(
         select(Order).where(Order.table_id == table.id, Order.status_id.not_in(final_status_ids))
@@ -338,7 +299,7 @@ async def request_bill(
     await manager.broadcast_staff({
         "type": "new_order", # Використовуємо 'new_order' для Toast
         "message": f"💰 СТІЛ {table.name}: Рахунок ({method_text})"
-    })
+    }, audience=StaffAudience(employee_ids=[w.id for w in waiters]))
 
     # 3. Telegram Bot
     admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
@@ -441,9 +402,17 @@ async def place_in_house_order(
         items=new_order_items
     )
     session.add(order)
+    await session.flush()
+
+    history_entry = OrderStatusHistory(
+        order_id=order.id, status_id=order.status_id,
+        actor_info=f"Гість за столиком {table.name}"
+    )
+    session.add(history_entry)
+    # Telegram та кухня/бар - фоновим воркером, в тій самій транзакції, що й замовлення
+    enqueue_notification(session, OUTBOX_NEW_TABLE_ORDER, {"order_id": order.id})
     await session.commit()
     await session.refresh(order)
-    await session.refresh(order, ['status'])
 
     # --- PWA NOTIFICATION ---
     pwa_msg = f"📝 Нове замовлення #{order.id} (Стіл: {table.name}). Сума: {total_price} грн"
@@ -451,72 +420,12 @@ async def place_in_house_order(
         if w.is_on_shift:
             await create_staff_notification(session, w.id, pwa_msg)
 
-    history_entry = OrderStatusHistory(
-        order_id=order.id, status_id=order.status_id,
-        actor_info=f"Гість за столиком {table.name}"
-    )
-    session.add(history_entry)
-    await session.commit()
-
     # --- WEBSOCKET BROADCAST (Миттєве сповіщення персоналу) ---
     await manager.broadcast_staff({
         "type": "new_order",
         "order_id": order.id,
+        "order": await build_order_delta(session, order),
         "message": f"📝 Замовлення #{order.id} (Стіл: {table.name})"
-    })
-
-    # --- Telegram сповіщення ---
-    products_display = "\n- ".join(products_str_for_msg)
-    order_details_text = (f"📝 <b>Нове замовлення зі столика: {aiogram_html.bold(table.name)} (ID: #{order.id})</b>\n\n"
-                          f"<b>Склад:</b>\n- {aiogram_html.quote(products_display)}\n\n"
-                          f"<b>Сума:</b> {total_price} грн")
-
-    admin_bot = request.app.state.admin_bot
-    
-    if not admin_bot:
-        return JSONResponse(content={"message": "Замовлення прийнято! Очікуйте.", "order_id": order.id})
-
-    kb_waiter = InlineKeyboardBuilder()
-    kb_waiter.row(InlineKeyboardButton(text="✅ Прийняти замовлення", callback_data=f"waiter_accept_order_{order.id}"))
-
-    kb_admin = InlineKeyboardBuilder()
-    kb_admin.row(InlineKeyboardButton(text="⚙️ Керувати (Адмін)", callback_data=f"waiter_manage_order_{order.id}"))
-
-    waiters = table.assigned_waiters
-    admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
-    admin_chat_id = None
-    if admin_chat_id_str:
-        try: admin_chat_id = int(admin_chat_id_str)
-        except ValueError: pass
-
-    waiter_chat_ids = set()
-    for w in waiters:
-        if w.telegram_user_id and w.is_on_shift:
-            waiter_chat_ids.add(w.telegram_user_id)
+    }, audience=await build_order_audience(session, order))
 
-    if waiter_chat_ids:
-        for chat_id in waiter_chat_ids:
-            try:
-                await admin_bot.send_message(chat_id, order_details_text, reply_markup=kb_waiter.as_markup())
-            except Exception as e:
-                logger.error(f"Не вдалося надіслати нове замовлення офіціанту {chat_id}: {e}")
-
-        if admin_chat_id and admin_chat_id not in waiter_chat_ids:
-            try:
-                await admin_bot.send_message(admin_chat_id, "✅ " + order_details_text, reply_markup=kb_admin.as_markup())
-            except Exception: pass
-    else:
-        if admin_chat_id:
-            await admin_bot.send_message(
-                admin_chat_id,
-                f"❗️ <b>Замовлення з вільного столика {aiogram_html.bold(table.name)} (ID: #{order.id})!</b>\n\n" + order_details_text,
-                reply_markup=kb_admin.as_markup()
-            )
-
-    if order.status.requires_kitchen_notify:
-        try:
-            await distribute_order_to_production(admin_bot, order, session)
-        except Exception as e:
-            logger.error(f"Помилка при розподілі замовлення #{order.id}: {e}")
-        
     return JSONResponse(content={"message": "Замовлення прийнято! Офіціант незабаром його підтвердить.", "order_id": order.id})
\ No newline at end of file
@@ -0,0 +1,358 @@
+# inventory_jobs.py
+
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Order, async_session_maker
+from inventory_models import InventoryJob, InventoryDoc, InventoryDocItem, InventoryDocOrderLine
+from inventory_service import deduct_products_by_tech_card, reverse_deduction
+from tech_card_plans import deduction_plans, ingredient_costs
+from stock_posting import StockKey, post_stock_changes
+
+logger = logging.getLogger(__name__)
+
+JOB_DEDUCT = "deduct"
+JOB_REVERSE = "reverse"
+# Скасування зі списанням у смітник: продаж замовлення стає накладною writeoff
+JOB_WRITEOFF = "writeoff"
+
+# sync - списання в запиті зміни статусу (як раніше); deferred - через чергу inventory_jobs
+INVENTORY_DEDUCTION_MODE = os.environ.get("INVENTORY_DEDUCTION_MODE", "sync").lower()
+# Скільки чекати після першої задачі, щоб зібрати пачку (сек.)
+INVENTORY_BATCH_WINDOW = float(os.environ.get("INVENTORY_BATCH_WINDOW", "2"))
+INVENTORY_POLL_INTERVAL = float(os.environ.get("INVENTORY_POLL_INTERVAL", "5"))
+INVENTORY_BATCH_SIZE = 200
+INVENTORY_MAX_ATTEMPTS = 8
+# Ключ pg_advisory_xact_lock: пачки обробляє лише один воркер одночасно,
+# тому задачі одного замовлення ніколи не проводяться паралельно
+INVENTORY_JOBS_LOCK_KEY = 7_310_001
+
+
+def is_deferred() -> bool:
+    return INVENTORY_DEDUCTION_MODE == "deferred"
+
+
+def enqueue_inventory_job(session: AsyncSession, kind: str, order_id: int):
+    """Додає задачу в чергу. Воркер цього процесу прокидається після commit."""
+    session.add(InventoryJob(kind=kind, order_id=order_id))
+    sa.event.listen(session.sync_session, "after_commit", lambda _session: inventory_worker.wake(), once=True)
+
+
+async def has_pending_deduction(session: AsyncSession, order_id: int) -> bool:
+    if not is_deferred():
+        return False
+    job_id = await session.scalar(
+        select(InventoryJob.id).where(InventoryJob.order_id == order_id, InventoryJob.kind == JOB_DEDUCT).limit(1)
+    )
+    return job_id is not None
+
+
+async def request_deduction(session: AsyncSession, order: Order):
+    """Списання по замовленню: одразу (sync) або задачею в черзі (deferred)."""
+    if not is_deferred():
+        await deduct_products_by_tech_card(session, order)
+        return
+    enqueue_inventory_job(session, JOB_DEDUCT, order.id)
+    await session.commit()
+
+
+async def request_reversal(session: AsyncSession, order: Order):
+    """Повернення на склад по замовленню: одразу (sync) або задачею в черзі (deferred)."""
+    if not is_deferred():
+        await reverse_deduction(session, order)
+        return
+    enqueue_inventory_job(session, JOB_REVERSE, order.id)
+    await session.commit()
+
+
+async def request_writeoff(session: AsyncSession, order: Order):
+    """
+    Скасування "в смітник": списане (або поставлене в чергу на списання) замовлення
+    обліковується як writeoff замість продажу. Залишки не змінюються - товар уже витрачено.
+    """
+    if not is_deferred():
+        converted = await convert_to_writeoff(session, order.id)
+        await session.commit()
+        if converted:
+            logger.info(f"Замовлення #{order.id}: {converted} накладних продажу перетворено на списання (Writeoff).")
+        else:
+            logger.warning(f"Замовлення #{order.id} (Waste): Документів продажу (deduction) не знайдено для конвертації.")
+        return
+    enqueue_inventory_job(session, JOB_WRITEOFF, order.id)
+    await session.commit()
+
+
+async def convert_to_writeoff(session: AsyncSession, order_id: int) -> int:
+    """
+    Перекласифікує вже проведене списання замовлення на writeoff. Commit - на стороні виклику.
+    Накладна одного замовлення змінює тип; з пакетної накладної частка замовлення
+    (InventoryDocOrderLine) переноситься в окрему накладну writeoff. Повертає кількість накладних.
+    """
+    comment = f"Списання (Скасування) замовлення #{order_id}"
+    docs = (await session.execute(
+        select(InventoryDoc).where(InventoryDoc.linked_order_id == order_id, InventoryDoc.doc_type == 'deduction')
+    )).scalars().all()
+    for doc in docs:
+        doc.doc_type = 'writeoff'
+        doc.comment = comment
+    converted = len(docs)
+
+    shares = (await session.execute(
+        select(InventoryDocOrderLine, InventoryDoc)
+        .join(InventoryDoc, InventoryDoc.id == InventoryDocOrderLine.doc_id)
+        .where(InventoryDocOrderLine.order_id == order_id, InventoryDoc.doc_type == 'deduction')
+        .order_by(InventoryDoc.id)
+    )).all()
+    by_doc: Dict[int, Tuple[InventoryDoc, List[InventoryDocOrderLine]]] = {}
+    for line, doc in shares:
+        by_doc.setdefault(doc.id, (doc, []))[1].append(line)
+
+    for batch_doc, lines in by_doc.values():
+        batch_items = {
+            item.ingredient_id: item for item in (await session.execute(
+                select(InventoryDocItem).where(InventoryDocItem.doc_id == batch_doc.id)
+            )).scalars().all()
+        }
+        waste = InventoryDoc(
+            doc_type='writeoff',
+            source_warehouse_id=batch_doc.source_warehouse_id,
+            comment=comment,
+            linked_order_id=order_id,
+            is_processed=True,
+        )
+        for line in lines:
+            qty = Decimal(str(line.quantity))
+            batch_item = batch_items.get(line.ingredient_id)
+            if batch_item is not None:
+                rest = Decimal(str(batch_item.quantity)) - qty
+                if rest > 0:
+                    batch_item.quantity = rest
+                else:
+                    await session.delete(batch_item)
+            waste.items.append(InventoryDocItem(
+                ingredient_id=line.ingredient_id, quantity=qty,
+                price=batch_item.price if batch_item is not None else Decimal(0),
+            ))
+            await session.delete(line)
+        session.add(waste)
+        converted += 1
+    return converted
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(300, 2 ** attempts))
+
+
+class InventoryJobWorker:
+    """
+    Фонова обробка inventory_jobs пачками.
+    За одну пачку: рядки всіх замовлень зводяться по (склад, інгредієнт), створюється
+    одна накладна на склад і тип руху, а залишки змінюються одним проведенням.
+    Ідемпотентність - через Order.is_inventory_deducted: списання вже списаного
+    і повернення не списаного замовлення пропускаються.
+    writeoff: не списане замовлення списується накладною writeoff, вже списане - перекласифікується.
+    """
+
+    def __init__(self):
+        self._task = None
+        self._wake = asyncio.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), INVENTORY_POLL_INTERVAL)
+                # Розбудили - даємо черзі набратися
+                await asyncio.sleep(INVENTORY_BATCH_WINDOW)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            try:
+                while await self.process_batch() >= INVENTORY_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                logger.error(f"Склад: помилка обробки черги списань: {e}", exc_info=True)
+
+    async def process_batch(self) -> int:
+        """Обробляє одну пачку. Повертає кількість задач у ній."""
+        async with async_session_maker() as session:
+            if not await session.scalar(select(func.pg_try_advisory_xact_lock(INVENTORY_JOBS_LOCK_KEY))):
+                return 0
+
+            jobs = (await session.execute(
+                select(InventoryJob)
+                .where(InventoryJob.status == 'pending', InventoryJob.next_attempt_at <= func.now())
+                .order_by(InventoryJob.id)
+                .limit(INVENTORY_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+            if not jobs:
+                return 0
+
+            jobs_by_order: Dict[int, List[Tuple[int, str, int]]] = {}
+            for job in jobs:
+                jobs_by_order.setdefault(job.order_id, []).append((job.id, job.kind, job.attempts))
+
+            try:
+                await self._post(session, jobs_by_order)
+                await session.commit()
+                return len(jobs)
+            except Exception as e:
+                await session.rollback()
+                if len(jobs_by_order) == 1:
+                    await self._mark_failed(list(jobs_by_order.values())[0], e)
+                    return len(jobs)
+                logger.warning(f"Склад: пачку з {len(jobs_by_order)} замовлень не проведено ({e}), обробляю по одному")
+
+        # Шукаємо замовлення, через яке впала пачка: проводимо кожне окремо
+        for order_id, order_jobs in jobs_by_order.items():
+            async with async_session_maker() as session:
+                try:
+                    await session.scalar(select(func.pg_advisory_xact_lock(INVENTORY_JOBS_LOCK_KEY)))
+                    await self._post(session, {order_id: order_jobs})
+                    await session.commit()
+                except Exception as e:
+                    await session.rollback()
+                    await self._mark_failed(order_jobs, e)
+        return len(jobs)
+
+    async def _post(self, session: AsyncSession, jobs_by_order: Dict[int, List[Tuple[int, str, int]]]):
+        orders = (await session.execute(
+            select(Order).where(Order.id.in_(jobs_by_order.keys())).order_by(Order.id).with_for_update(of=Order)
+        )).scalars().all()
+
+        plans = await deduction_plans.get(session)
+        if plans.fallback_wh_id is None:
+            raise RuntimeError("в базі немає жодного складу")
+
+        # {тип документа: {склад: {інгредієнт: кількість}}}, {тип документа: {склад: [замовлення]}}
+        moves: Dict[str, Dict[int, Dict[int, Decimal]]] = {'deduction': {}, 'writeoff': {}, 'return': {}}
+        move_orders: Dict[str, Dict[int, List[int]]] = {'deduction': {}, 'writeoff': {}, 'return': {}}
+        # Рядки кожного замовлення - для InventoryDocOrderLine пакетних накладних
+        order_shares: Dict[Tuple[str, int], List[Tuple[int, int, Decimal]]] = {}
+        convert_ids: List[int] = []
+
+        for order in orders:
+            deducted = bool(order.is_inventory_deducted)
+            # None - не списано, інакше тип накладної, якою списано (для вже списаного - продаж)
+            state = 'deduction' if deducted else None
+            for _, kind, _ in jobs_by_order[order.id]:
+                if kind == JOB_DEDUCT:
+                    state = state or 'deduction'
+                elif kind == JOB_WRITEOFF:
+                    state = 'writeoff'
+                elif kind == JOB_REVERSE:
+                    state = None
+
+            if deducted and state == 'writeoff':
+                # Залишки вже списано продажем - змінюється лише облік
+                convert_ids.append(order.id)
+                continue
+            if (state is not None) == deducted:
+                # Нічого не змінилось (повтор або списання + повернення в одній пачці)
+                continue
+
+            doc_type = state or 'return'
+            lines = plans.order_lines(order) if order.items else []
+            for wh_id, ing_id, qty in lines:
+                by_ing = moves[doc_type].setdefault(wh_id, {})
+                by_ing[ing_id] = by_ing.get(ing_id, Decimal(0)) + qty
+                wh_orders = move_orders[doc_type].setdefault(wh_id, [])
+                if not wh_orders or wh_orders[-1] != order.id:
+                    wh_orders.append(order.id)
+                order_shares.setdefault((doc_type, wh_id), []).append((order.id, ing_id, qty))
+            order.is_inventory_deducted = state is not None
+
+        for order_id in convert_ids:
+            await convert_to_writeoff(session, order_id)
+
+        ingredient_ids = {ing_id for by_wh in moves.values() for by_ing in by_wh.values() for ing_id in by_ing}
+        costs = await ingredient_costs(session, ingredient_ids)
+
+        labels = {'deduction': "Списання", 'writeoff': "Списання (Скасування)", 'return': "Повернення"}
+        deltas: Dict[StockKey, Decimal] = {}
+        doc_keys: List[Tuple[InventoryDoc, List[StockKey]]] = []
+        batch_docs: List[Tuple[InventoryDoc, List[Tuple[int, int, Decimal]]]] = []
+        for doc_type, by_wh in moves.items():
+            outgoing = doc_type != 'return'
+            sign = Decimal(-1) if outgoing else Decimal(1)
+            for wh_id, by_ing in sorted(by_wh.items()):
+                order_ids = move_orders[doc_type][wh_id]
+                comment = f"{labels[doc_type]} (пакетне): замовлення " + ", ".join(f"#{oid}" for oid in order_ids)
+                doc = InventoryDoc(
+                    doc_type=doc_type,
+                    source_warehouse_id=wh_id if outgoing else None,
+                    target_warehouse_id=wh_id if not outgoing else None,
+                    comment=comment[:255],
+                    # Накладна на одне замовлення лишається прив'язаною до нього
+                    linked_order_id=order_ids[0] if len(order_ids) == 1 else None,
+                    is_processed=True,
+                )
+                for ing_id, qty in sorted(by_ing.items()):
+                    doc.items.append(InventoryDocItem(ingredient_id=ing_id, quantity=qty, price=costs.get(ing_id, Decimal(0))))
+                    key = (wh_id, ing_id)
+                    deltas[key] = deltas.get(key, Decimal(0)) + sign * qty
+                session.add(doc)
+                doc_keys.append((doc, [(wh_id, ing_id) for ing_id in by_ing]))
+                if len(order_ids) > 1:
+                    batch_docs.append((doc, order_shares[(doc_type, wh_id)]))
+
+        await session.flush()
+
+        for doc, shares in batch_docs:
+            session.add_all([
+                InventoryDocOrderLine(doc_id=doc.id, order_id=order_id, ingredient_id=ing_id, quantity=qty)
+                for order_id, ing_id, qty in shares
+            ])
+
+        # Рядок журналу посилається на накладну; якщо ключ є і в списанні, і в поверненні пачки - без посилання
+        doc_ids: Dict[StockKey, Optional[int]] = {}
+        for doc, keys in doc_keys:
+            for key in keys:
+                doc_ids[key] = doc.id if key not in doc_ids else None
+
+        await post_stock_changes(session, deltas, label=f"пакета з {len(orders)} замовлень", doc_ids=doc_ids)
+
+        job_ids = [job_id for order_jobs in jobs_by_order.values() for job_id, _, _ in order_jobs]
+        await session.execute(delete(InventoryJob).where(InventoryJob.id.in_(job_ids)))
+        logger.info(f"Склад: проведено пакет із {len(job_ids)} задач ({len(orders)} замовлень)")
+
+    async def _mark_failed(self, order_jobs: List[Tuple[int, str, int]], error: Exception):
+        logger.error(f"Склад: задачі {[job_id for job_id, _, _ in order_jobs]} не проведено: {error}")
+        async with async_session_maker() as session:
+            for job_id, _, attempts in order_jobs:
+                attempts += 1
+                await session.execute(
+                    update(InventoryJob).where(InventoryJob.id == job_id).values(
+                        attempts=attempts,
+                        status='failed' if attempts >= INVENTORY_MAX_ATTEMPTS else 'pending',
+                        next_attempt_at=func.now() + _retry_delay(attempts),
+                        last_error=str(error)[:1000],
+                    )
+                )
+            await session.commit()
+
+
+# Глобальний екземпляр
+inventory_worker = InventoryJobWorker()
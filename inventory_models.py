@@ -158,6 +158,10 @@ class AutoDeductionRule(Base):
 class Stock(Base):
     """Остатки на складах"""
     __tablename__ = 'stocks'
+    __table_args__ = (
+        # Один рядок на пару склад + інгредієнт (для INSERT ... ON CONFLICT)
+        sa.Index('uq_stocks_warehouse_ingredient', 'warehouse_id', 'ingredient_id', unique=True),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     warehouse_id: Mapped[int] = mapped_column(sa.ForeignKey('warehouses.id'))
     ingredient_id: Mapped[int] = mapped_column(sa.ForeignKey('ingredients.id'))
@@ -205,4 +209,69 @@ class InventoryDocItem(Base):
     price: Mapped[float] = mapped_column(sa.Numeric(10, 2), default=0.00) # Цена закупки (для прихода)
     
     doc: Mapped["InventoryDoc"] = relationship("InventoryDoc", back_populates="items")
-    ingredient: Mapped["Ingredient"] = relationship("Ingredient")
\ No newline at end of file
+    ingredient: Mapped["Ingredient"] = relationship("Ingredient")
+
+class InventoryJob(Base):
+    """
+    Черга відкладених списань/повернень по замовленнях (INVENTORY_DEDUCTION_MODE=deferred).
+    Обробляє inventory_jobs.py пачками: одна накладна на склад за вікно пачки.
+    """
+    __tablename__ = 'inventory_jobs'
+    __table_args__ = (
+        sa.Index('ix_inventory_jobs_pending', 'status', 'next_attempt_at'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    # deduct (списати) / reverse (повернути) / writeoff (скасовано зі списанням у смітник)
+    kind: Mapped[str] = mapped_column(sa.String(20), nullable=False)
+    order_id: Mapped[int] = mapped_column(sa.ForeignKey('orders.id', ondelete="CASCADE"), nullable=False, index=True)
+    # pending -> (запис видаляється) | failed
+    status: Mapped[str] = mapped_column(sa.String(20), default='pending', server_default=text("'pending'"), nullable=False)
+    attempts: Mapped[int] = mapped_column(sa.Integer, default=0, server_default=text("0"), nullable=False)
+    next_attempt_at: Mapped[datetime] = mapped_column(sa.DateTime, default=sa.func.now(), server_default=sa.func.now(), nullable=False)
+    last_error: Mapped[str | None] = mapped_column(sa.Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(sa.DateTime, default=sa.func.now(), server_default=sa.func.now())
+
+class InventoryDocOrderLine(Base):
+    """
+    Частка замовлення в пакетній накладній (linked_order_id = NULL, кілька замовлень).
+    Потрібна, щоб перекласифікувати одне замовлення (продаж -> списання в смітник) без інших.
+    """
+    __tablename__ = 'inventory_doc_order_lines'
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    doc_id: Mapped[int] = mapped_column(sa.ForeignKey('inventory_docs.id', ondelete="CASCADE"), nullable=False, index=True)
+    order_id: Mapped[int] = mapped_column(sa.ForeignKey('orders.id', ondelete="CASCADE"), nullable=False, index=True)
+    ingredient_id: Mapped[int] = mapped_column(sa.ForeignKey('ingredients.id', ondelete="CASCADE"), nullable=False)
+    quantity: Mapped[float] = mapped_column(sa.Numeric(10, 3), nullable=False)
+
+class StockMovement(Base):
+    """
+    Журнал руху залишків (лише додавання). Пише stock_posting.post_stock_changes
+    в тій самій транзакції, що й зміну Stock.
+    """
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        sa.Index('ix_stock_movements_ing_wh_ts', 'ingredient_id', 'warehouse_id', 'ts'),
+        sa.Index('ix_stock_movements_ts', 'ts'),
+    )
+    id: Mapped[int] = mapped_column(sa.BigInteger, primary_key=True, autoincrement=True)
+    # clock_timestamp(): час запису рядка, а не початку транзакції (див. stock_ledger.take_stock_snapshot)
+    ts: Mapped[datetime] = mapped_column(sa.DateTime, server_default=sa.text("clock_timestamp()"), nullable=False)
+    warehouse_id: Mapped[int] = mapped_column(sa.ForeignKey('warehouses.id', ondelete="CASCADE"), nullable=False)
+    ingredient_id: Mapped[int] = mapped_column(sa.ForeignKey('ingredients.id', ondelete="CASCADE"), nullable=False)
+    delta: Mapped[float] = mapped_column(sa.Numeric(10, 3), nullable=False)
+    # Залишок на складі після руху
+    balance: Mapped[float] = mapped_column(sa.Numeric(10, 3), nullable=False)
+    doc_id: Mapped[int | None] = mapped_column(sa.ForeignKey('inventory_docs.id', ondelete="SET NULL"), nullable=True)
+
+class StockSnapshot(Base):
+    """Періодичний знімок залишків усіх складів (один ts на знімок)"""
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        sa.Index('ix_stock_snapshots_ts_wh', 'ts', 'warehouse_id'),
+        sa.Index('ix_stock_snapshots_ing_wh_ts', 'ingredient_id', 'warehouse_id', 'ts'),
+    )
+    id: Mapped[int] = mapped_column(sa.BigInteger, primary_key=True, autoincrement=True)
+    ts: Mapped[datetime] = mapped_column(sa.DateTime, nullable=False)
+    warehouse_id: Mapped[int] = mapped_column(sa.ForeignKey('warehouses.id', ondelete="CASCADE"), nullable=False)
+    ingredient_id: Mapped[int] = mapped_column(sa.ForeignKey('ingredients.id', ondelete="CASCADE"), nullable=False)
+    quantity: Mapped[float] = mapped_column(sa.Numeric(10, 3), nullable=False)
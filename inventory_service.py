@@ -3,37 +3,27 @@
 import logging
 from datetime import datetime
 from decimal import Decimal
+from typing import Dict, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, func
+from sqlalchemy import select, update
 from sqlalchemy.orm import joinedload, selectinload
 
-from inventory_models import (
-    Stock, InventoryDoc, InventoryDocItem, TechCard, 
-    TechCardItem, Ingredient, Warehouse, Modifier, AutoDeductionRule,
-    IngredientRecipeItem
-)
-from models import Order, OrderItem, Product
+from inventory_models import Stock, InventoryDoc, InventoryDocItem, Ingredient, IngredientRecipeItem
+from models import Order, OrderItem
+from tech_card_plans import deduction_plans, ingredient_costs, order_trigger
+from cost_rollup import cost_rollup
+from stock_posting import StockKey, lock_stock_rows, post_stock_changes
 
 logger = logging.getLogger(__name__)
 
 async def get_stock(session: AsyncSession, warehouse_id: int, ingredient_id: int) -> Stock:
     """
     Отримує запис про залишки товару на складі з блокуванням рядка для оновлення (FOR UPDATE).
-    Якщо запису немає, створює новий з нульовим залишком.
+    Якщо запису немає, створює новий з нульовим залишком (INSERT ... ON CONFLICT, без гонок).
     """
-    res = await session.execute(
-        select(Stock)
-        .where(Stock.warehouse_id == warehouse_id, Stock.ingredient_id == ingredient_id)
-        .with_for_update()
-    )
-    stock = res.scalars().first()
-    
-    if not stock:
-        stock = Stock(warehouse_id=warehouse_id, ingredient_id=ingredient_id, quantity=0)
-        session.add(stock)
-        await session.flush()
-        
-    return stock
+    locked = await lock_stock_rows(session, [(warehouse_id, ingredient_id)])
+    stock_id = locked[(warehouse_id, ingredient_id)][0]
+    return await session.get(Stock, stock_id, populate_existing=True)
 
 async def calculate_order_prime_cost(session: AsyncSession, order_id: int) -> Decimal:
     """
@@ -44,54 +34,14 @@ async def calculate_order_prime_cost(session: AsyncSession, order_id: int) -> De
     if not order or not order.items:
         return Decimal(0)
 
-    total_cost = Decimal(0)
+    plans = await deduction_plans.get(session)
+    lines = plans.order_lines(order, include_rules=False)
+    # Собівартість напівфабрикатів розгорнута по рецептах
+    costs = await cost_rollup.get(session)
 
-    for item in order.items:
-        # 1. Собівартість страви по техкарті
-        tech_card = await session.scalar(
-            select(TechCard)
-            .where(TechCard.product_id == item.product_id)
-            .options(joinedload(TechCard.components).joinedload(TechCardItem.ingredient))
-        )
-        
-        item_cost = Decimal(0)
-        if tech_card:
-            # Визначаємо, чи це замовлення "на винос" (для упаковки в техкарті)
-            is_takeaway_order = order.is_delivery or order.order_type == 'pickup'
-            
-            for comp in tech_card.components:
-                # Ігноруємо упаковку "на винос", якщо це не доставка/самовивіз
-                if comp.is_takeaway and not is_takeaway_order:
-                    continue
-                    
-                ing_price = Decimal(str(comp.ingredient.current_cost or 0))
-                amount = Decimal(str(comp.gross_amount))
-                item_cost += ing_price * amount
-        
-        # 2. Собівартість модифікаторів
-        mods_cost = Decimal(0)
-        if item.modifiers:
-            for m in item.modifiers:
-                # Отримуємо дані про інгредієнт модифікатора
-                ing_id = m.get('ingredient_id')
-                qty_val = m.get('ingredient_qty', 0)
-                
-                # Якщо в JSON немає ID інгредієнта (старі дані), пробуємо знайти через таблицю Modifier
-                if not ing_id and m.get('id'):
-                    mod_db = await session.get(Modifier, int(m['id']))
-                    if mod_db:
-                        ing_id = mod_db.ingredient_id
-                        qty_val = mod_db.ingredient_qty
-
-                if ing_id and float(qty_val) > 0:
-                    ing = await session.get(Ingredient, int(ing_id))
-                    if ing:
-                        ing_price = Decimal(str(ing.current_cost or 0))
-                        qty = Decimal(str(qty_val))
-                        mods_cost += ing_price * qty
-
-        # Додаємо до загальної суми: (собівартість страви + собівартість модифікаторів) * кількість
-        total_cost += (item_cost + mods_cost) * item.quantity
+    total_cost = Decimal(0)
+    for _, ing_id, qty in lines:
+        total_cost += costs.ingredient_cost(ing_id) * qty
 
     return total_cost
 
@@ -152,59 +102,70 @@ async def apply_doc_stock_changes(session: AsyncSession, doc_id: int):
         await session.commit()
         return
 
+    # Перевірка складів для типу документа
+    if doc.doc_type in ('supply', 'return') and not doc.target_warehouse_id:
+        raise ValueError("Не вказано склад отримувач" if doc.doc_type == 'supply' else "Не вказано склад для повернення")
+    if doc.doc_type == 'transfer' and (not doc.source_warehouse_id or not doc.target_warehouse_id):
+        raise ValueError("Потрібні обидва склади")
+    if doc.doc_type in ('writeoff', 'deduction') and not doc.source_warehouse_id:
+        raise ValueError("Не вказано склад списання")
+
+    # Зводимо всі рядки документа в зміни залишків {(склад, інгредієнт): delta}
+    deltas: Dict[StockKey, Decimal] = {}
+    supplies: Dict[int, Tuple[Decimal, Decimal]] = {}
+
+    def add_delta(wh_id: int, ing_id: int, qty: Decimal):
+        key = (wh_id, ing_id)
+        deltas[key] = deltas.get(key, Decimal(0)) + qty
+
     for item in doc.items:
         qty = Decimal(str(item.quantity))
         
         if doc.doc_type == 'supply': # Приход
-            if not doc.target_warehouse_id: raise ValueError("Не вказано склад отримувач")
-            
-            # --- ЛОГИКА СРЕДНЕВЗВЕШЕННОЙ СЕБЕСТОИМОСТИ ---
+            # Для середньозваженої собівартості враховуємо лише позиції з ціною
             if item.price > 0:
-                total_qty_res = await session.execute(
-                    select(func.sum(Stock.quantity)).where(Stock.ingredient_id == item.ingredient_id)
-                )
-                total_existing_qty = total_qty_res.scalar() or Decimal(0)
-                calc_existing_qty = total_existing_qty if total_existing_qty > 0 else Decimal(0)
-
-                ingredient = await session.get(Ingredient, item.ingredient_id)
-                if ingredient:
-                    old_cost = Decimal(str(ingredient.current_cost or 0))
-                    new_supply_price = Decimal(str(item.price))
-                    
-                    current_value = calc_existing_qty * old_cost
-                    new_supply_value = qty * new_supply_price
-                    
-                    total_new_qty = calc_existing_qty + qty
-                    
-                    if total_new_qty > 0:
-                        new_avg_cost = (current_value + new_supply_value) / total_new_qty
-                        ingredient.current_cost = new_avg_cost
-                        session.add(ingredient)
-            # ---------------------------------------------
-
-            stock = await get_stock(session, doc.target_warehouse_id, item.ingredient_id)
-            stock.quantity += qty
+                supply_qty, supply_value = supplies.get(item.ingredient_id, (Decimal(0), Decimal(0)))
+                supplies[item.ingredient_id] = (supply_qty + qty, supply_value + qty * Decimal(str(item.price)))
+            add_delta(doc.target_warehouse_id, item.ingredient_id, qty)
 
         elif doc.doc_type == 'return': # Возврат на склад
-            if not doc.target_warehouse_id: raise ValueError("Не вказано склад для повернення")
-            stock = await get_stock(session, doc.target_warehouse_id, item.ingredient_id)
-            stock.quantity += qty
+            add_delta(doc.target_warehouse_id, item.ingredient_id, qty)
 
         elif doc.doc_type == 'transfer': # Перемещение
-            if not doc.source_warehouse_id or not doc.target_warehouse_id: raise ValueError("Потрібні обидва склади")
-            src_stock = await get_stock(session, doc.source_warehouse_id, item.ingredient_id)
-            tgt_stock = await get_stock(session, doc.target_warehouse_id, item.ingredient_id)
-            src_stock.quantity -= qty
-            tgt_stock.quantity += qty
+            add_delta(doc.source_warehouse_id, item.ingredient_id, -qty)
+            add_delta(doc.target_warehouse_id, item.ingredient_id, qty)
 
         elif doc.doc_type in ['writeoff', 'deduction']: # Списание
-            if not doc.source_warehouse_id: raise ValueError("Не вказано склад списання")
-            stock = await get_stock(session, doc.source_warehouse_id, item.ingredient_id)
-            stock.quantity -= qty
+            add_delta(doc.source_warehouse_id, item.ingredient_id, -qty)
+
+    # Собівартість рахуємо від залишків ДО приходу
+    await post_stock_changes(session, deltas, supplies, label=f"документа #{doc.id}",
+                             doc_ids={key: doc.id for key in deltas})
 
     doc.is_processed = True
     await session.commit()
 
+async def _order_lines_by_warehouse(session: AsyncSession, order: Order) -> Optional[Dict[int, list]]:
+    """
+    Інгредієнти замовлення за скомпільованими планами, згруповані по складах: {warehouse_id: [items]}.
+    None - якщо в базі немає жодного складу.
+    """
+    plans = await deduction_plans.get(session)
+    if plans.fallback_wh_id is None:
+        return None
+
+    lines = plans.order_lines(order)
+    costs = await ingredient_costs(session, (ing_id for _, ing_id, _ in lines))
+
+    items_by_wh: Dict[int, list] = {}
+    for wh_id, ing_id, qty in lines:
+        items_by_wh.setdefault(wh_id, []).append({
+            'ingredient_id': ing_id,
+            'qty': qty,
+            'price': costs.get(ing_id, Decimal(0))
+        })
+    return items_by_wh
+
 async def deduct_products_by_tech_card(session: AsyncSession, order: Order):
     """
     Автоматическое списание продуктов (включая модификаторы) с соответствующих складов.
@@ -220,126 +181,15 @@ async def deduct_products_by_tech_card(session: AsyncSession, order: Order):
         await session.commit()
         return
 
-    # --- Fallback склад (первый попавшийся), если не указан цех ---
-    first_wh = await session.scalar(select(Warehouse).limit(1))
-    if not first_wh:
+    # Группируем ингредиенты для списания по складам (блюда, модификаторы, упаковка)
+    deduction_items_by_wh = await _order_lines_by_warehouse(session, order)
+    if deduction_items_by_wh is None:
         logger.error("КРИТИЧНА ПОМИЛКА: В базі даних немає жодного складу! Списання неможливе.")
         # Не ставим флаг is_inventory_deducted, чтобы можно было повторить попытку позже
         return 
-    
-    fallback_wh_id = first_wh.id
-
-    # Группируем ингредиенты для списания по складам: {warehouse_id: [items]}
-    deduction_items_by_wh = {} 
-
-    def add_deduction(wh_id, ing_id, qty, price):
-        # Если wh_id пришел None, используем fallback
-        target_wh = wh_id if wh_id else fallback_wh_id
-        
-        if target_wh not in deduction_items_by_wh: deduction_items_by_wh[target_wh] = []
-        deduction_items_by_wh[target_wh].append({
-            'ingredient_id': ing_id, 
-            'qty': qty, 
-            'price': price
-        })
 
-    # Helper function to resolve linked warehouses (цех -> склад)
-    async def get_real_storage_id(wh_id: int) -> int:
-        if not wh_id: return fallback_wh_id
-        warehouse = await session.get(Warehouse, wh_id)
-        if warehouse and warehouse.linked_warehouse_id:
-            return warehouse.linked_warehouse_id
-        return wh_id
+    trigger = order_trigger(order)
 
-    is_takeaway_order = order.is_delivery or order.order_type == 'pickup'
-
-    # --- 1. СПИСАНИЕ БЛЮД И МОДИФИКАТОРОВ ---
-    for order_item in order.items:
-        # 1.1 Определяем цех приготовления
-        product = await session.get(Product, order_item.product_id)
-        
-        # Если продукт был удален, но остался в истории заказа - используем fallback
-        prod_wh_id = fallback_wh_id
-        if product and product.production_warehouse_id:
-            prod_wh_id = product.production_warehouse_id
-        
-        real_prod_storage_id = await get_real_storage_id(prod_wh_id)
-        
-        # 1.2 Ищем техкарту
-        tech_card = await session.scalar(
-            select(TechCard).where(TechCard.product_id == order_item.product_id)
-            .options(joinedload(TechCard.components).joinedload(TechCardItem.ingredient))
-        )
-        
-        # 1.3 Списываем ингредиенты блюда
-        if tech_card:
-            for component in tech_card.components:
-                if component.is_takeaway and not is_takeaway_order:
-                    continue
-
-                gross = Decimal(str(component.gross_amount))
-                qty_item = Decimal(str(order_item.quantity))
-                total_qty = gross * qty_item
-                
-                cost = component.ingredient.current_cost if component.ingredient.current_cost else 0
-                add_deduction(real_prod_storage_id, component.ingredient_id, total_qty, cost)
-        else:
-            # Можно логировать, что нет техкарты
-            # logger.warning(f"Для товару ID {order_item.product_id} відсутня Техкарта.")
-            pass
-        
-        # 1.4 Списываем ингредиенты модификаторов
-        if order_item.modifiers:
-            for mod_data in order_item.modifiers:
-                ing_id = mod_data.get('ingredient_id')
-                ing_qty_val = mod_data.get('ingredient_qty')
-                
-                # Склад для модификатора
-                mod_target_wh_id = mod_data.get('warehouse_id')
-
-                # Если в JSON нет данных (старые заказы), пробуем найти в БД
-                if not ing_id or not ing_qty_val:
-                    mod_id = mod_data.get('id')
-                    if mod_id:
-                        modifier_db = await session.get(Modifier, mod_id)
-                        if modifier_db:
-                            ing_id = modifier_db.ingredient_id
-                            ing_qty_val = modifier_db.ingredient_qty
-                            if not mod_target_wh_id:
-                                mod_target_wh_id = modifier_db.warehouse_id
-
-                # Если склад модификатора не найден, берем цех блюда
-                if not mod_target_wh_id:
-                    mod_target_wh_id = prod_wh_id
-
-                # Если есть что списывать
-                if ing_id and ing_qty_val:
-                    ing_db = await session.get(Ingredient, ing_id)
-                    cost = ing_db.current_cost if (ing_db and ing_db.current_cost) else 0
-                    
-                    real_mod_storage_id = await get_real_storage_id(mod_target_wh_id)
-                    total_mod_qty = Decimal(str(ing_qty_val)) * Decimal(str(order_item.quantity))
-                    
-                    add_deduction(real_mod_storage_id, ing_id, total_mod_qty, cost)
-
-    # --- 2. СПИСАНИЕ УПАКОВКИ (Auto Rules) ---
-    trigger = 'in_house'
-    if order.is_delivery: trigger = 'delivery'
-    elif order.order_type == 'pickup': trigger = 'pickup'
-    
-    rules_res = await session.execute(
-        select(AutoDeductionRule).where(
-            AutoDeductionRule.trigger_type.in_([trigger, 'all'])
-        ).options(joinedload(AutoDeductionRule.ingredient))
-    )
-    rules = rules_res.scalars().all()
-    
-    for rule in rules:
-        real_rule_storage_id = await get_real_storage_id(rule.warehouse_id)
-        rule_cost = rule.ingredient.current_cost if rule.ingredient.current_cost else 0
-        add_deduction(real_rule_storage_id, rule.ingredient_id, Decimal(str(rule.quantity)), rule_cost)
-
-    # --- 3. ПРОВЕДЕНИЕ ---
     # Помечаем заказ как списанный
     order.is_inventory_deducted = True
     session.add(order)
@@ -373,98 +223,9 @@ async def reverse_deduction(session: AsyncSession, order: Order):
         await session.commit()
         return
 
-    # Fallback склад
-    first_wh = await session.scalar(select(Warehouse).limit(1))
-    if not first_wh: return 
-    fallback_wh_id = first_wh.id
-    
-    return_items_by_wh = {} 
-
-    def add_return(wh_id, ing_id, qty, price):
-        target_wh = wh_id if wh_id else fallback_wh_id
-        if target_wh not in return_items_by_wh: return_items_by_wh[target_wh] = []
-        return_items_by_wh[target_wh].append({'ingredient_id': ing_id, 'qty': qty, 'price': price})
-
-    async def get_real_storage_id(wh_id: int) -> int:
-        if not wh_id: return fallback_wh_id
-        warehouse = await session.get(Warehouse, wh_id)
-        if warehouse and warehouse.linked_warehouse_id:
-            return warehouse.linked_warehouse_id
-        return wh_id
+    return_items_by_wh = await _order_lines_by_warehouse(session, order)
+    if return_items_by_wh is None: return 
 
-    is_takeaway_order = order.is_delivery or order.order_type == 'pickup'
-
-    # --- 1. ВОЗВРАТ БЛЮД И МОДИФИКАТОРОВ ---
-    for order_item in order.items:
-        product = await session.get(Product, order_item.product_id)
-        
-        prod_wh_id = fallback_wh_id
-        if product and product.production_warehouse_id:
-            prod_wh_id = product.production_warehouse_id
-        
-        real_prod_storage_id = await get_real_storage_id(prod_wh_id)
-        
-        tech_card = await session.scalar(
-            select(TechCard).where(TechCard.product_id == order_item.product_id)
-            .options(joinedload(TechCard.components).joinedload(TechCardItem.ingredient))
-        )
-        
-        if tech_card:
-            for component in tech_card.components:
-                if component.is_takeaway and not is_takeaway_order:
-                    continue
-
-                total_qty = Decimal(str(component.gross_amount)) * Decimal(str(order_item.quantity))
-                cost = component.ingredient.current_cost if component.ingredient.current_cost else 0
-                add_return(real_prod_storage_id, component.ingredient_id, total_qty, cost)
-        
-        # Возврат модификаторов
-        if order_item.modifiers:
-            for mod_data in order_item.modifiers:
-                ing_id = mod_data.get('ingredient_id')
-                ing_qty_val = mod_data.get('ingredient_qty')
-                mod_target_wh_id = mod_data.get('warehouse_id')
-
-                if not ing_id or not ing_qty_val:
-                    mod_id = mod_data.get('id')
-                    if mod_id:
-                        modifier_db = await session.get(Modifier, mod_id)
-                        if modifier_db:
-                            ing_id = modifier_db.ingredient_id
-                            ing_qty_val = modifier_db.ingredient_qty
-                            if not mod_target_wh_id:
-                                mod_target_wh_id = modifier_db.warehouse_id
-
-                if not mod_target_wh_id:
-                    mod_target_wh_id = prod_wh_id
-
-                if ing_id and ing_qty_val:
-                    ing_db = await session.get(Ingredient, ing_id)
-                    cost = ing_db.current_cost if (ing_db and ing_db.current_cost) else 0
-                    
-                    real_mod_storage_id = await get_real_storage_id(mod_target_wh_id)
-                    total_mod_qty = Decimal(str(ing_qty_val)) * Decimal(str(order_item.quantity))
-                    
-                    add_return(real_mod_storage_id, ing_id, total_mod_qty, cost)
-
-    # --- 2. ВОЗВРАТ УПАКОВКИ ---
-    trigger = 'in_house'
-    if order.is_delivery: trigger = 'delivery'
-    elif order.order_type == 'pickup': trigger = 'pickup'
-    
-    rules_res = await session.execute(
-        select(AutoDeductionRule).where(
-            AutoDeductionRule.trigger_type.in_([trigger, 'all'])
-        ).options(joinedload(AutoDeductionRule.ingredient))
-    )
-    rules = rules_res.scalars().all()
-    
-    for rule in rules:
-        real_rule_storage_id = await get_real_storage_id(rule.warehouse_id)
-        rule_cost = rule.ingredient.current_cost if rule.ingredient.current_cost else 0
-        add_return(real_rule_storage_id, rule.ingredient_id, Decimal(str(rule.quantity)), rule_cost)
-
-    # --- 3. ПРОВЕДЕНИЕ ВОЗВРАТА ---
     for wh_id, items in return_items_by_wh.items():
         if items:
             await process_movement(
@@ -491,8 +252,10 @@ async def generate_cook_ticket(session: AsyncSession, order_id: int) -> str:
         <hr style="border-top: 1px dashed #000;">
     """
     
+    plans = await deduction_plans.get(session)
+
     for item in items:
-        tc = await session.scalar(select(TechCard).where(TechCard.product_id == item.product_id))
+        cooking_method = plans.product(item.product_id).cooking_method
         
         mods_html = ""
         if item.modifiers:
@@ -504,8 +267,8 @@ async def generate_cook_ticket(session: AsyncSession, order_id: int) -> str:
         html += f"{mods_html}"
         html += f"<div style='font-size:1.1em;'>К-сть: {item.quantity}</div>"
         
-        if tc and tc.cooking_method:
-            html += f"<div style='font-size:0.8em; color:#333; margin-top:2px; font-style:italic;'>{tc.cooking_method}</div>"
+        if cooking_method:
+            html += f"<div style='font-size:0.8em; color:#333; margin-top:2px; font-style:italic;'>{cooking_method}</div>"
             
     html += "<hr style='border-top: 1px dashed #000;'><div style='text-align:center; font-size:0.8em;'>Гарної роботи!</div></div>"
     html += "<script>window.print();</script>"
@@ -530,12 +293,14 @@ async def process_inventory_check(session: AsyncSession, doc_id: int):
     surplus_items = []
     shortage_items = []
 
+    # Усі рядки складу блокуємо одним запитом
+    locked = await lock_stock_rows(session, [(warehouse_id, item.ingredient_id) for item in inv_doc.items])
+
     for item in inv_doc.items:
         actual_qty = Decimal(str(item.quantity))
         ingredient_id = item.ingredient_id
         
-        stock = await get_stock(session, warehouse_id, ingredient_id)
-        system_qty = Decimal(str(stock.quantity))
+        system_qty = locked[(warehouse_id, ingredient_id)][1]
         
         diff = actual_qty - system_qty
         
@@ -51,12 +51,26 @@ from inventory_models import Unit, Warehouse, Modifier
 from admin_handlers import register_admin_handlers
 from courier_handlers import register_courier_handlers
 from notification_manager import notify_new_order_to_staff
+from notification_outbox import enqueue_notification, outbox_worker, OUTBOX_NEW_ORDER
+from inventory_jobs import inventory_worker, is_deferred as inventory_deferred
 from admin_clients import router as clients_router
-from dependencies import get_db_session, check_credentials
-from auth_utils import get_password_hash 
+from dependencies import get_db_session, get_read_db_session, check_credentials
+from settings_cache import settings_cache
+from status_registry import status_registry, STATUS_NEW
+from auth_utils import get_password_hash, decode_staff_token
 
 # Імпорт менеджера WebSocket
 from websocket_manager import manager
+from telegram_dispatcher import tg_dispatcher
+from stock_posting import posting_stats, ensure_stock_unique_index
+from stock_ledger import snapshot_worker
+from sales_rollup import sales_rollup_worker
+from db_metrics import db_metrics, current_route, route_label
+from event_bus import event_bus
+from menu_cache import menu_cache
+from http_cache import cached_response
+from page_cache import storefront_cache
+from pagination import fetch_keyset_page, estimated_total, keyset_links
 
 # --- ІМПОРТИ РОУТЕРІВ ---
 from admin_order_management import router as admin_order_router
@@ -137,7 +151,7 @@ async def handle_dynamic_menu_item(message: Message, session: AsyncSession):
 @dp.message(CommandStart())
 async def command_start_handler(message: Message, state: FSMContext, session: AsyncSession):
     await state.clear()
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     default_welcome = f"Шановний {{user_name}}, ласкаво просимо! 👋\n\nМи раді вас бачити. Оберіть опцію:"
     welcome_template = settings.telegram_welcome_message or default_welcome
     try:
@@ -182,7 +196,7 @@ async def back_to_start_menu(callback: CallbackQuery, state: FSMContext, session
     try: await callback.message.delete()
     except TelegramBadRequest: pass
 
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     default_welcome = f"Шановний {{user_name}}, ласкаво просимо! 👋\n\nМи раді вас бачити. Оберіть опцію:"
     welcome_template = settings.telegram_welcome_message or default_welcome
     try:
@@ -973,6 +987,9 @@ async def lifespan(app: FastAPI):
     
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+
+    async with engine.begin() as conn:
+        await ensure_stock_unique_index(conn)
     
     async with async_session_maker() as session:
         result_status = await session.execute(select(OrderStatus).limit(1))
@@ -1020,7 +1037,21 @@ async def lifespan(app: FastAPI):
             await session.commit()
         # --------------------------------------------------------------
 
+        # Рядок налаштувань (id=1) має існувати для кешу налаштувань
+        if not await session.get(Settings, 1):
+            session.add(Settings(id=1))
+
         await session.commit()
+
+    # Знімок налаштувань завантажуємо окремою сесією, щоб підтягнути server_default
+    async with async_session_maker() as session:
+        await settings_cache.load(session)
+
+    # Шина подій між воркерами (EVENT_BUS=postgres); без неї працює в межах процесу
+    try:
+        await event_bus.start()
+    except Exception as e:
+        logging.error(f"EventBus не запущено, події доставлятимуться лише локально: {e}")
     
     client_token = os.environ.get('CLIENT_BOT_TOKEN')
     admin_token = os.environ.get('ADMIN_BOT_TOKEN')
@@ -1041,10 +1072,24 @@ async def lifespan(app: FastAPI):
 
     app.state.client_bot = client_bot
     app.state.admin_bot = admin_bot
+
+    # Фонова відправка сповіщень з notification_outbox
+    outbox_worker.start(admin_bot)
+    # Пакетне списання зі складу (INVENTORY_DEDUCTION_MODE=deferred)
+    if inventory_deferred():
+        inventory_worker.start()
+    # Періодичні знімки залишків для журналу руху (stock_movements)
+    snapshot_worker.start()
+    # Денні підсумки продажів для звітів (daily_sales)
+    sales_rollup_worker.start()
     
     yield
     
     logging.info("Зупинка додатка...")
+    await outbox_worker.stop()
+    await inventory_worker.stop()
+    await snapshot_worker.stop()
+    await sales_rollup_worker.stop()
     if bot_task:
         bot_task.cancel()
         try:
@@ -1054,9 +1099,21 @@ async def lifespan(app: FastAPI):
     
     if client_bot: await client_bot.session.close()
     if admin_bot: await admin_bot.session.close()
+    await event_bus.stop()
 
 
 app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def db_route_label_middleware(request: Request, call_next):
+    """Мітка маршруту для метрик БД (очікування пулу і час запитів)."""
+    token = current_route.set(route_label(request.app.router.routes, request.scope))
+    try:
+        return await call_next(request)
+    finally:
+        current_route.reset(token)
+
 os.makedirs("static", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -1065,7 +1122,17 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 @app.websocket("/ws/staff")
 async def websocket_staff_endpoint(websocket: WebSocket):
     """WebSocket для персоналу (PWA)"""
-    await manager.connect_staff(websocket)
+    # Співробітник з JWT-кукі: за його роллю та цехами фільтруються події
+    employee_id = decode_staff_token(websocket.cookies.get("staff_access_token"))
+    employee = None
+    if employee_id:
+        async with async_session_maker() as session:
+            employee = await session.get(Employee, employee_id)
+    if not employee:
+        await websocket.close(code=1008)
+        return
+
+    await manager.connect_staff(websocket, employee)
     try:
         while True:
             # Просто підтримуємо з'єднання, можна обробляти вхідні повідомлення (ping/pong)
@@ -1089,6 +1156,32 @@ async def websocket_table_endpoint(websocket: WebSocket, table_id: int):
         logging.error(f"Table WS Error: {e}")
         manager.disconnect_table(websocket, table_id)
 
+@app.get("/admin/api/ws-metrics", response_class=JSONResponse)
+async def websocket_metrics(username: str = Depends(check_credentials)):
+    """Метрики WebSocket-розсилки: кількість з'єднань, затримка доставки, відключені клієнти."""
+    return JSONResponse(manager.metrics())
+
+
+@app.get("/admin/api/telegram-metrics", response_class=JSONResponse)
+async def telegram_metrics(username: str = Depends(check_credentials)):
+    """Метрики розсилки в Telegram: доставлено, помилки, RetryAfter, затримка по типах повідомлень."""
+    return JSONResponse(tg_dispatcher.metrics())
+
+
+@app.get("/admin/api/stock-posting-metrics", response_class=JSONResponse)
+async def stock_posting_metrics(username: str = Depends(check_credentials)):
+    """Метрики проведення складських документів: повтори після конфліктів, очікування блокувань."""
+    return JSONResponse(posting_stats.snapshot())
+
+
+@app.get("/admin/api/db-metrics", response_class=JSONResponse)
+async def db_pool_metrics(username: str = Depends(check_credentials)):
+    """Метрики БД: стан пулу, очікування з'єднання і час запитів по маршрутах."""
+    engines = {"primary": engine}
+    if replica_engine is not engine:
+        engines["replica"] = replica_engine
+    return JSONResponse(db_metrics.snapshot(engines))
+
 app.include_router(in_house_menu_router)
 app.include_router(clients_router)
 app.include_router(admin_order_router)
@@ -1125,8 +1218,13 @@ async def get_settings(session: AsyncSession) -> Settings:
     return settings
 
 @app.get("/", response_class=HTMLResponse)
-async def get_web_ordering_page(session: AsyncSession = Depends(get_db_session)):
-    settings = await get_settings(session)
+async def get_web_ordering_page(request: Request, session: AsyncSession = Depends(get_db_session)):
+    # Сторінка рендериться лише після зміни дизайну/налаштувань/сторінок меню
+    payload = await storefront_cache.get(lambda: _render_web_ordering_page(session))
+    return cached_response(request, payload)
+
+async def _render_web_ordering_page(session: AsyncSession) -> str:
+    settings = await settings_cache.get(session)
     logo_html = f'<img src="/{settings.logo_url}" alt="Логотип" class="header-logo">' if settings.logo_url else ''
 
     # Отримуємо сторінки меню для футера
@@ -1178,7 +1276,7 @@ async def get_web_ordering_page(session: AsyncSession = Depends(get_db_session))
         "free_delivery_from_val": float(free_delivery) if free_delivery != "null" else "null",
     }
 
-    return HTMLResponse(content=WEB_ORDER_HTML.format(**template_params))
+    return WEB_ORDER_HTML.format(**template_params)
 
 @app.get("/api/page/{item_id}", response_class=JSONResponse)
 async def get_menu_page_content(item_id: int, session: AsyncSession = Depends(get_db_session)):
@@ -1189,45 +1287,10 @@ async def get_menu_page_content(item_id: int, session: AsyncSession = Depends(ge
         
     return {"title": menu_item.title, "content": menu_item.content}
 @app.get("/api/menu")
-async def get_menu_data(session: AsyncSession = Depends(get_db_session)):
+async def get_menu_data(request: Request, session: AsyncSession = Depends(get_db_session)):
     try:
-        categories_res = await session.execute(
-            select(Category)
-            .where(Category.show_on_delivery_site == True)
-            .order_by(Category.sort_order, Category.name)
-        )
-        categories = [{"id": c.id, "name": c.name} for c in categories_res.scalars().all()]
-        
-        products_res = await session.execute(
-            select(Product)
-            .options(selectinload(Product.modifiers)) 
-            .join(Category)
-            .where(Product.is_active == True, Category.show_on_delivery_site == True)
-        )
-        
-        products = []
-        for p in products_res.scalars().all():
-            mods_list = []
-            if p.modifiers:
-                for m in p.modifiers:
-                    price_val = m.price if m.price is not None else 0
-                    mods_list.append({
-                        "id": m.id, 
-                        "name": m.name, 
-                        "price": float(price_val)
-                    })
-            
-            products.append({
-                "id": p.id, 
-                "name": p.name, 
-                "description": p.description, 
-                "price": float(p.price), 
-                "image_url": p.image_url, 
-                "category_id": p.category_id,
-                "modifiers": mods_list 
-            })
-
-        return JSONResponse(content={"categories": categories, "products": products})
+        snapshot = await menu_cache.get(session)
+        return cached_response(request, snapshot.delivery)
     except Exception as e:
         logging.error(f"Error in /api/menu: {e}", exc_info=True)
         return JSONResponse(status_code=500, content={"detail": "Internal Server Error", "error": str(e)})
@@ -1309,7 +1372,7 @@ async def place_web_order(request: Request, order_data: dict = Body(...), sessio
                 modifiers=final_modifiers_data 
             ))
 
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     delivery_cost = Decimal(0)
 
     is_delivery = order_data.get('is_delivery', True)
@@ -1336,17 +1399,16 @@ async def place_web_order(request: Request, order_data: dict = Body(...), sessio
         items=order_items_objects
     )
     session.add(order)
+    await session.flush()
+    # Сповіщення персоналу - фоновим воркером, відповідь клієнту не чекає на Telegram
+    enqueue_notification(session, OUTBOX_NEW_ORDER, {"order_id": order.id})
     await session.commit()
-    await session.refresh(order)
-
-    if request.app.state.admin_bot:
-        await notify_new_order_to_staff(request.app.state.admin_bot, order, session)
 
     return JSONResponse(content={"message": "Замовлення успішно розміщено", "order_id": order.id})
 
 @app.get("/admin", response_class=HTMLResponse)
-async def admin_dashboard(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
-    settings = await get_settings(session)
+async def admin_dashboard(session: AsyncSession = Depends(get_read_db_session), primary: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+    settings = await settings_cache.get(primary)
     orders_res = await session.execute(select(Order).order_by(Order.id.desc()).limit(5))
     orders_count_res = await session.execute(select(func.count(Order.id)))
     products_count_res = await session.execute(select(func.count(Product.id)))
@@ -1370,7 +1432,7 @@ async def admin_dashboard(session: AsyncSession = Depends(get_db_session), usern
 
 @app.get("/admin/categories", response_class=HTMLResponse)
 async def admin_categories(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
-    settings = await get_settings(session)
+    settings = await settings_cache.get(session)
     categories_res = await session.execute(select(Category).order_by(Category.sort_order, Category.name))
     categories = categories_res.scalars().all()
 
@@ -1386,6 +1448,7 @@ async def admin_categories(session: AsyncSession = Depends(get_db_session), user
 async def add_category(name: str = Form(...), sort_order: int = Form(100), show_on_delivery_site: bool = Form(False), show_in_restaurant: bool = Form(False), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
     session.add(Category(name=name, sort_order=sort_order, show_on_delivery_site=show_on_delivery_site, show_in_restaurant=show_in_restaurant))
     await session.commit()
+    menu_cache.invalidate()
     return RedirectResponse(url="/admin/categories", status_code=303)
 
 @app.post("/admin/edit_category/{cat_id}")
@@ -1398,6 +1461,7 @@ async def edit_category(cat_id: int, name: Optional[str] = Form(None), sort_orde
         elif field in ["show_on_delivery_site", "show_in_restaurant"]:
             setattr(category, field, value.lower() == 'true')
         await session.commit()
+        menu_cache.invalidate()
     return RedirectResponse(url="/admin/categories", status_code=303)
 
 @app.get("/admin/delete_category/{cat_id}")
@@ -1409,15 +1473,15 @@ async def delete_category(cat_id: int, session: AsyncSession = Depends(get_db_se
              return RedirectResponse(url="/admin/categories?error=category_in_use", status_code=303)
         await session.delete(category)
         await session.commit()
+        menu_cache.invalidate()
     return RedirectResponse(url="/admin/categories", status_code=303)
 
 @app.get("/admin/orders", response_class=HTMLResponse)
-async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
-    settings = await get_settings(session)
+async def admin_orders(after: Optional[int] = Query(None), before: Optional[int] = Query(None), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+    settings = await settings_cache.get(session)
     per_page = 15
-    offset = (page - 1) * per_page
     
-    query = select(Order).options(joinedload(Order.status), selectinload(Order.items)).order_by(Order.id.desc())
+    query = select(Order).options(joinedload(Order.status), selectinload(Order.items))
     
     filters = []
     if q:
@@ -1432,13 +1496,18 @@ async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="s
     count_query = select(func.count(Order.id))
     if filters:
         count_query = count_query.where(*filters)
-        
-    total_res = await session.execute(count_query)
-    total = total_res.scalar_one_or_none() or 0
-    
-    orders_res = await session.execute(query.limit(per_page).offset(offset))
-    orders = orders_res.scalars().all()
-    pages = (total // per_page) + (1 if total % per_page > 0 else 0)
+    total = await estimated_total(session, None if filters else "orders", ("orders", q), count_query)
+
+    # Keyset по Order.id замість OFFSET: глибокі сторінки коштують стільки ж, скільки перша
+    if before is not None:
+        query = query.where(Order.id > before)
+    elif after is not None:
+        query = query.where(Order.id < after)
+    page = await fetch_keyset_page(
+        session, query, per_page, (Order.id.desc(),), (Order.id.asc(),),
+        backward=before is not None, has_cursor=after is not None
+    )
+    orders = page.items
 
     rows = ""
     for o in orders:
@@ -1460,13 +1529,7 @@ async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="s
             </td>
         </tr>"""
 
-    links_orders = []
-    for i in range(1, pages + 1):
-        search_part = f'&search={q}' if q else ''
-        class_part = 'active' if i == page else ''
-        links_orders.append(f'<a href="/admin/orders?page={i}{search_part}" class="{class_part}">{i}</a>')
-    
-    pagination = f"<div class='pagination'>{' '.join(links_orders)}</div>"
+    pagination = keyset_links("/admin/orders", [("search", q)], page, lambda o: str(o.id), total, "замовлень")
 
     body = f"""
     <div class="card">
@@ -1480,7 +1543,7 @@ async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="s
         </form>
         <table><thead><tr><th>ID</th><th>Клієнт</th><th>Телефон</th><th>Сума</th><th>Статус</th><th>Склад</th><th>Дії</th></tr></thead><tbody>
         {rows or "<tr><td colspan='7'>Немає замовлень</td></tr>"}
-        </tbody></table>{pagination if pages > 1 else ''}
+        </tbody></table>{pagination}
     </div>"""
     active_classes = {key: "" for key in ["main_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active", "inventory_active"]}
     active_classes["orders_active"] = "active"
@@ -1488,7 +1551,7 @@ async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="s
 
 @app.get("/admin/order/new", response_class=HTMLResponse)
 async def get_add_order_form(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
-    settings = await get_settings(session)
+    settings = await settings_cache.get(session)
     initial_data = {"items": {}, "action": "/api/admin/order/new", "submit_text": "Створити замовлення", "form_values": None}
     script = f"<script>document.addEventListener('DOMContentLoaded',()=>{{if(typeof window.initializeForm==='function'&&!window.orderFormInitialized){{window.initializeForm({json.dumps(initial_data)});window.orderFormInitialized=true;}}else if(!window.initializeForm){{document.addEventListener('formScriptLoaded',()=>{{if(!window.orderFormInitialized){{window.initializeForm({json.dumps(initial_data)});window.orderFormInitialized=true;}}}});}}}});</script>"
     body = ADMIN_ORDER_FORM_BODY + script
@@ -1498,7 +1561,7 @@ async def get_add_order_form(session: AsyncSession = Depends(get_db_session), us
 
 @app.get("/admin/order/edit/{order_id}", response_class=HTMLResponse)
 async def get_edit_order_form(order_id: int, session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
-    settings = await get_settings(session)
+    settings = await settings_cache.get(session)
     order = await session.get(Order, order_id, options=[joinedload(Order.status), selectinload(Order.items)])
     if not order: raise HTTPException(404, "Замовлення не знайдено")
 
@@ -1564,14 +1627,18 @@ async def _process_and_save_order(order: Order, data: dict, session: AsyncSessio
     if is_new_order:
         session.add(order)
         if not order.status_id:
-            new_status_res = await session.execute(select(OrderStatus.id).where(OrderStatus.name == "Новий").limit(1))
-            order.status_id = new_status_res.scalar_one_or_none() or 1
+            new_status = (await status_registry.get(session)).by_name(STATUS_NEW)
+            order.status_id = new_status.id if new_status else 1
         
         await session.flush()
         
         for item in new_items:
             item.order_id = order.id
             session.add(item)
+
+        session.add(OrderStatusHistory(order_id=order.id, status_id=order.status_id, actor_info="Адміністративна панель"))
+        # Сповіщення - фоновим воркером, в тій самій транзакції, що й замовлення
+        enqueue_notification(session, OUTBOX_NEW_ORDER, {"order_id": order.id})
     else:
         for item in new_items:
             item.order_id = order.id
@@ -1580,16 +1647,6 @@ async def _process_and_save_order(order: Order, data: dict, session: AsyncSessio
     await session.commit()
     await session.refresh(order)
 
-    if is_new_order:
-        try:
-             session.add(OrderStatusHistory(order_id=order.id, status_id=order.status_id, actor_info="Адміністративна панель"))
-             await session.commit()
-        except Exception as e: logging.error(f"History error: {e}")
-
-        admin_bot = request.app.state.admin_bot
-        if admin_bot:
-            await notify_new_order_to_staff(admin_bot, order, session)
-
 @app.post("/api/admin/order/new", response_class=JSONResponse)
 async def api_create_order(request: Request, session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
     try: data = await request.json()
@@ -1619,7 +1676,7 @@ async def api_update_order(order_id: int, request: Request, session: AsyncSessio
 
 @app.get("/admin/reports", response_class=HTMLResponse)
 async def admin_reports_menu(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
-    settings = await get_settings(session)
+    settings = await settings_cache.get(session)
     
     body = ADMIN_REPORTS_BODY
     
@@ -1635,7 +1692,7 @@ async def admin_reports_menu(session: AsyncSession = Depends(get_db_session), us
 
 @app.get("/admin/settings", response_class=HTMLResponse)
 async def admin_settings_page(saved: bool = False, session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
-    settings = await get_settings(session)
+    settings = await settings_cache.get(session)
     
     current_logo_html = f'<img src="/{settings.logo_url}" alt="Лого" style="height: 50px;">' if settings.logo_url else "Логотип не завантажено"
     cache_buster = secrets.token_hex(4)
@@ -1678,6 +1735,8 @@ async def save_admin_settings(session: AsyncSession = Depends(get_db_session), u
             except Exception as e: logging.error(f"Save favicon error: {e}")
 
     await session.commit()
+    await settings_cache.refresh(session)
+    storefront_cache.invalidate()
     return RedirectResponse(url="/admin/settings?saved=true", status_code=303)
 
 
@@ -0,0 +1,156 @@
+# menu_cache.py
+
+import asyncio
+import json
+import logging
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from models import Category, Product
+from http_cache import CachedPayload
+from event_bus import event_bus, ALL_CACHES
+
+logger = logging.getLogger(__name__)
+
+
+def _dump(data) -> bytes:
+    # Той самий формат, що й у JSONResponse
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class MenuSnapshot:
+    """
+    Зібране меню для конкретної версії каталогу.
+    ETag та стиснуті варіанти публічного меню рахуються тут один раз.
+    """
+
+    def __init__(self, version: int, delivery: dict, restaurant: dict, staff: dict):
+        self.version = version
+        # /api/menu (сайт та доставка)
+        self.delivery = CachedPayload(_dump(delivery), "application/json")
+        # /api/menu/restaurant (QR-меню столика)
+        self.restaurant = CachedPayload(_dump(restaurant), "application/json")
+        # /staff/api/menu/full (PWA офіціанта)
+        self.staff_json: bytes = _dump(staff)
+
+
+class MenuCatalogCache:
+    """
+    Кеш каталогу меню (категорії, страви, модифікатори).
+    Версія збільшується адмін-ендпоінтами після зміни меню,
+    знімок перебудовується не частіше одного разу на версію.
+    """
+
+    def __init__(self):
+        self.version: int = 1
+        self._snapshot: Optional[MenuSnapshot] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, broadcast: bool = True):
+        """Викликати ПІСЛЯ commit змін категорій, страв або модифікаторів."""
+        self.version += 1
+        if broadcast:
+            # Інші воркери теж скидають свій знімок
+            event_bus.publish_nowait("cache_invalidate", {"cache": "menu"})
+
+    async def get(self, session: AsyncSession) -> MenuSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+
+        async with self._lock:
+            # Інший запит міг уже перебудувати кеш, поки ми чекали на lock
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == self.version:
+                return snapshot
+
+            version = self.version
+            snapshot = await _build_snapshot(session, version)
+            self._snapshot = snapshot
+            return snapshot
+
+
+async def _build_snapshot(session: AsyncSession, version: int) -> MenuSnapshot:
+    categories = (await session.execute(
+        select(Category).order_by(Category.sort_order, Category.name)
+    )).scalars().all()
+
+    products = (await session.execute(
+        select(Product)
+        .options(selectinload(Product.modifiers))
+        .where(Product.is_active == True)
+        .order_by(Product.id)
+    )).scalars().all()
+
+    categories_by_id = {c.id: c for c in categories}
+
+    delivery_products = []
+    restaurant_products = []
+    staff_products_by_cat = {}
+
+    for p in products:
+        category = categories_by_id.get(p.category_id)
+        if not category:
+            continue
+
+        mods_list = []
+        for m in p.modifiers or []:
+            price_val = m.price if m.price is not None else 0
+            mods_list.append({"id": m.id, "name": m.name, "price": float(price_val)})
+
+        public_item = {
+            "id": p.id,
+            "name": p.name,
+            "description": p.description,
+            "price": float(p.price),
+            "image_url": p.image_url,
+            "category_id": p.category_id,
+            "modifiers": mods_list
+        }
+
+        if category.show_on_delivery_site:
+            delivery_products.append(public_item)
+
+        if category.show_in_restaurant:
+            restaurant_products.append(public_item)
+            staff_products_by_cat.setdefault(category.id, []).append({
+                "id": p.id,
+                "name": p.name,
+                "price": float(p.price),
+                "preparation_area": p.preparation_area,
+                "production_warehouse_id": p.production_warehouse_id,
+                "modifiers": mods_list
+            })
+
+    delivery = {
+        "categories": [{"id": c.id, "name": c.name} for c in categories if c.show_on_delivery_site],
+        "products": delivery_products
+    }
+    restaurant = {
+        "categories": [{"id": c.id, "name": c.name} for c in categories if c.show_in_restaurant],
+        "products": restaurant_products
+    }
+    staff = {
+        "menu": [
+            {"id": c.id, "name": c.name, "products": staff_products_by_cat.get(c.id, [])}
+            for c in categories if c.show_in_restaurant
+        ]
+    }
+
+    logger.info(f"Кеш меню перебудовано (версія {version}): {len(products)} активних страв")
+    return MenuSnapshot(version, delivery, restaurant, staff)
+
+
+# Глобальний екземпляр
+menu_cache = MenuCatalogCache()
+
+
+def _on_remote_invalidate(payload: dict):
+    if payload.get("cache") in ("menu", ALL_CACHES):
+        menu_cache.invalidate(broadcast=False)
+
+
+event_bus.subscribe("cache_invalidate", _on_remote_invalidate)
@@ -1,15 +1,17 @@
 # models.py
 
 import sqlalchemy as sa
-from sqlalchemy.orm import sessionmaker, DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.orm import sessionmaker, Session, DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy import text, ForeignKey, JSON, func
 from typing import Optional, List, TYPE_CHECKING
-from datetime import datetime
+from datetime import date, datetime
 import secrets
 import os
 from decimal import Decimal
 
+from db_metrics import TimedAsyncQueuePool, instrument_engine
+
 # Якщо потрібно для тайп-хінтингу (щоб IDE розуміла, що таке Modifier),
 # але уникаючи циклічного імпорту в рантаймі
 if TYPE_CHECKING:
@@ -20,9 +22,67 @@ DATABASE_URL = os.environ.get('DATABASE_URL')
 if not DATABASE_URL:
     raise ValueError("Помилка: Змінна оточення DATABASE_URL не встановлена.")
 
-engine = create_async_engine(DATABASE_URL)
+# Пул з'єднань: на піку staff PWA (polling) і два диспетчери ботів ділять один пул
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+# Кеш підготовлених запитів asyncpg; 0 - для pgbouncer у режимі transaction
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', '100'))
+# Обмеження часу запиту в межах HTTP-запиту (мс, 0 - без обмеження), див. dependencies.get_db_session
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '15000'))
+
+# Необов'язкова репліка лише для читання: звіти і дашборди (див. dependencies.get_read_db_session)
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+DB_REPLICA_POOL_SIZE = int(os.environ.get('DB_REPLICA_POOL_SIZE', '5'))
+DB_REPLICA_MAX_OVERFLOW = int(os.environ.get('DB_REPLICA_MAX_OVERFLOW', '5'))
+# Звіти за довгі періоди важчі за звичайні запити (мс)
+DB_REPORT_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_REPORT_STATEMENT_TIMEOUT_MS', '60000'))
+
+
+def _create_engine(url: str, pool_size: int, max_overflow: int, read_only: bool = False):
+    connect_args = {}
+    if url.startswith('postgresql+asyncpg'):
+        connect_args = {
+            'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+            'statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+        }
+        if read_only:
+            # Випадковий запис через сесію репліки падає одразу, а не на рівні реплікації
+            connect_args['server_settings'] = {'default_transaction_read_only': 'on'}
+    new_engine = create_async_engine(
+        url,
+        poolclass=TimedAsyncQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+    instrument_engine(new_engine)
+    return new_engine
+
+
+engine = _create_engine(DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW)
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+if DATABASE_REPLICA_URL:
+    replica_engine = _create_engine(DATABASE_REPLICA_URL, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW, read_only=True)
+    replica_session_maker = sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False)
+else:
+    # Без репліки звіти читають з primary
+    replica_engine = engine
+    replica_session_maker = async_session_maker
+
+
+@sa.event.listens_for(Session, "after_begin")
+def _apply_statement_timeout(session, transaction, connection):
+    """SET LOCAL statement_timeout для сесій, яким його задано через session.info."""
+    timeout_ms = session.info.get("statement_timeout_ms")
+    if timeout_ms:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
 
 class Base(DeclarativeBase):
     pass
@@ -148,6 +208,27 @@ class StaffNotification(Base):
     employee: Mapped["Employee"] = relationship("Employee", back_populates="notifications")
 
 
+class NotificationOutbox(Base):
+    """
+    Черга фонових сповіщень (Telegram, PWA, WebSocket).
+    Запис додається в тій самій транзакції, що й замовлення; відправляє notification_outbox.py.
+    """
+    __tablename__ = 'notification_outbox'
+    __table_args__ = (
+        sa.Index('ix_notification_outbox_pending', 'status', 'next_attempt_at'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(sa.String(50), nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    # pending -> processing -> (запис видаляється) | failed
+    status: Mapped[str] = mapped_column(sa.String(20), default='pending', server_default=text("'pending'"), nullable=False)
+    attempts: Mapped[int] = mapped_column(sa.Integer, default=0, server_default=text("0"), nullable=False)
+    next_attempt_at: Mapped[datetime] = mapped_column(sa.DateTime, default=func.now(), server_default=func.now(), nullable=False)
+    locked_at: Mapped[Optional[datetime]] = mapped_column(sa.DateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(sa.Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(sa.DateTime, default=func.now(), server_default=func.now())
+
+
 class Category(Base):
     __tablename__ = 'categories'
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -429,6 +510,49 @@ class Settings(Base):
     free_delivery_from: Mapped[Optional[Decimal]] = mapped_column(sa.Numeric(10, 2), nullable=True)
 
 
+class DailySales(Base):
+    """
+    Денний підсумок замовлень у фінальних статусах (див. sales_rollup.py).
+    Один рядок на дату створення + результат + тип + оплата + кур'єр + офіціант.
+    """
+    __tablename__ = 'daily_sales'
+    __table_args__ = (
+        sa.Index('ix_daily_sales_date', 'sale_date', 'outcome'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    sale_date: Mapped[date] = mapped_column(sa.Date, nullable=False)
+    # completed / cancelled
+    outcome: Mapped[str] = mapped_column(sa.String(10), nullable=False)
+    order_type: Mapped[str] = mapped_column(sa.String(20), nullable=False)
+    payment_method: Mapped[Optional[str]] = mapped_column(sa.String(20), nullable=True)
+    courier_id: Mapped[Optional[int]] = mapped_column(sa.ForeignKey('employees.id', ondelete="SET NULL"), nullable=True)
+    waiter_id: Mapped[Optional[int]] = mapped_column(sa.ForeignKey('employees.id', ondelete="SET NULL"), nullable=True)
+    orders_count: Mapped[int] = mapped_column(sa.Integer, nullable=False)
+    revenue: Mapped[Decimal] = mapped_column(sa.Numeric(12, 2), nullable=False)
+
+
+class DailyProductSales(Base):
+    """Денний підсумок продажів по стравах (позиції замовлень у фінальних статусах)."""
+    __tablename__ = 'daily_product_sales'
+    __table_args__ = (
+        sa.Index('ix_daily_product_sales_date', 'sale_date', 'outcome'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    sale_date: Mapped[date] = mapped_column(sa.Date, nullable=False)
+    outcome: Mapped[str] = mapped_column(sa.String(10), nullable=False)
+    product_id: Mapped[Optional[int]] = mapped_column(sa.ForeignKey('products.id', ondelete="SET NULL"), nullable=True)
+    product_name: Mapped[str] = mapped_column(sa.String(100), nullable=False)
+    quantity: Mapped[int] = mapped_column(sa.Integer, nullable=False)
+    revenue: Mapped[Decimal] = mapped_column(sa.Numeric(12, 2), nullable=False)
+
+
+class SalesRollupDirtyDate(Base):
+    """Дати, підсумки яких треба перерахувати (черга для sales_rollup.SalesRollupWorker)."""
+    __tablename__ = 'sales_rollup_dirty_dates'
+    sale_date: Mapped[date] = mapped_column(sa.Date, primary_key=True)
+    marked_at: Mapped[datetime] = mapped_column(sa.DateTime, default=func.now(), server_default=func.now(), nullable=False)
+
+
 async def create_db_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -1,21 +1,24 @@
 # notification_manager.py
 
+import asyncio
 import logging
 import os
 import html as html_module
-from aiogram import Bot
+from aiogram import Bot, html as aiogram_html
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload, joinedload
 
-from models import Order, OrderStatus, Employee, Role, OrderItem, StaffNotification
+from models import Order, Employee, OrderItem, StaffNotification, Product, Table, waiter_table_association
+from status_registry import status_registry
+from shift_roster import shift_roster
 # --- СКЛАД: Импорт функций списания и возврата ---
-from inventory_service import deduct_products_by_tech_card, reverse_deduction
-from inventory_models import InventoryDoc 
+from inventory_jobs import request_deduction, request_reversal, request_writeoff, has_pending_deduction, is_deferred
 
 # Импорт менеджера WebSocket для отправки событий
-from websocket_manager import manager
+from websocket_manager import manager, StaffAudience
+from telegram_dispatcher import tg_dispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -30,12 +33,35 @@ async def create_staff_notification(session: AsyncSession, employee_id: int, mes
     except Exception as e:
         logger.error(f"Error creating PWA notification for emp {employee_id}: {e}")
 
-async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: AsyncSession):
+async def _run_step(progress, name: str, action):
+    """
+    Крок сповіщення. З outbox (progress) крок, виконаний у попередній спробі, пропускається -
+    повтор після помилки не дублює вже надіслані повідомлення.
+    """
+    if progress is None:
+        await action()
+    else:
+        await progress.step(name, action)
+
+
+async def _send_step(progress, name: str, bot: Bot, chat_ids, text: str, kind: str, **kwargs):
+    """
+    Telegram-крок. З outbox тимчасова помилка доставки (мережа, 5xx, ліміт) лишає крок невиконаним:
+    повтор надсилає лише в чати, куди повідомлення не дійшло.
+    """
+    if progress is None:
+        await tg_dispatcher.send_many(bot, chat_ids, text, kind=kind, **kwargs)
+    else:
+        await progress.send(name, bot, chat_ids, text, kind, **kwargs)
+
+
+async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: AsyncSession, progress=None):
     """
     Отправляет уведомление о НОВОМ заказе:
     1. PWA: Операторам.
     2. Telegram: В админ-чат и операторам в личные.
     3. WebSocket: Мгновенное обновление интерфейса.
+    progress - отметки выполненных шагов (OutboxProgress), если вызывается из outbox.
     """
     admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
     
@@ -49,17 +75,16 @@ async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: Async
     order = result.scalar_one()
 
     # --- 1. PWA NOTIFICATION (Операторам) ---
-    operator_roles_res = await session.execute(select(Role.id).where(Role.can_manage_orders == True))
-    operator_role_ids = operator_roles_res.scalars().all()
+    roster = await shift_roster.get(session)
+    operators = roster.with_capability("can_manage_orders")
     
-    if operator_role_ids:
-        operators = (await session.execute(
-            select(Employee).where(Employee.role_id.in_(operator_role_ids), Employee.is_on_shift == True)
-        )).scalars().all()
-        
-        pwa_msg = f"🆕 Нове замовлення #{order.id} ({order.total_price} грн)"
+    pwa_msg = f"🆕 Нове замовлення #{order.id} ({order.total_price} грн)"
+
+    async def send_pwa():
         for emp in operators:
             await create_staff_notification(session, emp.id, pwa_msg)
+
+    await _run_step(progress, "pwa", send_pwa)
     # ---------------------------------------
 
     # --- 2. TELEGRAM NOTIFICATION ---
@@ -102,12 +127,10 @@ async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: Async
                   f"<b>Статус:</b> {status_name}")
 
     kb_admin = InlineKeyboardBuilder()
-    statuses_res = await session.execute(
-        select(OrderStatus).where(OrderStatus.visible_to_operator == True).order_by(OrderStatus.id)
-    )
+    operator_statuses = (await status_registry.get(session)).visible_to("operator")
     status_buttons = [
         InlineKeyboardButton(text=s.name, callback_data=f"change_order_status_{order.id}_{s.id}")
-        for s in statuses_res.scalars().all()
+        for s in operator_statuses
     ]
     for i in range(0, len(status_buttons), 2):
         kb_admin.row(*status_buttons[i:i+2])
@@ -121,47 +144,142 @@ async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: Async
         except ValueError:
             logger.warning(f"Некоректний ADMIN_CHAT_ID: {admin_chat_id_str}")
 
-    if operator_role_ids:
-        operators_tg = await session.execute(
-            select(Employee).where(
-                Employee.role_id.in_(operator_role_ids),
-                Employee.is_on_shift == True,
-                Employee.telegram_user_id.is_not(None)
-            )
-        )
-        for operator in operators_tg.scalars().all():
-            target_chat_ids.add(operator.telegram_user_id)
-            
-    for chat_id in target_chat_ids:
-        try:
-            await admin_bot.send_message(chat_id, admin_text, reply_markup=kb_admin.as_markup())
-        except Exception as e:
-            logger.error(f"Не вдалося відправити нове замовлення в TG {chat_id}: {e}")
+    target_chat_ids.update(roster.telegram_ids("can_manage_orders"))
+
+    await _send_step(progress, "telegram", admin_bot, target_chat_ids, admin_text, kind="new_order", reply_markup=kb_admin.as_markup())
 
     # 3. РОЗПОДІЛ НА ВИРОБНИЦТВО
     if order.status and order.status.requires_kitchen_notify:
-        await distribute_order_to_production(admin_bot, order, session)
+        await distribute_order_to_production(admin_bot, order, session, progress)
     else:
         logger.info(f"Замовлення #{order.id} створено, чекає обробки.")
 
     # --- 4. WEBSOCKET BROADCAST ---
-    await manager.broadcast_staff({
-        "type": "new_order",
-        "order_id": order.id,
-        "message": f"Нове замовлення #{order.id}"
-    })
-    
-    if order.table_id:
-        await manager.broadcast_table(order.table_id, {
-            "type": "order_update",
+    async def send_websocket():
+        await manager.broadcast_staff({
+            "type": "new_order",
             "order_id": order.id,
-            "status": "Новий"
-        })
+            "order": await build_order_delta(session, order),
+            "message": f"Нове замовлення #{order.id}"
+        }, audience=await build_order_audience(session, order))
+        
+        if order.table_id:
+            await manager.broadcast_table(order.table_id, {
+                "type": "order_update",
+                "order_id": order.id,
+                "status": "Новий"
+            })
+
+    await _run_step(progress, "websocket", send_websocket)
+
+
+async def build_order_delta(session: AsyncSession, order: Order) -> dict:
+    """
+    Короткий стан замовлення для WebSocket-події персоналу.
+    PWA оновлює по ньому лише картку цього замовлення, без перезавантаження всієї вкладки.
+    """
+    status = (await status_registry.get(session)).get(order.status_id)
+    return {
+        "id": order.id,
+        "status_id": order.status_id,
+        "status": status.name if status else None,
+        "is_final": bool(status and status.is_final),
+        "total_price": float(order.total_price or 0),
+        "kitchen_done": bool(order.kitchen_done),
+        "bar_done": bool(order.bar_done),
+        "table_id": order.table_id,
+        "courier_id": order.courier_id,
+        "accepted_by_waiter_id": order.accepted_by_waiter_id,
+        "is_delivery": bool(order.is_delivery),
+    }
+
+
+async def build_order_audience(session: AsyncSession, order: Order) -> StaffAudience:
+    """
+    Хто з персоналу має отримати подію по замовленню:
+    оператори, офіціант/кур'єр замовлення, офіціанти столика та цехи зі стравами замовлення.
+    """
+    employee_ids = {order.accepted_by_waiter_id, order.courier_id}
+    if order.table_id:
+        waiters_res = await session.execute(
+            select(waiter_table_association.c.employee_id).where(waiter_table_association.c.table_id == order.table_id)
+        )
+        employee_ids.update(waiters_res.scalars().all())
+
+    workshops_res = await session.execute(
+        select(Product.production_warehouse_id).distinct()
+        .join(OrderItem, OrderItem.product_id == Product.id)
+        .where(OrderItem.order_id == order.id, Product.production_warehouse_id.is_not(None))
+    )
+    return StaffAudience(employee_ids=employee_ids, workshop_ids=workshops_res.scalars().all())
+
+
+async def notify_new_table_order(admin_bot: Bot, order: Order, session: AsyncSession, progress=None):
+    """
+    Telegram-сповіщення про замовлення з QR-меню столика:
+    офіціантам столика (або в адмін-чат, якщо столик вільний) та розподіл на кухню/бар.
+    progress - відмітки виконаних кроків (OutboxProgress), якщо виклик з outbox.
+    """
+    query = select(Order).where(Order.id == order.id).options(
+        selectinload(Order.items),
+        joinedload(Order.status),
+        joinedload(Order.table).selectinload(Table.assigned_waiters)
+    )
+    order = (await session.execute(query)).scalar_one()
+    table = order.table
+
+    products_str_for_msg = []
+    for item in order.items:
+        mod_names = [m.get('name') for m in (item.modifiers or [])]
+        mod_str = f" (+ {', '.join(mod_names)})" if mod_names else ""
+        products_str_for_msg.append(f"{item.product_name}{mod_str} x {item.quantity}")
+
+    products_display = "\n- ".join(products_str_for_msg)
+    order_details_text = (f"📝 <b>Нове замовлення зі столика: {aiogram_html.bold(table.name)} (ID: #{order.id})</b>\n\n"
+                          f"<b>Склад:</b>\n- {aiogram_html.quote(products_display)}\n\n"
+                          f"<b>Сума:</b> {order.total_price} грн")
+
+    kb_waiter = InlineKeyboardBuilder()
+    kb_waiter.row(InlineKeyboardButton(text="✅ Прийняти замовлення", callback_data=f"waiter_accept_order_{order.id}"))
+
+    kb_admin = InlineKeyboardBuilder()
+    kb_admin.row(InlineKeyboardButton(text="⚙️ Керувати (Адмін)", callback_data=f"waiter_manage_order_{order.id}"))
+
+    admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
+    admin_chat_id = None
+    if admin_chat_id_str:
+        try: admin_chat_id = int(admin_chat_id_str)
+        except ValueError: pass
+
+    waiter_chat_ids = set()
+    for w in table.assigned_waiters:
+        if w.telegram_user_id and w.is_on_shift:
+            waiter_chat_ids.add(w.telegram_user_id)
+
+    if waiter_chat_ids:
+        sends = [_send_step(progress, "telegram", admin_bot, waiter_chat_ids, order_details_text, kind="new_table_order", reply_markup=kb_waiter.as_markup())]
+        if admin_chat_id and admin_chat_id not in waiter_chat_ids:
+            sends.append(_send_step(progress, "telegram_admin", admin_bot, [admin_chat_id], "✅ " + order_details_text, kind="new_table_order", reply_markup=kb_admin.as_markup()))
+        # Помилка одного кроку не скасовує інший: обидва фіксують свій результат, потім outbox повторить невдалий
+        for result in await asyncio.gather(*sends, return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+    elif admin_chat_id:
+        await _send_step(
+            progress, "telegram", admin_bot, [admin_chat_id],
+            f"❗️ <b>Замовлення з вільного столика {aiogram_html.bold(table.name)} (ID: #{order.id})!</b>\n\n" + order_details_text,
+            kind="new_table_order",
+            reply_markup=kb_admin.as_markup()
+        )
+
+    if order.status and order.status.requires_kitchen_notify:
+        await distribute_order_to_production(admin_bot, order, session, progress)
 
 
-async def distribute_order_to_production(bot: Bot, order: Order, session: AsyncSession):
+async def distribute_order_to_production(bot: Bot, order: Order, session: AsyncSession, progress=None):
     """
     Распределяет товары заказа между Кухней и Баром для уведомлений.
+    progress - отметки выполненных шагов (OutboxProgress), если вызывается из outbox.
     """
     query = select(Order).where(Order.id == order.id).options(
         selectinload(Order.items).joinedload(OrderItem.product)
@@ -171,6 +289,9 @@ async def distribute_order_to_production(bot: Bot, order: Order, session: AsyncS
 
     kitchen_items = []
     bar_items = []
+    # Цехи страв кожної зони: сповіщення отримують лише закріплені за ними працівники
+    workshops = {"kitchen": set(), "bar": set()}
+    unrouted = {"kitchen": False, "bar": False}
 
     for item in loaded_order.items:
         # Формируем строку с модификаторами
@@ -181,60 +302,52 @@ async def distribute_order_to_production(bot: Bot, order: Order, session: AsyncS
                 mods_str = f" (+ {', '.join(mod_names)})"
 
         item_str = f"- {html_module.escape(item.product_name)}{mods_str} x {item.quantity}"
-        area = item.preparation_area
+        area = 'bar' if item.preparation_area == 'bar' else 'kitchen'
         
         if area == 'bar':
             bar_items.append(item_str)
         else:
             kitchen_items.append(item_str)
 
+        workshop_id = item.product.production_warehouse_id if item.product else None
+        if workshop_id:
+            workshops[area].add(workshop_id)
+        else:
+            unrouted[area] = True
+
+    roster = await shift_roster.get(session)
+    kitchen_staff = roster.production_staff("can_receive_kitchen_orders", workshops["kitchen"], unrouted["kitchen"]) if kitchen_items else []
+    bar_staff = roster.production_staff("can_receive_bar_orders", workshops["bar"], unrouted["bar"]) if bar_items else []
+
     # --- PWA NOTIFICATION ---
-    if kitchen_items:
-        chefs = (await session.execute(
-            select(Employee).join(Role).where(Role.can_receive_kitchen_orders==True, Employee.is_on_shift==True)
-        )).scalars().all()
-        for emp in chefs:
+    async def send_pwa():
+        for emp in kitchen_staff:
             await create_staff_notification(session, emp.id, f"🍳 Кухня: Нове замовлення #{order.id}")
-            
-    if bar_items:
-        barmen = (await session.execute(
-            select(Employee).join(Role).where(Role.can_receive_bar_orders==True, Employee.is_on_shift==True)
-        )).scalars().all()
-        for emp in barmen:
+
+        for emp in bar_staff:
             await create_staff_notification(session, emp.id, f"🍹 Бар: Нове замовлення #{order.id}")
 
+    await _run_step(progress, "production_pwa", send_pwa)
+
     # --- TELEGRAM NOTIFICATION ---
     if kitchen_items:
         await send_group_notification(
             bot=bot, order=loaded_order, items=kitchen_items,
-            role_filter=Role.can_receive_kitchen_orders == True,
-            title="🧑‍🍳 ЗАМОВЛЕННЯ НА КУХНЮ", session=session, area="kitchen"
+            chat_ids=[e.telegram_user_id for e in kitchen_staff if e.telegram_user_id],
+            title="🧑‍🍳 ЗАМОВЛЕННЯ НА КУХНЮ", area="kitchen", progress=progress
         )
 
     if bar_items:
         await send_group_notification(
             bot=bot, order=loaded_order, items=bar_items,
-            role_filter=Role.can_receive_bar_orders == True,
-            title="🍹 ЗАМОВЛЕННЯ НА БАР", session=session, area="bar"
+            chat_ids=[e.telegram_user_id for e in bar_staff if e.telegram_user_id],
+            title="🍹 ЗАМОВЛЕННЯ НА БАР", area="bar", progress=progress
         )
 
 
-async def send_group_notification(bot: Bot, order: Order, items: list, role_filter, title: str, session: AsyncSession, area: str = "kitchen"):
-    roles_res = await session.execute(select(Role.id).where(role_filter))
-    role_ids = roles_res.scalars().all()
-
-    if not role_ids: return
-
-    employees_res = await session.execute(
-        select(Employee).where(
-            Employee.role_id.in_(role_ids),
-            Employee.is_on_shift == True,
-            Employee.telegram_user_id.is_not(None)
-        )
-    )
-    employees = employees_res.scalars().all()
-
-    if employees:
+async def send_group_notification(bot: Bot, order: Order, items: list, chat_ids: list, title: str, area: str = "kitchen",
+                                  progress=None):
+    if chat_ids:
         is_delivery = order.is_delivery
         items_formatted = "\n".join(items)
         
@@ -251,11 +364,7 @@ async def send_group_notification(bot: Bot, order: Order, items: list, role_filt
         kb = InlineKeyboardBuilder()
         kb.row(InlineKeyboardButton(text=f"✅ Видача #{order.id}", callback_data=f"chef_ready_{order.id}_{area}"))
         
-        for emp in employees:
-            try:
-                await bot.send_message(emp.telegram_user_id, text, reply_markup=kb.as_markup())
-            except Exception as e:
-                logger.error(f"Не вдалося відправити в TG працівнику {emp.id}: {e}")
+        await _send_step(progress, f"production_{area}", bot, chat_ids, text, kind="production", reply_markup=kb.as_markup())
 
 
 async def notify_station_completion(bot: Bot, order: Order, area: str, session: AsyncSession, employee_id: int = None):
@@ -339,15 +448,14 @@ async def notify_station_completion(bot: Bot, order: Order, area: str, session:
              except ValueError: pass
              message_text += "\n(Виконавець не призначений)"
 
-    for chat_id in target_chat_ids:
-        try: await bot.send_message(chat_id, message_text)
-        except Exception: pass
+    await tg_dispatcher.send_many(bot, target_chat_ids, message_text, kind="item_ready")
 
     await manager.broadcast_staff({
         "type": "item_ready",
         "order_id": order.id,
+        "order": await build_order_delta(session, order),
         "area": area
-    })
+    }, audience=await build_order_audience(session, order))
 
 
 async def notify_all_parties_on_status_change(
@@ -385,42 +493,24 @@ async def notify_all_parties_on_status_change(
     # --- 1. ЛОГИКА СКЛАДА (Списание и Возврат) ---
     
     # А. ПОВЕРНЕННЯ НА СКЛАД ПРИ СКАСУВАННІ
-    if new_status.is_cancelled_status and order.is_inventory_deducted:
+    # У режимі відкладеного списання замовлення може ще чекати в черзі
+    if new_status.is_cancelled_status and (order.is_inventory_deducted or await has_pending_deduction(session, order.id)):
         # Перевіряємо прапорець skip_inventory_return (TRUE = "Списати в смітник", FALSE = "Вернути на полицю")
         if not order.skip_inventory_return:
             # Варіант 1: Повернення товару (Клієнт відмовився, товар цілий)
             try:
-                await reverse_deduction(session, order)
-                if admin_chat_id_str:
-                    try: await admin_bot.send_message(admin_chat_id_str, f"♻️ <b>[Склад]</b> Товари замовлення #{order.id} повернуто на склад.")
-                    except Exception: pass
+                await request_reversal(session, order)
+                if admin_chat_id_str and not is_deferred():
+                    await tg_dispatcher.send(admin_bot, admin_chat_id_str, f"♻️ <b>[Склад]</b> Товари замовлення #{order.id} повернуто на склад.", kind="admin_log")
             except Exception as e:
                 logger.error(f"Помилка повернення на склад для #{order.id}: {e}")
         else:
             # Варіант 2: Списання (Waste)
-            # Ми перетворюємо документ "Deduction" (Продаж) на "Writeoff" (Списання)
+            # Продаж замовлення (одразу або воркером черги, зокрема з пакетної накладної) стає "Writeoff"
             try:
-                docs_to_update = await session.execute(
-                    select(InventoryDoc).where(
-                        InventoryDoc.linked_order_id == order.id,
-                        InventoryDoc.doc_type == 'deduction'
-                    )
-                )
-                
-                updated_count = 0
-                docs = docs_to_update.scalars().all()
-                for doc in docs:
-                    doc.doc_type = 'writeoff'
-                    doc.comment = f"Списання (Скасування) замовлення #{order.id}"
-                    updated_count += 1
-                
-                if updated_count > 0:
-                    await session.commit()
-                    logger.info(f"Замовлення #{order.id}: {updated_count} накладних продажу перетворено на списання (Writeoff).")
-                else:
-                    logger.warning(f"Замовлення #{order.id} (Waste): Документів продажу (deduction) не знайдено для конвертації.")
-                    
+                await request_writeoff(session, order)
             except Exception as e:
+                await session.rollback()
                 logger.error(f"Помилка конвертації документів для #{order.id}: {e}")
 
     # Б. СПИСАННЯ СО СКЛАДА (якщо статус "Готовий до видачі" або завершальний)
@@ -428,11 +518,11 @@ async def notify_all_parties_on_status_change(
     should_deduct = (new_status.name == "Готовий до видачі" or new_status.is_completed_status)
     if should_deduct and not order.is_inventory_deducted:
         try:
-            await deduct_products_by_tech_card(session, order)
-            # Прапорець is_inventory_deducted ставиться всередині deduct_products_by_tech_card,
+            await request_deduction(session, order)
+            # Прапорець is_inventory_deducted ставиться всередині deduct_products_by_tech_card (або воркером черги),
             # але ми перестраховуємося і перевіряємо, чи зберігся він
             await session.commit()
-            logger.info(f"Склад списан для заказа #{order.id}")
+            logger.info(f"Списання замовлення #{order.id} поставлено в чергу" if is_deferred() else f"Склад списан для заказа #{order.id}")
         except Exception as e:
             logger.error(f"Помилка списання складу для #{order.id}: {e}")
     # --------------------------------------------
@@ -451,8 +541,7 @@ async def notify_all_parties_on_status_change(
             f"<b>Ким:</b> {html_module.escape(actor_info)}\n"
             f"<b>Статус:</b> `{html_module.escape(old_status_name)}` → `{html_module.escape(new_status.name)}`"
         )
-        try: await admin_bot.send_message(admin_chat_id_str, log_message)
-        except Exception: pass
+        await tg_dispatcher.send(admin_bot, admin_chat_id_str, log_message, kind="admin_log")
 
     # --- 4. DISTRIBUTE TO PRODUCTION ---
     if new_status.requires_kitchen_notify:
@@ -479,42 +568,38 @@ async def notify_all_parties_on_status_change(
             ready_message += f"Кур'єр: {html_module.escape(order.courier.full_name)}"
 
         if not target_employees:
-             operator_roles_res = await session.execute(select(Role.id).where(Role.can_manage_orders == True))
-             op_ids = operator_roles_res.scalars().all()
-             if op_ids:
-                 ops = (await session.execute(select(Employee).where(Employee.role_id.in_(op_ids), Employee.is_on_shift==True))).scalars().all()
-                 target_employees.extend(ops)
+             target_employees.extend((await shift_roster.get(session)).with_capability("can_manage_orders"))
              ready_message += f"Тип: {'Самовивіз' if order.order_type == 'pickup' else 'Доставка'}. Потрібна видача."
              
-        for employee in target_employees:
-            if employee.telegram_user_id:
-                try: await admin_bot.send_message(employee.telegram_user_id, ready_message)
-                except Exception: pass
+        await tg_dispatcher.send_many(admin_bot, [e.telegram_user_id for e in target_employees], ready_message, kind="ready")
 
     # --- 6. NOTIFY STAFF (Status Change) ---
+    # Незалежні адресати - надсилаємо паралельно
+    status_sends = []
     if order.courier and order.courier.telegram_user_id and "Кур'єр" not in actor_info and new_status.name != "Готовий до видачі":
         if new_status.visible_to_courier:
             courier_text = f"❗️ Статус замовлення #{order.id} змінено на: <b>{new_status.name}</b>"
-            try: await admin_bot.send_message(order.courier.telegram_user_id, courier_text)
-            except Exception: pass
+            status_sends.append(tg_dispatcher.send(admin_bot, order.courier.telegram_user_id, courier_text, kind="status_change"))
 
     if order.order_type != 'delivery' and order.accepted_by_waiter and order.accepted_by_waiter.telegram_user_id and "Офіціант" not in actor_info and new_status.name != "Готовий до видачі":
         waiter_text = f"📢 Замовлення #{order.id} (Стіл: {html_module.escape(order.table.name if order.table else 'N/A')}) має новий статус: <b>{new_status.name}</b>"
-        try: await admin_bot.send_message(order.accepted_by_waiter.telegram_user_id, waiter_text)
-        except Exception: pass
+        status_sends.append(tg_dispatcher.send(admin_bot, order.accepted_by_waiter.telegram_user_id, waiter_text, kind="status_change"))
 
     # --- 7. NOTIFY CUSTOMER ---
     if new_status.notify_customer and order.user_id and client_bot:
         client_text = f"Статус вашого замовлення #{order.id} змінено на: <b>{new_status.name}</b>"
-        try: await client_bot.send_message(order.user_id, client_text)
-        except Exception: pass
+        status_sends.append(tg_dispatcher.send(client_bot, order.user_id, client_text, kind="client_status"))
+
+    if status_sends:
+        await asyncio.gather(*status_sends)
 
     # --- 8. WEBSOCKET BROADCAST ---
     await manager.broadcast_staff({
         "type": "order_updated",
         "order_id": order.id,
+        "order": await build_order_delta(session, order),
         "new_status": new_status.name
-    })
+    }, audience=await build_order_audience(session, order))
 
     if order.table_id:
         await manager.broadcast_table(order.table_id, {
@@ -0,0 +1,214 @@
+# notification_outbox.py
+
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import sqlalchemy as sa
+from aiogram import Bot
+from sqlalchemy import select, update, delete, or_, and_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import NotificationOutbox, Order, async_session_maker
+from notification_manager import notify_new_order_to_staff, notify_new_table_order
+from telegram_dispatcher import tg_dispatcher, allow_waiting, TG_MAX_RETRIES, TG_MAX_RETRY_AFTER
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_NEW_ORDER = "new_order"
+OUTBOX_NEW_TABLE_ORDER = "new_table_order"
+
+# Кількість паралельних задач-обробників у кожному воркері
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", "2"))
+# Як часто перевіряти чергу, якщо нас не розбудили (сек.)
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_BATCH_SIZE = 10
+OUTBOX_MAX_ATTEMPTS = 8
+# Запис у статусі processing довше цього часу вважається загубленим (воркер впав).
+# locked_at оновлюється після кожного кроку, тож вікно має перевищувати найдовший крок:
+# Telegram з паузами RetryAfter - до TG_MAX_RETRIES * TG_MAX_RETRY_AFTER на повідомлення плюс черга лімітів
+OUTBOX_STALE_AFTER = max(timedelta(minutes=30), timedelta(seconds=4 * TG_MAX_RETRIES * TG_MAX_RETRY_AFTER))
+
+Handler = Callable[[Optional[Bot], AsyncSession, dict, "OutboxProgress"], Awaitable[None]]
+
+
+def enqueue_notification(session: AsyncSession, kind: str, payload: dict):
+    """
+    Додає сповіщення в чергу. Викликати ДО commit - запис з'явиться разом із замовленням.
+    Після commit воркер цього процесу прокидається одразу, інші - за OUTBOX_POLL_INTERVAL.
+    """
+    session.add(NotificationOutbox(kind=kind, payload=payload))
+    sa.event.listen(session.sync_session, "after_commit", lambda _session: outbox_worker.wake(), once=True)
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(300, 2 ** attempts))
+
+
+class OutboxProgress:
+    """
+    Виконані кроки сповіщення (payload["done"]: "pwa", "telegram", ...).
+    Кожен крок після успіху одразу фіксується в записі черги, тому повтор після помилки
+    виконує лише кроки, що ще не пройшли, і не розсилає повідомлення вдруге.
+    Telegram-крок (send) запам'ятовує чати, куди не доставлено (payload["pending"]), і повторює лише їх.
+    """
+
+    def __init__(self, row_id: int, payload: dict):
+        self.row_id = row_id
+        self.payload = dict(payload)
+        self.payload["pending"] = dict(self.payload.get("pending") or {})
+        self.done = set(self.payload.get("done") or [])
+
+    async def step(self, name: str, action: Callable[[], Awaitable]):
+        if name in self.done:
+            return
+        await action()
+        await self._complete(name)
+
+    async def send(self, name: str, bot: Optional[Bot], chat_ids: Iterable, text: str, kind: str, **kwargs):
+        """Telegram-крок: при тимчасовій помилці крок не виконано, повтор - лише в недоставлені чати."""
+        if name in self.done:
+            return
+        pending = self.payload["pending"].get(name)
+        failed = await tg_dispatcher.deliver(bot, pending if pending is not None else chat_ids, text, kind=kind, **kwargs)
+        if failed:
+            self.payload["pending"][name] = failed
+            await self._save()
+            raise RuntimeError(f"Telegram: крок '{name}' не доставлено в {len(failed)} чат(ів)")
+        self.payload["pending"].pop(name, None)
+        await self._complete(name)
+
+    async def _complete(self, name: str):
+        self.done.add(name)
+        self.payload["done"] = sorted(self.done)
+        await self._save()
+
+    async def _save(self):
+        async with async_session_maker() as session:
+            # locked_at - заодно heartbeat: запис не вважається загубленим, поки кроки виконуються
+            await session.execute(
+                update(NotificationOutbox).where(NotificationOutbox.id == self.row_id)
+                .values(payload=self.payload, locked_at=func.now())
+            )
+            await session.commit()
+
+
+class OutboxWorker:
+    """
+    Фонові задачі, що розбирають notification_outbox.
+    Записи захоплюються через FOR UPDATE SKIP LOCKED, тому кілька воркерів не дублюють роботу.
+    Доставка "щонайменше один раз": після помилки сповіщення повторюється з наростаючою паузою,
+    кроки, виконані в попередніх спробах, пропускаються (OutboxProgress).
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, Handler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self.bot: Optional[Bot] = None
+
+    def register(self, kind: str, handler: Handler):
+        self._handlers[kind] = handler
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self, bot: Optional[Bot], concurrency: int = OUTBOX_WORKERS):
+        self.bot = bot
+        for _ in range(max(1, concurrency)):
+            self._tasks.append(asyncio.create_task(self._run()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        # Фонова задача може чекати ліміти і TelegramRetryAfter на місці - відповіді користувачу вона не тримає
+        allow_waiting()
+        while True:
+            try:
+                claimed = await self._claim()
+            except Exception as e:
+                logger.error(f"Outbox: помилка вибірки черги: {e}")
+                claimed = []
+
+            for row_id, kind, payload, attempts in claimed:
+                await self._process(row_id, kind, payload, attempts)
+
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def _claim(self) -> List[Tuple[int, str, dict, int]]:
+        async with async_session_maker() as session:
+            rows = (await session.execute(
+                select(NotificationOutbox)
+                .where(or_(
+                    and_(NotificationOutbox.status == 'pending', NotificationOutbox.next_attempt_at <= func.now()),
+                    and_(NotificationOutbox.status == 'processing', NotificationOutbox.locked_at < func.now() - OUTBOX_STALE_AFTER),
+                ))
+                .order_by(NotificationOutbox.id)
+                .limit(OUTBOX_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+
+            claimed = []
+            for row in rows:
+                claimed.append((row.id, row.kind, row.payload or {}, row.attempts))
+                row.status = 'processing'
+                row.locked_at = func.now()
+            await session.commit()
+            return claimed
+
+    async def _process(self, row_id: int, kind: str, payload: dict, attempts: int):
+        handler = self._handlers.get(kind)
+        try:
+            if handler is None:
+                raise RuntimeError(f"невідомий тип сповіщення '{kind}'")
+            async with async_session_maker() as session:
+                await handler(self.bot, session, payload, OutboxProgress(row_id, payload))
+        except Exception as e:
+            attempts += 1
+            failed = attempts >= OUTBOX_MAX_ATTEMPTS
+            logger.error(f"Outbox: сповіщення #{row_id} ({kind}), спроба {attempts}: {e}")
+            async with async_session_maker() as session:
+                await session.execute(
+                    update(NotificationOutbox).where(NotificationOutbox.id == row_id).values(
+                        status='failed' if failed else 'pending',
+                        attempts=attempts,
+                        next_attempt_at=func.now() + _retry_delay(attempts),
+                        locked_at=None,
+                        last_error=str(e)[:1000],
+                    )
+                )
+                await session.commit()
+            return
+
+        async with async_session_maker() as session:
+            await session.execute(delete(NotificationOutbox).where(NotificationOutbox.id == row_id))
+            await session.commit()
+
+
+async def _handle_new_order(bot: Optional[Bot], session: AsyncSession, payload: dict, progress: OutboxProgress):
+    order = await session.get(Order, payload["order_id"])
+    if order:
+        await notify_new_order_to_staff(bot, order, session, progress)
+
+
+async def _handle_new_table_order(bot: Optional[Bot], session: AsyncSession, payload: dict, progress: OutboxProgress):
+    order = await session.get(Order, payload["order_id"])
+    if order and bot:
+        await notify_new_table_order(bot, order, session, progress)
+
+
+# Глобальний екземпляр
+outbox_worker = OutboxWorker()
+outbox_worker.register(OUTBOX_NEW_ORDER, _handle_new_order)
+outbox_worker.register(OUTBOX_NEW_TABLE_ORDER, _handle_new_table_order)
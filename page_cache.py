@@ -0,0 +1,51 @@
+# page_cache.py
+
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from http_cache import CachedPayload
+from event_bus import event_bus, ALL_CACHES
+
+
+class RenderedPageCache:
+    """
+    Кеш відрендереної сторінки (HTML + ETag/Last-Modified).
+    Сторінка рендериться один раз на версію; версію збільшують
+    ендпоінти, які змінюють дані сторінки (дизайн, налаштування, сторінки меню).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.version: int = 1
+        self._payload: Optional[CachedPayload] = None
+        self._payload_version: int = 0
+        self._lock = asyncio.Lock()
+        event_bus.subscribe("cache_invalidate", self._on_remote_invalidate)
+
+    def invalidate(self, broadcast: bool = True):
+        """Викликати ПІСЛЯ commit змін, що впливають на сторінку."""
+        self.version += 1
+        if broadcast:
+            event_bus.publish_nowait("cache_invalidate", {"cache": self.name})
+
+    def _on_remote_invalidate(self, payload: dict):
+        if payload.get("cache") in (self.name, ALL_CACHES):
+            self.invalidate(broadcast=False)
+
+    async def get(self, render: Callable[[], Awaitable[str]]) -> CachedPayload:
+        if self._payload is not None and self._payload_version == self.version:
+            return self._payload
+
+        async with self._lock:
+            if self._payload is not None and self._payload_version == self.version:
+                return self._payload
+
+            version = self.version
+            content = await render()
+            self._payload = CachedPayload(content.encode("utf-8"), "text/html; charset=utf-8")
+            self._payload_version = version
+            return self._payload
+
+
+# Головна сторінка сайту (GET /)
+storefront_cache = RenderedPageCache("storefront")
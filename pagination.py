@@ -0,0 +1,105 @@
+# pagination.py
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+# Скільки секунд тримати точну кількість для списків із фільтром
+PAGINATION_COUNT_TTL = float(os.environ.get("PAGINATION_COUNT_TTL", "60"))
+PAGINATION_COUNT_CACHE_SIZE = 500
+
+
+class KeysetPage:
+    """Сторінка keyset-пагінації: рядки і чи є сусідні сторінки."""
+
+    __slots__ = ("items", "has_next", "has_prev")
+
+    def __init__(self, items: List[Any], has_next: bool, has_prev: bool):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+
+
+async def fetch_keyset_page(session: AsyncSession, query: Select, per_page: int,
+                            order_by: Sequence, reverse_order_by: Sequence,
+                            backward: bool = False, has_cursor: bool = False,
+                            mappings: bool = False) -> KeysetPage:
+    """
+    Один запит на сторінку: LIMIT per_page + 1 без OFFSET.
+    query вже містить умову курсора (WHERE/HAVING key < after або key > before).
+    backward=True - сторінка "назад": читається у зворотному порядку і перевертається.
+    """
+    ordered = query.order_by(*(reverse_order_by if backward else order_by)).limit(per_page + 1)
+    result = await session.execute(ordered)
+    rows = list(result.mappings().all() if mappings else result.scalars().all())
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+        return KeysetPage(rows, has_next=True, has_prev=has_more)
+    return KeysetPage(rows, has_next=has_more, has_prev=has_cursor)
+
+
+class CountCache:
+    """Точні count(*) для списків із фільтром - з TTL, щоб не рахувати на кожному перегляді."""
+
+    def __init__(self, max_size: int = PAGINATION_COUNT_CACHE_SIZE):
+        self._items: "OrderedDict[Tuple, Tuple[float, int]]" = OrderedDict()
+        self.max_size = max_size
+
+    async def get(self, session: AsyncSession, key: Tuple, count_query: Select) -> int:
+        now = time.monotonic()
+        cached = self._items.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+        total = (await session.execute(count_query)).scalar_one_or_none() or 0
+        self._items[key] = (now + PAGINATION_COUNT_TTL, total)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return total
+
+
+# Глобальний екземпляр
+count_cache = CountCache()
+
+
+async def estimated_total(session: AsyncSession, table: Optional[str], cache_key: Tuple, count_query: Select) -> int:
+    """
+    Загальна кількість для підпису під списком.
+    Без фільтра (table задано) - оцінка планувальника pg_class.reltuples, без сканування таблиці;
+    з фільтром або якщо таблиця ще не аналізувалась - точний count з кешу count_cache.
+    """
+    if table:
+        estimate = await session.scalar(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)").bindparams(table=table)
+        )
+        if estimate is not None and estimate > 0:
+            return int(estimate)
+    return await count_cache.get(session, cache_key, count_query)
+
+
+def keyset_links(path: str, params: Iterable[Tuple[str, Any]], page: KeysetPage,
+                 cursor_of: Callable[[Any], str], total: Optional[int] = None, noun: str = "записів") -> str:
+    """Посилання "Попередня / Наступна" з курсорами before/after, фільтри зберігаються."""
+    base = [(k, v) for k, v in params if v not in (None, "")]
+
+    def href(cursor_param: str, cursor: str) -> str:
+        return f"{path}?{urlencode(base + [(cursor_param, cursor)])}"
+
+    links = []
+    if page.has_prev and page.items:
+        links.append(f'<a href="{href("before", cursor_of(page.items[0]))}">&larr; Попередня</a>')
+    if page.has_next and page.items:
+        links.append(f'<a href="{href("after", cursor_of(page.items[-1]))}">Наступна &rarr;</a>')
+    total_html = f'<span style="color:#888; margin-left:10px;">≈ {total:,} {noun}</span>'.replace(",", " ") if total is not None else ""
+    if not links and not total_html:
+        return ""
+    return f"<div class='pagination'>{' '.join(links)}{total_html}</div>"
@@ -0,0 +1,311 @@
+# sales_rollup.py
+
+import argparse
+import asyncio
+import logging
+import os
+import time as time_module
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy import select, delete, func, case, cast, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import (
+    Order, OrderItem, OrderStatus, DailySales, DailyProductSales, SalesRollupDirtyDate, async_session_maker
+)
+from status_registry import status_registry
+
+logger = logging.getLogger(__name__)
+
+SALES_ROLLUP_POLL_INTERVAL = float(os.environ.get("SALES_ROLLUP_POLL_INTERVAL", "10"))
+# Страховка для правок уже закритих замовлень: останні дні перераховуються періодично (сек.)
+SALES_ROLLUP_SWEEP_INTERVAL = float(os.environ.get("SALES_ROLLUP_SWEEP_INTERVAL", "900"))
+SALES_ROLLUP_SWEEP_DAYS = 2
+SALES_ROLLUP_BATCH_DATES = 100
+# Ключ pg_advisory_xact_lock: підсумки перераховує лише один воркер (або команда backfill)
+SALES_ROLLUP_LOCK_KEY = 7_310_004
+
+# Поля Order, від яких залежать daily_sales / daily_product_sales
+SALES_ORDER_FIELDS = (
+    "status_id", "created_at", "total_price", "payment_method", "order_type",
+    "completed_by_courier_id", "accepted_by_waiter_id",
+)
+
+
+def _day_bounds(d_from: date, d_to: date) -> Tuple[datetime, datetime]:
+    return datetime.combine(d_from, time.min), datetime.combine(d_to + timedelta(days=1), time.min)
+
+
+async def mark_sales_dirty(session: AsyncSession, sale_date: date):
+    """Ставить дату в чергу перерахунку. Воркер цього процесу прокидається після commit."""
+    await session.execute(
+        pg_insert(SalesRollupDirtyDate).values(sale_date=sale_date).on_conflict_do_nothing(index_elements=["sale_date"])
+    )
+    sa.event.listen(session.sync_session, "after_commit", lambda _session: sales_rollup_worker.wake(), once=True)
+
+
+def _wake_worker(session: Session):
+    sales_rollup_worker.wake()
+
+
+def _collect_sales_changes(session: Session, flush_context, instances):
+    """
+    before_flush: замовлення, зміни яких зачіпають підсумки. Дати ставить у чергу _mark_sales_changes
+    після flush у тій самій транзакції - хоч би звідки змінили замовлення (адмінка, PWA, бот, API).
+    """
+    statuses = status_registry.current()
+
+    def is_final(status_id) -> bool:
+        # Довідник ще не завантажено - позначаємо з запасом
+        return statuses is None or status_id in statuses.final_ids
+
+    always, if_final, dates = [], [], set()
+    for obj in session.new:
+        if isinstance(obj, (Order, OrderItem)):
+            if_final.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Order):
+            attrs = sa.inspect(obj).attrs
+            status = attrs.status_id.history
+            if status.has_changes() and any(is_final(s) for s in (*status.added, *status.deleted)):
+                # Вихід із фінального статусу: після flush замовлення вже не фінальне, але дату перерахувати треба
+                always.append(obj)
+            elif any(attrs[field].history.has_changes() for field in SALES_ORDER_FIELDS):
+                if_final.append(obj)
+            dates.update(old.date() for old in attrs.created_at.history.deleted if old)
+        elif isinstance(obj, OrderItem) and session.is_modified(obj):
+            if_final.append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            if obj.created_at and is_final(obj.status_id):
+                dates.add(obj.created_at.date())
+        elif isinstance(obj, OrderItem):
+            if_final.append(obj)
+    session.info["sales_rollup_pending"] = (always, if_final, dates)
+
+
+def _mark_sales_changes(session: Session, flush_context):
+    """after_flush: ID нових замовлень уже відомі, дати беремо з orders одним INSERT ... SELECT."""
+    always, if_final, dates = session.info.pop("sales_rollup_pending", ([], [], set()))
+
+    def order_ids(objs) -> set:
+        return {obj.id if isinstance(obj, Order) else obj.order_id for obj in objs} - {None}
+
+    conn = session.connection()
+    marked = False
+    final_statuses = select(OrderStatus.id).where(or_(OrderStatus.is_completed_status, OrderStatus.is_cancelled_status))
+    for ids, only_final in ((order_ids(always), False), (order_ids(if_final), True)):
+        if not ids:
+            continue
+        where = [Order.id.in_(ids)]
+        if only_final:
+            where.append(Order.status_id.in_(final_statuses))
+        conn.execute(
+            pg_insert(SalesRollupDirtyDate)
+            .from_select(["sale_date"], select(cast(Order.created_at, sa.Date)).where(*where).distinct())
+            .on_conflict_do_nothing(index_elements=["sale_date"])
+        )
+        marked = True
+    if dates:
+        conn.execute(
+            pg_insert(SalesRollupDirtyDate).values([{"sale_date": d} for d in dates])
+            .on_conflict_do_nothing(index_elements=["sale_date"])
+        )
+        marked = True
+    if marked and not sa.event.contains(session, "after_commit", _wake_worker):
+        sa.event.listen(session, "after_commit", _wake_worker)
+
+
+async def rebuild_sales_rollup(session: AsyncSession, d_from: date, d_to: date):
+    """
+    Перераховує daily_sales і daily_product_sales за дати [d_from, d_to] з orders / order_items.
+    DELETE + INSERT ... SELECT: повтор не подвоює підсумки. Commit - на стороні виклику,
+    виклик має тримати SALES_ROLLUP_LOCK_KEY.
+    """
+    statuses = await status_registry.get(session)
+    dt_from, dt_to = _day_bounds(d_from, d_to)
+
+    await session.execute(delete(DailySales).where(DailySales.sale_date.between(d_from, d_to)))
+    await session.execute(delete(DailyProductSales).where(DailyProductSales.sale_date.between(d_from, d_to)))
+    if not statuses.final_ids:
+        return
+
+    in_period = (
+        Order.created_at >= dt_from,
+        Order.created_at < dt_to,
+        Order.status_id.in_(statuses.final_ids),
+    )
+    sale_date = cast(Order.created_at, sa.Date).label("sale_date")
+    outcome = case((Order.status_id.in_(statuses.completed_ids), "completed"), else_="cancelled").label("outcome")
+
+    # Вимір outcome рахується в підзапиті: GROUP BY по виразу з параметрами Postgres не зіставляє
+    orders = select(
+        sale_date, outcome,
+        func.coalesce(Order.order_type, "delivery").label("order_type"),
+        Order.payment_method.label("payment_method"),
+        Order.completed_by_courier_id.label("courier_id"),
+        Order.accepted_by_waiter_id.label("waiter_id"),
+        Order.total_price.label("total_price"),
+    ).where(*in_period).subquery()
+    dims = (orders.c.sale_date, orders.c.outcome, orders.c.order_type, orders.c.payment_method, orders.c.courier_id, orders.c.waiter_id)
+    await session.execute(
+        sa.insert(DailySales).from_select(
+            ["sale_date", "outcome", "order_type", "payment_method", "courier_id", "waiter_id", "orders_count", "revenue"],
+            select(*dims, func.count(), func.coalesce(func.sum(orders.c.total_price), 0)).group_by(*dims)
+        )
+    )
+
+    items = select(
+        sale_date, outcome,
+        OrderItem.product_id.label("product_id"),
+        OrderItem.product_name.label("product_name"),
+        OrderItem.quantity.label("quantity"),
+        (OrderItem.quantity * OrderItem.price_at_moment).label("revenue"),
+    ).join(Order, OrderItem.order_id == Order.id).where(*in_period).subquery()
+    item_dims = (items.c.sale_date, items.c.outcome, items.c.product_id, items.c.product_name)
+    await session.execute(
+        sa.insert(DailyProductSales).from_select(
+            ["sale_date", "outcome", "product_id", "product_name", "quantity", "revenue"],
+            select(*item_dims, func.coalesce(func.sum(items.c.quantity), 0), func.coalesce(func.sum(items.c.revenue), 0)).group_by(*item_dims)
+        )
+    )
+
+
+def _date_ranges(dates: List[date]) -> List[Tuple[date, date]]:
+    """Суміжні дати зливаються в один діапазон - один INSERT ... SELECT на діапазон."""
+    ranges: List[Tuple[date, date]] = []
+    for d in sorted(dates):
+        if ranges and d - ranges[-1][1] <= timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], d)
+        else:
+            ranges.append((d, d))
+    return ranges
+
+
+class SalesRollupWorker:
+    """
+    Підтримує daily_sales інкрементально: хуки flush позначають дату замовлення при зміні статусу,
+    суми, оплати, виконавця чи позицій (у транзакції самої зміни), воркер перераховує позначені дати.
+    Після зміни прапорів фінальних статусів історію треба перерахувати: python -m sales_rollup backfill.
+    """
+
+    def __init__(self):
+        self._task = None
+        self._wake = asyncio.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        try:
+            await self.backfill_if_empty()
+        except Exception as e:
+            logger.error(f"Підсумки продажів: помилка початкового заповнення: {e}", exc_info=True)
+
+        last_sweep = time_module.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), SALES_ROLLUP_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            try:
+                if time_module.monotonic() - last_sweep > SALES_ROLLUP_SWEEP_INTERVAL:
+                    await self.mark_recent_days()
+                    last_sweep = time_module.monotonic()
+                while await self.process_dirty() >= SALES_ROLLUP_BATCH_DATES:
+                    pass
+            except Exception as e:
+                logger.error(f"Підсумки продажів: помилка перерахунку: {e}", exc_info=True)
+
+    async def mark_recent_days(self):
+        today = date.today()
+        async with async_session_maker() as session:
+            for days_ago in range(SALES_ROLLUP_SWEEP_DAYS):
+                await mark_sales_dirty(session, today - timedelta(days=days_ago))
+            await session.commit()
+
+    async def process_dirty(self) -> int:
+        """Перераховує одну пачку позначених дат. Повертає кількість дат."""
+        async with async_session_maker() as session:
+            if not await session.scalar(select(func.pg_try_advisory_xact_lock(SALES_ROLLUP_LOCK_KEY))):
+                return 0
+
+            dates = (await session.execute(
+                select(SalesRollupDirtyDate.sale_date)
+                .order_by(SalesRollupDirtyDate.sale_date)
+                .limit(SALES_ROLLUP_BATCH_DATES)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+            if not dates:
+                return 0
+
+            for d_from, d_to in _date_ranges(dates):
+                await rebuild_sales_rollup(session, d_from, d_to)
+            await session.execute(delete(SalesRollupDirtyDate).where(SalesRollupDirtyDate.sale_date.in_(dates)))
+            await session.commit()
+            logger.info(f"Підсумки продажів перераховано за {len(dates)} дат")
+            return len(dates)
+
+    async def backfill_if_empty(self):
+        """Перший запуск на існуючій базі: заповнює підсумки за всю історію."""
+        async with async_session_maker() as session:
+            if await session.scalar(select(DailySales.id).limit(1)) is not None:
+                return
+        await backfill()
+
+
+async def backfill(d_from: Optional[date] = None, d_to: Optional[date] = None, chunk_days: int = 31):
+    """Перерахунок підсумків за період (за замовчуванням - уся історія) частинами по chunk_days днів."""
+    async with async_session_maker() as session:
+        if d_from is None:
+            first = await session.scalar(select(func.min(Order.created_at)))
+            if first is None:
+                return
+            d_from = first.date()
+    d_to = d_to or date.today()
+
+    start = d_from
+    while start <= d_to:
+        end = min(start + timedelta(days=chunk_days - 1), d_to)
+        async with async_session_maker() as session:
+            await session.scalar(select(func.pg_advisory_xact_lock(SALES_ROLLUP_LOCK_KEY)))
+            await rebuild_sales_rollup(session, start, end)
+            await session.commit()
+        logger.info(f"Підсумки продажів: перераховано {start} - {end}")
+        start = end + timedelta(days=1)
+
+
+# Глобальний екземпляр
+sales_rollup_worker = SalesRollupWorker()
+sa.event.listen(Session, "before_flush", _collect_sales_changes)
+sa.event.listen(Session, "after_flush", _mark_sales_changes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перерахунок daily_sales / daily_product_sales")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--from", dest="date_from", help="YYYY-MM-DD (за замовчуванням - перше замовлення)")
+    parser.add_argument("--to", dest="date_to", help="YYYY-MM-DD (за замовчуванням - сьогодні)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(backfill(
+        datetime.strptime(args.date_from, "%Y-%m-%d").date() if args.date_from else None,
+        datetime.strptime(args.date_to, "%Y-%m-%d").date() if args.date_to else None,
+    ))
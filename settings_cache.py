@@ -0,0 +1,97 @@
+# settings_cache.py
+
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Settings
+from event_bus import event_bus, ALL_CACHES
+
+logger = logging.getLogger(__name__)
+
+_SETTINGS_FIELDS = [attr.key for attr in sa.inspect(Settings).column_attrs]
+
+
+class SettingsSnapshot:
+    """
+    Незмінна копія рядка Settings (id=1).
+    Має ті самі атрибути, що й модель, тому підходить для читання замість ORM-об'єкта.
+    """
+
+    def __init__(self, row: Settings):
+        for key in _SETTINGS_FIELDS:
+            object.__setattr__(self, key, getattr(row, key))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("SettingsSnapshot доступний лише для читання, змінюйте Settings через сесію")
+
+
+class SettingsCache:
+    """
+    Кеш налаштувань закладу в пам'яті процесу.
+    - load() викликається при старті (lifespan);
+    - refresh() викликається ПІСЛЯ commit у POST-обробниках налаштувань
+      і атомарно замінює знімок;
+    - хуки інвалідації дозволяють повідомити інші воркери,
+      які у відповідь викликають mark_stale().
+    SETTINGS_CACHE_TTL (сек.) - страховка на випадок, якщо хук не налаштовано.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[SettingsSnapshot] = None
+        self._loaded_at: float = 0.0
+        self.ttl: float = float(os.environ.get("SETTINGS_CACHE_TTL", "60"))
+        self._invalidation_hooks: List[Callable[[], Awaitable[None]]] = []
+
+    def add_invalidation_hook(self, hook: Callable[[], Awaitable[None]]):
+        """Реєструє async-хук, який викликається після локального оновлення знімка."""
+        self._invalidation_hooks.append(hook)
+
+    def mark_stale(self):
+        """Скидає знімок (наприклад, за сигналом від іншого воркера)."""
+        self._snapshot = None
+
+    async def load(self, session: AsyncSession, reload: bool = False) -> SettingsSnapshot:
+        row = await session.get(Settings, 1, populate_existing=reload)
+        snapshot = SettingsSnapshot(row or Settings())
+        self._snapshot = snapshot
+        self._loaded_at = time.monotonic()
+        return snapshot
+
+    async def get(self, session: AsyncSession) -> SettingsSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None or (self.ttl > 0 and time.monotonic() - self._loaded_at > self.ttl):
+            snapshot = await self.load(session)
+        return snapshot
+
+    async def refresh(self, session: AsyncSession) -> SettingsSnapshot:
+        """Write-through після commit: перечитує рядок і сповіщає інші воркери."""
+        # populate_existing: підтягуємо значення з БД, включно з server_default
+        snapshot = await self.load(session, reload=True)
+        for hook in self._invalidation_hooks:
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Помилка хука інвалідації налаштувань: {e}")
+        return snapshot
+
+
+# Глобальний екземпляр
+settings_cache = SettingsCache()
+
+
+async def _publish_settings_changed():
+    await event_bus.publish("cache_invalidate", {"cache": "settings"})
+
+
+def _on_remote_invalidate(payload: dict):
+    if payload.get("cache") in ("settings", ALL_CACHES):
+        settings_cache.mark_stale()
+
+
+settings_cache.add_invalidation_hook(_publish_settings_changed)
+event_bus.subscribe("cache_invalidate", _on_remote_invalidate)
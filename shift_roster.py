@@ -0,0 +1,133 @@
+# shift_roster.py
+
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from models import Employee
+from event_bus import event_bus, ALL_CACHES
+
+logger = logging.getLogger(__name__)
+
+# Прапори Role, за якими шукаємо адресатів сповіщень
+CAPABILITIES = (
+    "can_manage_orders",
+    "can_be_assigned",
+    "can_serve_tables",
+    "can_receive_kitchen_orders",
+    "can_receive_bar_orders",
+)
+
+
+class RosterEmployee:
+    """Незмінна копія працівника на зміні (для використання поза сесією)."""
+
+    __slots__ = ("id", "full_name", "telegram_user_id", "role_id", "workshop_ids", "capabilities")
+
+    def __init__(self, row: Employee):
+        object.__setattr__(self, "id", row.id)
+        object.__setattr__(self, "full_name", row.full_name)
+        object.__setattr__(self, "telegram_user_id", row.telegram_user_id)
+        object.__setattr__(self, "role_id", row.role_id)
+        object.__setattr__(self, "workshop_ids", frozenset(row.assigned_workshop_ids or []))
+        object.__setattr__(self, "capabilities", frozenset(c for c in CAPABILITIES if row.role and getattr(row.role, c)))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("RosterEmployee доступний лише для читання")
+
+
+class RosterSnapshot:
+    """Працівники на зміні з індексами за прапорами ролі та цехами."""
+
+    def __init__(self, version: int, rows: List[Employee]):
+        self.version = version
+        self.by_id: Dict[int, RosterEmployee] = {r.id: RosterEmployee(r) for r in rows}
+        ordered = sorted(self.by_id.values(), key=lambda e: e.id)
+
+        self._by_capability: Dict[str, Tuple[RosterEmployee, ...]] = {
+            cap: tuple(e for e in ordered if cap in e.capabilities) for cap in CAPABILITIES
+        }
+        by_workshop: Dict[int, List[RosterEmployee]] = {}
+        for e in ordered:
+            for ws_id in e.workshop_ids:
+                by_workshop.setdefault(ws_id, []).append(e)
+        self._by_workshop: Dict[int, Tuple[RosterEmployee, ...]] = {k: tuple(v) for k, v in by_workshop.items()}
+
+    def with_capability(self, capability: str) -> Tuple[RosterEmployee, ...]:
+        return self._by_capability[capability]
+
+    def in_workshops(self, workshop_ids: Iterable[int]) -> List[RosterEmployee]:
+        result: Dict[int, RosterEmployee] = {}
+        for ws_id in workshop_ids:
+            for e in self._by_workshop.get(ws_id, ()):
+                result[e.id] = e
+        return sorted(result.values(), key=lambda e: e.id)
+
+    def production_staff(self, capability: str, workshop_ids: Iterable[int], unrouted: bool = False) -> List[RosterEmployee]:
+        """
+        Адресати страв цеху: працівники з прапором capability, закріплені за цехами workshop_ids.
+        Страви без цеху (unrouted) або цех без нікого на зміні - усім з прапором, як раніше.
+        """
+        staff = [e for e in self.in_workshops(workshop_ids) if capability in e.capabilities]
+        if unrouted or not staff:
+            by_id = {e.id: e for e in staff}
+            by_id.update((e.id, e) for e in self._by_capability[capability])
+            staff = sorted(by_id.values(), key=lambda e: e.id)
+        return staff
+
+    def telegram_ids(self, capability: str) -> List[int]:
+        return [e.telegram_user_id for e in self._by_capability[capability] if e.telegram_user_id]
+
+
+class ShiftRoster:
+    """
+    Склад зміни в пам'яті процесу: хто зараз на зміні і що може приймати.
+    Перечитується одним запитом після invalidate() - його викликають при
+    відкритті/закритті зміни, вході/виході з бота та змінах працівників і ролей.
+    """
+
+    def __init__(self):
+        self.version: int = 1
+        self._snapshot: Optional[RosterSnapshot] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, broadcast: bool = True):
+        """Викликати ПІСЛЯ commit змін Employee.is_on_shift / telegram_user_id / ролей."""
+        self.version += 1
+        if broadcast:
+            event_bus.publish_nowait("cache_invalidate", {"cache": "shift_roster"})
+
+    async def get(self, session: AsyncSession) -> RosterSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+
+        async with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == self.version:
+                return snapshot
+
+            version = self.version
+            rows = (await session.execute(
+                select(Employee).where(Employee.is_on_shift == True).options(joinedload(Employee.role))
+            )).scalars().all()
+            snapshot = RosterSnapshot(version, rows)
+            self._snapshot = snapshot
+            logger.info(f"Склад зміни завантажено (версія {version}): {len(rows)} працівників")
+            return snapshot
+
+
+# Глобальний екземпляр
+shift_roster = ShiftRoster()
+
+
+def _on_remote_invalidate(payload: dict):
+    if payload.get("cache") in ("shift_roster", ALL_CACHES):
+        shift_roster.invalidate(broadcast=False)
+
+
+event_bus.subscribe("cache_invalidate", _on_remote_invalidate)
@@ -8,18 +8,19 @@ from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, Form, Request, Response, status
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, func, delete, and_, desc
+from sqlalchemy import select, or_, delete, and_, desc
 from sqlalchemy.orm import joinedload, selectinload
 
 # Імпорт моделей і залежностей
 from models import (
-    Employee, Settings, Order, OrderStatus, Role, OrderItem, Table, 
-    Category, Product, OrderStatusHistory, StaffNotification, BalanceHistory
+    Employee, Order, Role, OrderItem, Table, 
+    Product, OrderStatusHistory, StaffNotification, BalanceHistory
 )
 # Імпорт моделей інвентаря
 from inventory_models import Modifier, Supplier, InventoryDoc, InventoryDocItem, Warehouse, Ingredient
 
 from dependencies import get_db_session
+from settings_cache import settings_cache
 from auth_utils import verify_password, create_access_token, get_current_staff
 
 # Імпорт шаблонів
@@ -31,7 +32,6 @@ from staff_templates import (
 # Імпорт менеджерів сповіщень та каси
 from notification_manager import (
     notify_all_parties_on_status_change, 
-    notify_new_order_to_staff, 
     notify_station_completion,
     create_staff_notification
 )
@@ -46,6 +46,11 @@ from inventory_service import (
     generate_cook_ticket, calculate_order_prime_cost
 )
 from websocket_manager import manager
+from menu_cache import menu_cache
+from status_registry import status_registry, STATUS_NEW, STATUS_PROCESSING, STATUS_READY
+from table_service import get_waiter_tables_occupancy
+from shift_roster import shift_roster
+from notification_outbox import enqueue_notification, OUTBOX_NEW_ORDER
 
 # Налаштування роутера та логера
 router = APIRouter(prefix="/staff", tags=["staff_pwa"])
@@ -125,7 +130,7 @@ async def check_and_update_order_readiness(session: AsyncSession, order_id: int,
 
     # Якщо ВСЕ готово, змінюємо глобальний статус замовлення
     if all_items_ready:
-        ready_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "Готовий до видачі").limit(1))
+        ready_status = (await status_registry.get(session)).by_name(STATUS_READY)
         
         # Змінюємо статус тільки якщо він ще не фінальний і не "Готов"
         if ready_status and order.status_id != ready_status.id and not order.status.is_completed_status:
@@ -218,7 +223,7 @@ async def dashboard(request: Request, session: AsyncSession = Depends(get_db_ses
         response.delete_cookie("staff_access_token")
         return response
 
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     
     if 'role' not in employee.__dict__:
         await session.refresh(employee, ['role'])
@@ -279,7 +284,7 @@ async def dashboard(request: Request, session: AsyncSession = Depends(get_db_ses
     
     <div id="main-view">
         <div id="loading-indicator"><i class="fa-solid fa-spinner fa-spin"></i> Завантаження...</div>
-        <div id="content-area"></div>
+        <div id="content-area" data-orders-mode="{'general' if is_admin_operator else 'waiter'}"></div>
     </div>
 
     <div class="bottom-nav" id="bottom-nav">
@@ -295,7 +300,7 @@ async def dashboard(request: Request, session: AsyncSession = Depends(get_db_ses
 
 @router.get("/manifest.json")
 async def get_manifest(session: AsyncSession = Depends(get_db_session)):
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await settings_cache.get(session)
     return JSONResponse({
         "name": f"{settings.site_title} Staff",
         "short_name": "Staff",
@@ -316,6 +321,7 @@ async def get_manifest(session: AsyncSession = Depends(get_db_session)):
 async def toggle_shift_api(session: AsyncSession = Depends(get_db_session), employee: Employee = Depends(get_current_staff)):
     employee.is_on_shift = not employee.is_on_shift
     await session.commit()
+    shift_roster.invalidate()
     return JSONResponse({"status": "ok", "is_on_shift": employee.is_on_shift})
 
 @router.get("/api/notifications")
@@ -423,26 +429,24 @@ async def get_staff_data(
 # --- РЕНДЕРИНГ КОНТЕНТУ ---
 
 async def _render_tables_view(session: AsyncSession, employee: Employee):
-    tables = (await session.execute(
-        select(Table)
-        .where(Table.assigned_waiters.any(Employee.id == employee.id))
-        .order_by(Table.name)
-    )).scalars().all()
+    tables = await get_waiter_tables_occupancy(session, employee.id)
     
     if not tables: 
         return JSONResponse({"html": "<div class='empty-state'><i class='fa-solid fa-chair'></i>За вами не закріплено столиків.</div>"})
     
     html_content = "<div class='grid-container'>"
     for t in tables:
-        final_ids = select(OrderStatus.id).where(or_(OrderStatus.is_completed_status==True, OrderStatus.is_cancelled_status==True))
-        active_count = await session.scalar(
-            select(func.count(Order.id)).where(Order.table_id == t.id, Order.status_id.not_in(final_ids))
-        )
+        active_count = t.active_count
         
         badge_class = "alert" if active_count > 0 else "success"
         border_color = "#e74c3c" if active_count > 0 else "transparent"
         bg_color = "#fff"
-        status_text = f"{active_count} активних" if active_count > 0 else "Вільний"
+        if active_count > 0:
+            status_text = f"{active_count} активних · {t.open_total:.2f} грн"
+            if t.oldest_minutes is not None:
+                status_text += f" · {t.oldest_minutes} хв"
+        else:
+            status_text = "Вільний"
         
         html_content += STAFF_TABLE_CARD.format(
             id=t.id, 
@@ -456,7 +460,7 @@ async def _render_tables_view(session: AsyncSession, employee: Employee):
     return JSONResponse({"html": html_content})
 
 async def _get_waiter_orders_grouped(session: AsyncSession, employee: Employee):
-    final_ids = (await session.execute(select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True)))).scalars().all()
+    final_ids = (await status_registry.get(session)).final_ids
     
     tables_sub = select(Table.id).where(Table.assigned_waiters.any(Employee.id == employee.id))
     
@@ -763,10 +767,8 @@ async def _get_production_orders(session: AsyncSession, employee: Employee):
         return []
 
     # 2. Завантажуємо замовлення зі статусами, видимими для виробництва
-    status_query = select(OrderStatus.id).where(
-        or_(OrderStatus.visible_to_chef == True, OrderStatus.visible_to_bartender == True)
-    )
-    status_ids = (await session.execute(status_query)).scalars().all()
+    statuses = await status_registry.get(session)
+    status_ids = (statuses.visible_ids["chef"] | statuses.visible_ids["bartender"]) & statuses.kitchen_notify_ids
     
     if status_ids:
         q = select(Order).options(
@@ -774,8 +776,7 @@ async def _get_production_orders(session: AsyncSession, employee: Employee):
             selectinload(Order.items).joinedload(OrderItem.product), 
             joinedload(Order.status)
         ).where(
-            Order.status_id.in_(status_ids), 
-            Order.status.has(requires_kitchen_notify=True)
+            Order.status_id.in_(status_ids)
         ).order_by(Order.id.asc())
         
         orders = (await session.execute(q)).scalars().all()
@@ -843,7 +844,7 @@ async def _get_production_orders(session: AsyncSession, employee: Employee):
     return orders_data
 
 async def _get_my_courier_orders(session: AsyncSession, employee: Employee):
-    final_ids = (await session.execute(select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True)))).scalars().all()
+    final_ids = (await status_registry.get(session)).final_ids
     q = select(Order).options(joinedload(Order.status), selectinload(Order.items)).where(Order.courier_id == employee.id, Order.status_id.not_in(final_ids)).order_by(Order.id.desc())
     orders = (await session.execute(q)).scalars().all()
     res = []
@@ -883,7 +884,7 @@ async def _get_my_courier_orders(session: AsyncSession, employee: Employee):
     return res
 
 async def _get_all_delivery_orders_for_admin(session: AsyncSession, employee: Employee):
-    final_ids = (await session.execute(select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True)))).scalars().all()
+    final_ids = (await status_registry.get(session)).final_ids
     
     q = select(Order).options(
         joinedload(Order.status), joinedload(Order.courier)
@@ -917,7 +918,7 @@ async def _get_all_delivery_orders_for_admin(session: AsyncSession, employee: Em
     return res
 
 async def _get_general_orders(session: AsyncSession, employee: Employee):
-    final_ids = (await session.execute(select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True)))).scalars().all()
+    final_ids = (await status_registry.get(session)).final_ids
     
     q = select(Order).options(
         joinedload(Order.status), joinedload(Order.table), joinedload(Order.accepted_by_waiter), joinedload(Order.courier), selectinload(Order.items)
@@ -980,20 +981,18 @@ async def get_order_details(order_id: int, session: AsyncSession = Depends(get_d
     order = await session.get(Order, order_id, options=[selectinload(Order.items), joinedload(Order.status), joinedload(Order.courier)])
     if not order: return JSONResponse({"error": "Не знайдено"}, status_code=404)
     
-    status_query = select(OrderStatus)
+    registry = await status_registry.get(session)
     if employee.role.can_manage_orders:
-        status_query = status_query.where(OrderStatus.visible_to_operator == True)
+        statuses = registry.visible_to("operator")
     elif employee.role.can_be_assigned:
-        status_query = status_query.where(OrderStatus.visible_to_courier == True)
+        statuses = registry.visible_to("courier")
     elif employee.role.can_serve_tables:
-        status_query = status_query.where(OrderStatus.visible_to_waiter == True)
+        statuses = registry.visible_to("waiter")
     else:
-        status_query = status_query.where(OrderStatus.id == order.status_id)
-    
-    statuses = (await session.execute(status_query.order_by(OrderStatus.id))).scalars().all()
+        statuses = []
     
     if order.status_id not in [s.id for s in statuses]:
-        current_s = await session.get(OrderStatus, order.status_id)
+        current_s = registry.get(order.status_id)
         if current_s: statuses.append(current_s)
 
     status_list = [{"id": s.id, "name": s.name, "selected": s.id == order.status_id, "is_completed": s.is_completed_status, "is_cancelled": s.is_cancelled_status} for s in statuses]
@@ -1102,7 +1101,8 @@ async def update_order_status_api(
          return JSONResponse({"error": "Немає прав"}, 403)
 
     old_status = order.status.name
-    new_status = await session.get(OrderStatus, new_status_id)
+    new_status = (await status_registry.get(session)).get(new_status_id)
+    if not new_status: return JSONResponse({"error": "Статус не знайдено"}, 404)
     
     # --- НОВА ПЕРЕВІРКА ПРАВ НА СКАСУВАННЯ ---
     if new_status.is_cancelled_status:
@@ -1177,7 +1177,7 @@ async def cancel_order_complex_api(
     if not order: return JSONResponse({"error": "Замовлення не знайдено"}, 404)
 
     # Знаходимо статус скасування
-    cancel_status = await session.scalar(select(OrderStatus).where(OrderStatus.is_cancelled_status == True).limit(1))
+    cancel_status = (await status_registry.get(session)).first_cancelled()
     if not cancel_status: return JSONResponse({"error": "Статус скасування не налаштовано"}, 500)
 
     old_status_name = order.status.name
@@ -1309,7 +1309,7 @@ async def update_order_items_api(
                 ))
     
     if order.is_delivery:
-        settings = await session.get(Settings, 1) or Settings()
+        settings = await settings_cache.get(session)
         delivery_cost = settings.delivery_cost
         if settings.free_delivery_from is not None and total_price >= settings.free_delivery_from:
             delivery_cost = Decimal(0)
@@ -1321,10 +1321,7 @@ async def update_order_items_api(
     await session.commit()
     
     msg = f"🔄 Замовлення #{order.id} оновлено ({employee.full_name})"
-    chefs = (await session.execute(
-        select(Employee).join(Role).where(Role.can_receive_kitchen_orders==True, Employee.is_on_shift==True)
-    )).scalars().all()
-    for c in chefs:
+    for c in (await shift_roster.get(session)).with_capability("can_receive_kitchen_orders"):
         await create_staff_notification(session, c.id, msg)
         
     return JSONResponse({"success": True})
@@ -1356,7 +1353,7 @@ async def handle_action_api(
             order = await session.get(Order, order_id)
             if order and not order.accepted_by_waiter_id:
                 order.accepted_by_waiter_id = employee.id
-                proc_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "В обробці").limit(1))
+                proc_status = (await status_registry.get(session)).by_name(STATUS_PROCESSING)
                 if proc_status: order.status_id = proc_status.id
                 await session.commit()
                 return JSONResponse({"success": True})
@@ -1369,46 +1366,10 @@ async def handle_action_api(
 @router.get("/api/menu/full")
 async def get_full_menu(session: AsyncSession = Depends(get_db_session)):
     """
-    Повертає повне меню ресторану для PWA.
+    Повертає повне меню ресторану для PWA (з кешу каталогу).
     """
-    cats = (await session.execute(select(Category).where(Category.show_in_restaurant==True).order_by(Category.sort_order))).scalars().all()
-    
-    menu = []
-    for c in cats:
-        prods = (await session.execute(
-            select(Product)
-            .where(Product.category_id==c.id, Product.is_active==True)
-            .options(selectinload(Product.modifiers))
-        )).scalars().all()
-        
-        prod_list = []
-        for p in prods:
-            p_mods = []
-            if p.modifiers:
-                for m in p.modifiers:
-                    price_val = m.price if m.price is not None else 0
-                    p_mods.append({
-                        "id": m.id, 
-                        "name": m.name, 
-                        "price": float(price_val)
-                    })
-            
-            prod_list.append({
-                "id": p.id, 
-                "name": p.name, 
-                "price": float(p.price), 
-                "preparation_area": p.preparation_area,
-                "production_warehouse_id": p.production_warehouse_id, # Важливо для фільтрації
-                "modifiers": p_mods 
-            })
-            
-        menu.append({
-            "id": c.id, 
-            "name": c.name, 
-            "products": prod_list
-        })
-        
-    return JSONResponse({"menu": menu})
+    snapshot = await menu_cache.get(session)
+    return Response(content=snapshot.staff_json, media_type="application/json")
 
 @router.post("/api/order/create")
 async def create_waiter_order(
@@ -1484,7 +1445,7 @@ async def create_waiter_order(
                     modifiers=final_mods # JSON з warehouse_id
                 ))
         
-        new_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "Новий").limit(1))
+        new_status = (await status_registry.get(session)).by_name(STATUS_NEW)
         status_id = new_status.id if new_status else 1
         
         order = Order(
@@ -1506,14 +1467,10 @@ async def create_waiter_order(
             item_data.order_id = order.id
             session.add(item_data)
 
-        await session.commit()
-        
-        await session.refresh(order, ['status'])
-        
         session.add(OrderStatusHistory(order_id=order.id, status_id=status_id, actor_info=f"{employee.full_name} (PWA)"))
+        # Сповіщення - фоновим воркером, в тій самій транзакції, що й замовлення
+        enqueue_notification(session, OUTBOX_NEW_ORDER, {"order_id": order.id})
         await session.commit()
-        
-        await notify_new_order_to_staff(request.app.state.admin_bot, order, session)
         return JSONResponse({"success": True, "orderId": order.id})
     except Exception as e:
         logger.error(f"Order create error: {e}")
@@ -1762,12 +1719,12 @@ async def create_staff_delivery_order(
                 ))
         
         # Додаємо вартість доставки якщо є в налаштуваннях
-        settings = await session.get(Settings, 1) or Settings()
+        settings = await settings_cache.get(session)
         if settings.delivery_cost > 0:
              if settings.free_delivery_from is None or total < settings.free_delivery_from:
                  total += settings.delivery_cost
 
-        new_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "Новий").limit(1))
+        new_status = (await status_registry.get(session)).by_name(STATUS_NEW)
         status_id = new_status.id if new_status else 1
         
         order = Order(
@@ -1789,15 +1746,11 @@ async def create_staff_delivery_order(
             item_data.order_id = order.id
             session.add(item_data)
 
-        await session.commit()
-        await session.refresh(order, ['status'])
-        
         session.add(OrderStatusHistory(order_id=order.id, status_id=status_id, actor_info=f"{employee.full_name} (PWA)"))
+        # Сповіщаємо систему (фоновим воркером, в тій самій транзакції, що й замовлення)
+        enqueue_notification(session, OUTBOX_NEW_ORDER, {"order_id": order.id})
         await session.commit()
         
-        # Сповіщаємо систему
-        await notify_new_order_to_staff(request.app.state.admin_bot, order, session)
-        
         return JSONResponse({"success": True, "orderId": order.id})
     except Exception as e:
         logger.error(f"Create Delivery Error: {e}")
@@ -475,6 +475,9 @@ STAFF_DASHBOARD_HTML = """
         // WebSocket variables
         let ws = null;
         let wsRetryInterval = 1000;
+        let lastSeq = null; // Номер останньої отриманої події (null - ще не було sync)
+        let wsWasConnected = false;
+        let fetchTimer = null;
 
         document.addEventListener('DOMContentLoaded', () => {{
             const activeBtn = document.querySelector('.nav-item.active');
@@ -525,20 +528,38 @@ STAFF_DASHBOARD_HTML = """
                     const data = JSON.parse(event.data);
                     console.log("WS Message:", data);
 
-                    // Если пришло событие обновления заказа/очереди
+                    // Початковий номер після (пере)підключення
+                    if (data.type === 'sync') {{
+                        lastSeq = data.seq;
+                        // Під час розриву могли бути пропущені події - повна синхронізація
+                        if (wsWasConnected) scheduleFetch();
+                        wsWasConnected = true;
+                        return;
+                    }}
+
+                    let gap = false;
+                    if (typeof data.seq === 'number') {{
+                        gap = lastSeq !== null && data.seq !== lastSeq + 1;
+                        lastSeq = data.seq;
+                    }}
+
+                    // Якщо пришло событие обновления заказа/очереди
                     if (data.type === 'new_order' || data.type === 'order_updated' || data.type === 'item_ready') {{
                         // Если это "новый заказ" - показываем уведомление
                         if (data.type === 'new_order') showToast("🔔 " + data.message);
-                        else showToast("🔄 Оновлення даних...");
                         
-                        // Обновляем текущий список
-                        fetchData(); 
+                        // Пропущено подію - перечитуємо вкладку повністю,
+                        // інакше оновлюємо лише картку цього замовлення
+                        // refetch - дельта не передана (завелика для шини подій)
+                        if (gap || data.refetch) scheduleFetch();
+                        else if (data.order && !applyOrderDelta(data.type, data.order)) scheduleFetch();
                         
                         // Если открыто модальное окно с этим заказом - обновляем его
                         if (editingOrderId && data.order_id == editingOrderId) {{
                             openOrderEditModal(editingOrderId, true); 
                         }}
                     }}
+                    else if (gap || data.refetch) scheduleFetch();
                 }} catch (e) {{ console.error("WS Parse Error", e); }}
             }};
 
@@ -554,6 +575,50 @@ STAFF_DASHBOARD_HTML = """
             }};
         }}
 
+        // Кілька подій поспіль - один запит до сервера
+        function scheduleFetch() {{
+            if (fetchTimer) return;
+            fetchTimer = setTimeout(() => {{ fetchTimer = null; fetchData(); }}, 300);
+        }}
+
+        function orderBadgeText(order) {{
+            // Ті самі правила, що й при рендері карток на сервері (staff_pwa.py)
+            if (currentView === 'delivery_courier') {{
+                if (order.kitchen_done && order.bar_done) return "📦 ВСЕ ГОТОВО";
+                if (order.kitchen_done) return "🍳 Кухня готова";
+                return order.status;
+            }}
+            if (currentView === 'orders' && document.getElementById('content-area').dataset.ordersMode === 'waiter') {{
+                const parts = [order.status];
+                if (order.kitchen_done) parts.push("🍳Готово");
+                if (order.bar_done) parts.push("🍹Готово");
+                return parts.join(" | ");
+            }}
+            return order.status;
+        }}
+
+        // Оновлює картку замовлення на місці. false - потрібне повне оновлення вкладки.
+        function applyOrderDelta(type, order) {{
+            if (currentView === 'notifications') return true;
+            if (currentView === 'tables') return !order.table_id;
+
+            const listViews = ['orders', 'delivery_admin', 'delivery_courier', 'production'];
+            if (!listViews.includes(currentView)) return false;
+
+            const card = document.getElementById(`order-${{order.id}}`);
+            // Завершені/скасовані замовлення не показуються в жодному списку
+            if (order.is_final) {{
+                if (card) card.remove();
+                return true;
+            }}
+            // Нове для цієї вкладки замовлення або зміна складу черги кухні/бару
+            if (!card || type === 'new_order' || currentView === 'production') return false;
+
+            const badge = card.querySelector('.card-header .badge');
+            if (badge) badge.textContent = orderBadgeText(order);
+            return true;
+        }}
+
         function initNotifications() {{
             if (!("Notification" in window)) return;
             if (Notification.permission === "default") {{
@@ -0,0 +1,134 @@
+# status_registry.py
+
+import asyncio
+import logging
+from typing import Dict, FrozenSet, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import OrderStatus
+from event_bus import event_bus, ALL_CACHES
+
+logger = logging.getLogger(__name__)
+
+# Ролі, для яких у OrderStatus є прапор visible_to_<role>
+STATUS_ROLES = ("operator", "courier", "waiter", "chef", "bartender")
+
+# Назви системних статусів (створюються при першому запуску)
+STATUS_NEW = "Новий"
+STATUS_PROCESSING = "В обробці"
+STATUS_READY = "Готовий до видачі"
+
+
+class StatusInfo:
+    """Незмінна копія рядка OrderStatus (для використання поза сесією)."""
+
+    __slots__ = (
+        "id", "name", "notify_customer", "requires_kitchen_notify",
+        "is_completed_status", "is_cancelled_status",
+        "visible_to_operator", "visible_to_courier", "visible_to_waiter",
+        "visible_to_chef", "visible_to_bartender",
+    )
+
+    def __init__(self, row: OrderStatus):
+        for key in self.__slots__:
+            object.__setattr__(self, key, getattr(row, key))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("StatusInfo доступний лише для читання")
+
+    @property
+    def is_final(self) -> bool:
+        return bool(self.is_completed_status or self.is_cancelled_status)
+
+
+class StatusSnapshot:
+    """Довідник статусів з готовими наборами ID."""
+
+    def __init__(self, version: int, rows: List[OrderStatus]):
+        self.version = version
+        self.by_id: Dict[int, StatusInfo] = {r.id: StatusInfo(r) for r in rows}
+        self.ordered: List[StatusInfo] = sorted(self.by_id.values(), key=lambda s: s.id)
+
+        self.completed_ids: FrozenSet[int] = frozenset(s.id for s in self.ordered if s.is_completed_status)
+        self.cancelled_ids: FrozenSet[int] = frozenset(s.id for s in self.ordered if s.is_cancelled_status)
+        self.final_ids: FrozenSet[int] = self.completed_ids | self.cancelled_ids
+        self.kitchen_notify_ids: FrozenSet[int] = frozenset(s.id for s in self.ordered if s.requires_kitchen_notify)
+        self.notify_customer_ids: FrozenSet[int] = frozenset(s.id for s in self.ordered if s.notify_customer)
+        self.visible_ids: Dict[str, FrozenSet[int]] = {
+            role: frozenset(s.id for s in self.ordered if getattr(s, f"visible_to_{role}"))
+            for role in STATUS_ROLES
+        }
+
+        self._by_name: Dict[str, StatusInfo] = {}
+        for s in self.ordered:
+            # Як і select(...).where(name == ...).limit(1): перший за ID
+            self._by_name.setdefault(s.name, s)
+
+    def get(self, status_id: Optional[int]) -> Optional[StatusInfo]:
+        return self.by_id.get(status_id)
+
+    def by_name(self, name: str) -> Optional[StatusInfo]:
+        return self._by_name.get(name)
+
+    def visible_to(self, role: str) -> List[StatusInfo]:
+        ids = self.visible_ids[role]
+        return [s for s in self.ordered if s.id in ids]
+
+    def first_cancelled(self) -> Optional[StatusInfo]:
+        return next((s for s in self.ordered if s.is_cancelled_status), None)
+
+
+class StatusRegistry:
+    """
+    Довідник статусів замовлень у пам'яті процесу.
+    Завантажується один раз і перечитується після змін в admin_statuses.py.
+    """
+
+    def __init__(self):
+        self.version: int = 1
+        self._snapshot: Optional[StatusSnapshot] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, broadcast: bool = True):
+        """Викликати ПІСЛЯ commit змін статусів."""
+        self.version += 1
+        if broadcast:
+            event_bus.publish_nowait("cache_invalidate", {"cache": "statuses"})
+
+    def current(self) -> Optional[StatusSnapshot]:
+        """Актуальний довідник без звернення до БД (None - ще не завантажено або застарів)."""
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+        return None
+
+    async def get(self, session: AsyncSession) -> StatusSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+
+        async with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == self.version:
+                return snapshot
+
+            version = self.version
+            rows = (await session.execute(select(OrderStatus).order_by(OrderStatus.id))).scalars().all()
+            snapshot = StatusSnapshot(version, rows)
+            self._snapshot = snapshot
+            logger.info(f"Довідник статусів завантажено (версія {version}): {len(rows)} статусів")
+            return snapshot
+
+
+# Глобальний екземпляр
+status_registry = StatusRegistry()
+
+
+def _on_remote_invalidate(payload: dict):
+    if payload.get("cache") in ("statuses", ALL_CACHES):
+        status_registry.invalidate(broadcast=False)
+
+
+event_bus.subscribe("cache_invalidate", _on_remote_invalidate)
@@ -0,0 +1,171 @@
+# stock_ledger.py
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy import select, func, text, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import async_session_maker
+from inventory_models import Stock, StockMovement, StockSnapshot
+from stock_posting import StockKey
+
+logger = logging.getLogger(__name__)
+
+# Як часто знімати залишки всіх складів (год.)
+STOCK_SNAPSHOT_INTERVAL_HOURS = float(os.environ.get("STOCK_SNAPSHOT_INTERVAL_HOURS", "24"))
+# Ключ pg_try_advisory_xact_lock: знімок робить лише один воркер
+STOCK_SNAPSHOT_LOCK_KEY = 7_310_003
+
+
+async def take_stock_snapshot(session: AsyncSession) -> Optional[datetime]:
+    """
+    Знімок поточних залишків усіх складів з одним ts. Commit - на стороні виклику.
+    LOCK TABLE stocks IN SHARE MODE чекає завершення проведень, що вже змінили залишки,
+    і не пускає нові до commit знімка. Рух у журналі має ts = clock_timestamp() на момент
+    запису (вже під блокуванням stocks), тож кожен рядок журналу або врахований у знімку
+    (ts <= ts знімка), або ні (ts > ts знімка) - без подвійного обліку і пропусків.
+    """
+    await session.execute(text("LOCK TABLE stocks IN SHARE MODE"))
+    ts = await session.scalar(select(sa.cast(func.clock_timestamp(), sa.DateTime)))
+    result = await session.execute(
+        sa.insert(StockSnapshot).from_select(
+            ["ts", "warehouse_id", "ingredient_id", "quantity"],
+            select(sa.literal(ts, sa.DateTime), Stock.warehouse_id, Stock.ingredient_id, func.coalesce(Stock.quantity, 0))
+        )
+    )
+    logger.info(f"Склад: знімок залишків на {ts:%d.%m.%Y %H:%M} ({result.rowcount} рядків)")
+    return ts
+
+
+def _scoped(stmt, model, warehouse_id: Optional[int], ingredient_ids: Optional[list]):
+    if warehouse_id:
+        stmt = stmt.where(model.warehouse_id == warehouse_id)
+    if ingredient_ids is not None:
+        stmt = stmt.where(model.ingredient_id.in_(ingredient_ids))
+    return stmt
+
+
+async def ledger_start(session: AsyncSession) -> Optional[datetime]:
+    """Час першого знімка: журнал руху веде облік лише з цього моменту."""
+    return await session.scalar(select(func.min(StockSnapshot.ts)))
+
+
+async def stock_as_of(session: AsyncSession, at: datetime, warehouse_id: Optional[int] = None,
+                      ingredient_ids: Optional[Iterable[int]] = None) -> Optional[Dict[StockKey, Decimal]]:
+    """
+    Залишки на момент at: {(склад, інгредієнт): кількість}.
+    Найближчий знімок до at плюс рух журналу між ними - без перегляду всієї історії.
+    До першого знімка даних немає (журнал ведеться з нього) - повертає None.
+    """
+    ingredient_ids = list(ingredient_ids) if ingredient_ids is not None else None
+
+    snap_ts = await session.scalar(select(func.max(StockSnapshot.ts)).where(StockSnapshot.ts <= at))
+    if snap_ts is None:
+        return None
+
+    base = select(StockSnapshot.warehouse_id, StockSnapshot.ingredient_id, StockSnapshot.quantity).where(StockSnapshot.ts == snap_ts)
+    base = _scoped(base, StockSnapshot, warehouse_id, ingredient_ids)
+
+    result: Dict[StockKey, Decimal] = {}
+    for wh_id, ing_id, qty in (await session.execute(base)).all():
+        result[(wh_id, ing_id)] = Decimal(str(qty or 0))
+
+    moves = _scoped(
+        select(StockMovement.warehouse_id, StockMovement.ingredient_id, func.sum(StockMovement.delta))
+        .where(StockMovement.ts > snap_ts, StockMovement.ts <= at)
+        .group_by(StockMovement.warehouse_id, StockMovement.ingredient_id),
+        StockMovement, warehouse_id, ingredient_ids
+    )
+    for wh_id, ing_id, delta in (await session.execute(moves)).all():
+        key = (wh_id, ing_id)
+        result[key] = result.get(key, Decimal(0)) + Decimal(str(delta or 0))
+    return result
+
+
+async def usage_for_period(session: AsyncSession, date_from: datetime, date_to: datetime,
+                           warehouse_id: Optional[int] = None,
+                           ingredient_ids: Optional[Iterable[int]] = None) -> Optional[Dict[int, Tuple[Decimal, Decimal, Decimal, Decimal]]]:
+    """
+    Рух по інгредієнтах за період (по всіх складах або по одному):
+    {ingredient_id: (на початок, прихід, витрата, на кінець)}.
+    Переміщення між складами без фільтра складу потрапляють і в прихід, і у витрату.
+    Період, що починається до першого знімка, - None (залишку на початок немає).
+    """
+    ingredient_ids = list(ingredient_ids) if ingredient_ids is not None else None
+
+    balances = await stock_as_of(session, date_from, warehouse_id, ingredient_ids)
+    if balances is None:
+        return None
+    opening: Dict[int, Decimal] = {}
+    for (_, ing_id), qty in balances.items():
+        opening[ing_id] = opening.get(ing_id, Decimal(0)) + qty
+
+    moves = _scoped(
+        select(
+            StockMovement.ingredient_id,
+            func.coalesce(func.sum(case((StockMovement.delta > 0, StockMovement.delta), else_=0)), 0),
+            func.coalesce(func.sum(case((StockMovement.delta < 0, -StockMovement.delta), else_=0)), 0),
+        )
+        .where(StockMovement.ts > date_from, StockMovement.ts <= date_to)
+        .group_by(StockMovement.ingredient_id),
+        StockMovement, warehouse_id, ingredient_ids
+    )
+    flows: Dict[int, Tuple[Decimal, Decimal]] = {
+        ing_id: (Decimal(str(incoming)), Decimal(str(outgoing)))
+        for ing_id, incoming, outgoing in (await session.execute(moves)).all()
+    }
+
+    usage: Dict[int, Tuple[Decimal, Decimal, Decimal, Decimal]] = {}
+    for ing_id in set(opening) | set(flows):
+        start = opening.get(ing_id, Decimal(0))
+        incoming, outgoing = flows.get(ing_id, (Decimal(0), Decimal(0)))
+        usage[ing_id] = (start, incoming, outgoing, start + incoming - outgoing)
+    return usage
+
+
+class StockSnapshotWorker:
+    """Фонові знімки залишків раз на STOCK_SNAPSHOT_INTERVAL_HOURS (перший - одразу, якщо знімків ще немає)."""
+
+    def __init__(self):
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        interval = timedelta(hours=STOCK_SNAPSHOT_INTERVAL_HOURS)
+        while True:
+            try:
+                await self.snapshot_if_due(interval)
+            except Exception as e:
+                logger.error(f"Склад: помилка знімка залишків: {e}", exc_info=True)
+            await asyncio.sleep(min(interval.total_seconds(), 3600))
+
+    async def snapshot_if_due(self, interval: timedelta) -> bool:
+        async with async_session_maker() as session:
+            if not await session.scalar(select(func.pg_try_advisory_xact_lock(STOCK_SNAPSHOT_LOCK_KEY))):
+                return False
+            last_ts = await session.scalar(select(func.max(StockSnapshot.ts)))
+            now = await session.scalar(select(sa.cast(func.clock_timestamp(), sa.DateTime)))
+            if last_ts is not None and now - last_ts < interval:
+                return False
+            await take_stock_snapshot(session)
+            await session.commit()
+            return True
+
+
+# Глобальний екземпляр
+snapshot_worker = StockSnapshotWorker()
@@ -0,0 +1,276 @@
+# stock_posting.py
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event as sa_event
+from sqlalchemy import select, update, insert, func, text, tuple_, values, column, Integer, Numeric
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+
+from inventory_models import Stock, Ingredient, StockMovement
+from cost_rollup import notify_costs_changed
+
+logger = logging.getLogger(__name__)
+
+# (warehouse_id, ingredient_id)
+StockKey = Tuple[int, int]
+
+# serialization_failure, deadlock_detected, lock_not_available (lock_timeout)
+RETRYABLE_SQLSTATES = {"40001", "40P01", "55P03"}
+POSTING_MAX_RETRIES = 5
+# Проведення, що чекали на блокування довше цього (сек.), пишемо в лог
+SLOW_LOCK_WAIT = 1.0
+
+
+class PostingStats:
+    """Проведення складських змін: кількість, повтори після конфліктів, час очікування блокувань."""
+
+    def __init__(self, window: int = 500):
+        self.postings = 0
+        self.retries = 0
+        self.failures = 0
+        self._lock_waits = deque(maxlen=window)
+
+    def observe(self, lock_wait: float):
+        self.postings += 1
+        self._lock_waits.append(lock_wait)
+
+    def snapshot(self) -> dict:
+        waits = sorted(self._lock_waits)
+
+        def pct(p: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(len(waits) * p))]
+
+        return {
+            "postings": self.postings,
+            "retries": self.retries,
+            "failures": self.failures,
+            "lock_wait_p50_ms": round(pct(0.50) * 1000, 1),
+            "lock_wait_p95_ms": round(pct(0.95) * 1000, 1),
+            "lock_wait_max_ms": round((waits[-1] if waits else 0.0) * 1000, 1),
+        }
+
+
+# Глобальний екземпляр
+posting_stats = PostingStats()
+
+
+def _is_retryable(e: DBAPIError) -> bool:
+    sqlstate = getattr(e.orig, "sqlstate", None) or getattr(e.orig, "pgcode", None)
+    return sqlstate in RETRYABLE_SQLSTATES
+
+
+async def _select_for_update(session: AsyncSession, keys: List[StockKey]) -> Dict[StockKey, Tuple[int, Decimal]]:
+    rows = await session.execute(
+        select(Stock.id, Stock.warehouse_id, Stock.ingredient_id, Stock.quantity)
+        .where(tuple_(Stock.warehouse_id, Stock.ingredient_id).in_(keys))
+        .order_by(Stock.warehouse_id, Stock.ingredient_id)
+        .with_for_update()
+    )
+    return {(wh_id, ing_id): (stock_id, Decimal(str(qty or 0))) for stock_id, wh_id, ing_id, qty in rows.all()}
+
+
+async def lock_stock_rows(session: AsyncSession, keys: Iterable[StockKey]) -> Dict[StockKey, Tuple[int, Decimal]]:
+    """
+    Атомарний upsert-and-lock: блокує рядки Stock для всіх ключів одним SELECT ... FOR UPDATE
+    (у порядку склад, інгредієнт), відсутні створює одним INSERT ... ON CONFLICT DO NOTHING.
+    Рядки, які паралельно вставила інша транзакція, дочитуються з блокуванням.
+    Повертає {ключ: (stock_id, кількість)}.
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return {}
+
+    locked = await _select_for_update(session, keys)
+
+    missing = [key for key in keys if key not in locked]
+    if missing:
+        inserted = await session.execute(
+            pg_insert(Stock)
+            .values([{"warehouse_id": wh_id, "ingredient_id": ing_id, "quantity": 0} for wh_id, ing_id in missing])
+            .on_conflict_do_nothing(index_elements=[Stock.warehouse_id, Stock.ingredient_id])
+            .returning(Stock.id, Stock.warehouse_id, Stock.ingredient_id)
+        )
+        for stock_id, wh_id, ing_id in inserted.all():
+            locked[(wh_id, ing_id)] = (stock_id, Decimal(0))
+
+        raced = [key for key in missing if key not in locked]
+        if raced:
+            locked.update(await _select_for_update(session, raced))
+
+    return locked
+
+
+async def ensure_stock_unique_index(conn: AsyncConnection):
+    """
+    Міграція для існуючих баз: зливає дублікати (warehouse_id, ingredient_id) в найстаріший
+    рядок (сумуючи кількість) і створює унікальний індекс. Повторний запуск нічого не робить.
+    """
+    if await conn.scalar(text("SELECT to_regclass('uq_stocks_warehouse_ingredient')")):
+        return
+
+    # Кілька воркерів стартують одночасно - мігрує один
+    await conn.execute(text("SELECT pg_advisory_xact_lock(7310002)"))
+    if await conn.scalar(text("SELECT to_regclass('uq_stocks_warehouse_ingredient')")):
+        return
+
+    await conn.execute(text("LOCK TABLE stocks IN SHARE ROW EXCLUSIVE MODE"))
+    merged = await conn.execute(text("""
+        UPDATE stocks s SET quantity = d.total
+        FROM (
+            SELECT warehouse_id, ingredient_id, MIN(id) AS keep_id, SUM(quantity) AS total
+            FROM stocks GROUP BY warehouse_id, ingredient_id HAVING COUNT(*) > 1
+        ) d
+        WHERE s.id = d.keep_id
+    """))
+    removed = await conn.execute(text("""
+        DELETE FROM stocks s USING stocks k
+        WHERE s.warehouse_id = k.warehouse_id AND s.ingredient_id = k.ingredient_id AND s.id > k.id
+    """))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_stocks_warehouse_ingredient ON stocks (warehouse_id, ingredient_id)"
+    ))
+    logger.info(f"Склад: створено унікальний індекс залишків (злито {merged.rowcount} груп, видалено {removed.rowcount} дублікатів)")
+
+
+async def lock_ingredients(session: AsyncSession, ingredient_ids: Iterable[int]):
+    """Блокує рядки Ingredient (для зміни собівартості) у порядку ID."""
+    ids = sorted(set(ingredient_ids))
+    if ids:
+        await session.execute(select(Ingredient.id).where(Ingredient.id.in_(ids)).order_by(Ingredient.id).with_for_update())
+
+
+async def apply_stock_deltas(session: AsyncSession, deltas: Dict[StockKey, Decimal],
+                             locked: Optional[Dict[StockKey, Tuple[int, Decimal]]] = None) -> Dict[StockKey, Tuple[int, Decimal]]:
+    """
+    Змінює залишки на delta для кожного ключа одним UPDATE ... FROM (VALUES ...).
+    Якщо рядки ще не заблоковані (locked=None), блокує/створює їх через lock_stock_rows.
+    Повертає заблоковані рядки зі станом ДО зміни.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return locked or {}
+
+    if locked is None or any(key not in locked for key in deltas):
+        locked = await lock_stock_rows(session, deltas.keys())
+
+    data = [(locked[key][0], delta) for key, delta in sorted(deltas.items())]
+    delta_rows = values(column("stock_id", Integer), column("delta", Numeric(10, 3)), name="stock_deltas").data(data)
+    await session.execute(
+        update(Stock)
+        .where(Stock.id == delta_rows.c.stock_id)
+        .values(quantity=Stock.quantity + delta_rows.c.delta)
+        .execution_options(synchronize_session=False)
+    )
+    return locked
+
+
+async def recompute_average_costs(session: AsyncSession, supplies: Dict[int, Tuple[Decimal, Decimal]]):
+    """
+    Середньозважена собівартість для приходу.
+    supplies = {ingredient_id: (кількість, сума)} - лише позиції з ціною > 0.
+    Викликати ДО зміни залишків: поточна кількість береться одним агрегатом по всіх складах.
+    Рядки Ingredient мають бути заблоковані заздалегідь (lock_ingredients).
+    """
+    if not supplies:
+        return
+
+    rows = await session.execute(
+        select(Ingredient.id, Ingredient.current_cost, func.coalesce(func.sum(Stock.quantity), 0))
+        .outerjoin(Stock, Stock.ingredient_id == Ingredient.id)
+        .where(Ingredient.id.in_(supplies.keys()))
+        .group_by(Ingredient.id, Ingredient.current_cost)
+        .order_by(Ingredient.id)
+    )
+
+    data = []
+    for ing_id, current_cost, existing_qty in rows.all():
+        supply_qty, supply_value = supplies[ing_id]
+        existing_qty = max(Decimal(str(existing_qty)), Decimal(0))
+        total_qty = existing_qty + supply_qty
+        if total_qty > 0:
+            new_avg_cost = (existing_qty * Decimal(str(current_cost or 0)) + supply_value) / total_qty
+            data.append((ing_id, new_avg_cost))
+
+    if not data:
+        return
+
+    cost_rows = values(column("ingredient_id", Integer), column("cost", Numeric), name="ingredient_costs").data(data)
+    await session.execute(
+        update(Ingredient)
+        .where(Ingredient.id == cost_rows.c.ingredient_id)
+        .values(current_cost=cost_rows.c.cost)
+        .execution_options(synchronize_session=False)
+    )
+
+    # Розгорнута собівартість напівфабрикатів і страв оновиться після commit
+    changed_ids = [ing_id for ing_id, _ in data]
+    sa_event.listen(session.sync_session, "after_commit", lambda _session: notify_costs_changed(changed_ids), once=True)
+
+
+async def record_movements(session: AsyncSession, deltas: Dict[StockKey, Decimal],
+                           locked: Dict[StockKey, Tuple[int, Decimal]],
+                           doc_ids: Optional[Dict[StockKey, Optional[int]]] = None):
+    """
+    Пише рядки журналу stock_movements одним executemany.
+    locked - стан рядків ДО зміни (з lock_stock_rows), з нього рахується залишок після руху.
+    """
+    rows = [
+        {
+            "warehouse_id": wh_id,
+            "ingredient_id": ing_id,
+            "delta": delta,
+            "balance": locked[(wh_id, ing_id)][1] + delta,
+            "doc_id": (doc_ids or {}).get((wh_id, ing_id)),
+        }
+        for (wh_id, ing_id), delta in sorted(deltas.items()) if delta
+    ]
+    if rows:
+        await session.execute(insert(StockMovement), rows)
+
+
+async def post_stock_changes(session: AsyncSession, deltas: Dict[StockKey, Decimal],
+                             supplies: Optional[Dict[int, Tuple[Decimal, Decimal]]] = None, label: str = "",
+                             doc_ids: Optional[Dict[StockKey, Optional[int]]] = None):
+    """
+    Проводить зміни залишків (і собівартості для приходу) у SAVEPOINT
+    і записує їх у журнал stock_movements (doc_ids - накладна для кожного ключа).
+    Порядок блокувань завжди однаковий: Ingredient за ID, потім Stock за (склад, інгредієнт),
+    тому зустрічні проведення чекають одне одного, а не взаємоблокуються.
+    Якщо Postgres все ж повернув deadlock / serialization failure / lock timeout,
+    SAVEPOINT відкочується (разом з отриманими в ньому блокуваннями) і проведення повторюється.
+    """
+    attempt = 0
+    while True:
+        try:
+            async with session.begin_nested():
+                started = time.monotonic()
+                await lock_ingredients(session, (supplies or {}).keys())
+                locked = await lock_stock_rows(session, (key for key, delta in deltas.items() if delta))
+                lock_wait = time.monotonic() - started
+
+                await recompute_average_costs(session, supplies or {})
+                await apply_stock_deltas(session, deltas, locked)
+                await record_movements(session, deltas, locked, doc_ids)
+            break
+        except DBAPIError as e:
+            if not _is_retryable(e) or attempt >= POSTING_MAX_RETRIES:
+                posting_stats.failures += 1
+                raise
+            attempt += 1
+            posting_stats.retries += 1
+            logger.warning(f"Склад: конфлікт блокувань при проведенні {label}, повтор {attempt}: {e.orig}")
+            await asyncio.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+    posting_stats.observe(lock_wait)
+    if lock_wait > SLOW_LOCK_WAIT:
+        logger.warning(f"Склад: проведення {label} чекало на блокування {lock_wait:.2f} с")
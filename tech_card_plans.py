@@ -0,0 +1,210 @@
+# tech_card_plans.py
+
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from inventory_models import TechCard, Ingredient, Warehouse, Modifier, AutoDeductionRule
+from models import Order, Product
+from event_bus import event_bus, ALL_CACHES
+
+logger = logging.getLogger(__name__)
+
+# (склад зберігання, інгредієнт, кількість)
+PlanLine = Tuple[int, int, Decimal]
+
+
+def _dec(value) -> Decimal:
+    return Decimal(str(value or 0))
+
+
+def order_trigger(order: Order) -> str:
+    """Тип замовлення для правил автосписання (упаковки)."""
+    if order.is_delivery: return 'delivery'
+    if order.order_type == 'pickup': return 'pickup'
+    return 'in_house'
+
+
+class ProductPlan:
+    """
+    Скомпільована техкарта страви:
+    цех приготування, склад, з якого фактично списуємо, і брутто на 1 порцію
+    окремо для замовлень у залі та "на винос" (з упаковкою з техкарти).
+    """
+
+    __slots__ = ("product_id", "production_wh_id", "storage_wh_id", "in_house", "takeaway", "cooking_method")
+
+    def __init__(self, product_id: int, production_wh_id: int, storage_wh_id: int,
+                 components: Iterable[Tuple[int, Decimal, bool]] = (), cooking_method: Optional[str] = None):
+        self.product_id = product_id
+        self.production_wh_id = production_wh_id
+        self.storage_wh_id = storage_wh_id
+        self.in_house: Tuple[Tuple[int, Decimal], ...] = tuple(
+            (ing_id, gross) for ing_id, gross, is_takeaway in components if not is_takeaway
+        )
+        self.takeaway: Tuple[Tuple[int, Decimal], ...] = tuple((ing_id, gross) for ing_id, gross, _ in components)
+        self.cooking_method = cooking_method
+
+    def components(self, is_takeaway_order: bool) -> Tuple[Tuple[int, Decimal], ...]:
+        return self.takeaway if is_takeaway_order else self.in_house
+
+
+class DeductionPlanSnapshot:
+    """Довідник техкарт, модифікаторів, складів і правил упаковки для списання."""
+
+    def __init__(self, version: int, warehouses: List[Tuple[int, Optional[int]]],
+                 products: List[Tuple[int, Optional[int]]], tech_cards: List[TechCard],
+                 modifiers: List[Modifier], rules: List[AutoDeductionRule]):
+        self.version = version
+
+        # Склад за замовчуванням (перший у базі), якщо цех не вказано
+        self.fallback_wh_id: Optional[int] = warehouses[0][0] if warehouses else None
+        # Цех -> склад, з якого він бере продукти
+        self._storage: Dict[int, int] = {wh_id: (linked_id or wh_id) for wh_id, linked_id in warehouses}
+
+        cards: Dict[int, TechCard] = {tc.product_id: tc for tc in tech_cards}
+        self._products: Dict[int, ProductPlan] = {}
+        for product_id, production_wh_id in products:
+            self._products[product_id] = self._compile(product_id, production_wh_id, cards.get(product_id))
+
+        self._modifiers: Dict[int, Tuple[Optional[int], Decimal, Optional[int]]] = {
+            m.id: (m.ingredient_id, _dec(m.ingredient_qty), m.warehouse_id) for m in modifiers
+        }
+
+        self._rules: Dict[str, Tuple[Tuple[int, int, Decimal], ...]] = {}
+        for trigger in ('in_house', 'delivery', 'pickup'):
+            self._rules[trigger] = tuple(
+                (self.storage_id(r.warehouse_id), r.ingredient_id, _dec(r.quantity))
+                for r in rules if r.trigger_type in (trigger, 'all')
+            )
+
+    def _compile(self, product_id: int, production_wh_id: Optional[int], tech_card: Optional[TechCard]) -> ProductPlan:
+        wh_id = production_wh_id or self.fallback_wh_id
+        components = []
+        cooking_method = None
+        if tech_card:
+            components = [(c.ingredient_id, _dec(c.gross_amount), bool(c.is_takeaway)) for c in tech_card.components]
+            cooking_method = tech_card.cooking_method
+        return ProductPlan(product_id, wh_id, self.storage_id(wh_id), components, cooking_method)
+
+    def storage_id(self, wh_id: Optional[int]) -> Optional[int]:
+        if not wh_id: return self.fallback_wh_id
+        return self._storage.get(wh_id, wh_id)
+
+    def product(self, product_id: int) -> ProductPlan:
+        plan = self._products.get(product_id)
+        if plan is None:
+            # Товар видалено, але він лишився в історії замовлення
+            plan = self._compile(product_id, None, None)
+        return plan
+
+    def modifier_usage(self, mod_data: dict, default_wh_id: Optional[int]) -> Optional[Tuple[int, int, Decimal]]:
+        """(склад зберігання, інгредієнт, кількість на 1 порцію) для модифікатора з Order.items.modifiers."""
+        ing_id = mod_data.get('ingredient_id')
+        ing_qty_val = mod_data.get('ingredient_qty')
+        wh_id = mod_data.get('warehouse_id')
+
+        # Старі замовлення: в JSON немає даних - беремо з довідника модифікаторів
+        if not ing_id or not ing_qty_val:
+            mod_id = mod_data.get('id')
+            known = self._modifiers.get(int(mod_id)) if mod_id else None
+            if known:
+                ing_id, ing_qty_val, mod_wh_id = known
+                if not wh_id:
+                    wh_id = mod_wh_id
+
+        if not ing_id or not ing_qty_val or _dec(ing_qty_val) <= 0:
+            return None
+        return self.storage_id(wh_id or default_wh_id), int(ing_id), _dec(ing_qty_val)
+
+    def order_lines(self, order: Order, include_rules: bool = True) -> List[PlanLine]:
+        """Усі інгредієнти замовлення (страви, модифікатори, упаковка) зі складами списання."""
+        is_takeaway_order = order.is_delivery or order.order_type == 'pickup'
+        lines: List[PlanLine] = []
+
+        for item in order.items:
+            plan = self.product(item.product_id)
+            qty = _dec(item.quantity)
+            for ing_id, gross in plan.components(is_takeaway_order):
+                lines.append((plan.storage_wh_id, ing_id, gross * qty))
+            for mod_data in item.modifiers or []:
+                usage = self.modifier_usage(mod_data, plan.production_wh_id)
+                if usage:
+                    wh_id, ing_id, mod_qty = usage
+                    lines.append((wh_id, ing_id, mod_qty * qty))
+
+        if include_rules:
+            lines.extend(self._rules[order_trigger(order)])
+        return lines
+
+
+class DeductionPlanCache:
+    """
+    Скомпільовані плани списання в пам'яті процесу.
+    Перебудовуються після змін техкарт, модифікаторів, складів, правил упаковки
+    та цеху приготування товару. Ціни інгредієнтів сюди не входять - їх
+    дочитує ingredient_costs() одним запитом на замовлення.
+    """
+
+    def __init__(self):
+        self.version: int = 1
+        self._snapshot: Optional[DeductionPlanSnapshot] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, broadcast: bool = True):
+        """Викликати ПІСЛЯ commit змін техкарт / модифікаторів / складів / товарів."""
+        self.version += 1
+        if broadcast:
+            event_bus.publish_nowait("cache_invalidate", {"cache": "tech_card_plans"})
+
+    async def get(self, session: AsyncSession) -> DeductionPlanSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+
+        async with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == self.version:
+                return snapshot
+
+            version = self.version
+            warehouses = (await session.execute(
+                select(Warehouse.id, Warehouse.linked_warehouse_id).order_by(Warehouse.id)
+            )).all()
+            products = (await session.execute(select(Product.id, Product.production_warehouse_id))).all()
+            tech_cards = (await session.execute(
+                select(TechCard).options(selectinload(TechCard.components))
+            )).scalars().all()
+            modifiers = (await session.execute(select(Modifier))).scalars().all()
+            rules = (await session.execute(select(AutoDeductionRule))).scalars().all()
+
+            snapshot = DeductionPlanSnapshot(version, warehouses, products, tech_cards, modifiers, rules)
+            self._snapshot = snapshot
+            logger.info(f"Плани списання зібрано (версія {version}): {len(products)} товарів, {len(tech_cards)} техкарт")
+            return snapshot
+
+
+async def ingredient_costs(session: AsyncSession, ingredient_ids: Iterable[int]) -> Dict[int, Decimal]:
+    """Поточна собівартість інгредієнтів одним запитом."""
+    ids = set(ingredient_ids)
+    if not ids:
+        return {}
+    rows = await session.execute(select(Ingredient.id, Ingredient.current_cost).where(Ingredient.id.in_(ids)))
+    return {ing_id: _dec(cost) for ing_id, cost in rows.all()}
+
+
+# Глобальний екземпляр
+deduction_plans = DeductionPlanCache()
+
+
+def _on_remote_invalidate(payload: dict):
+    if payload.get("cache") in ("tech_card_plans", ALL_CACHES):
+        deduction_plans.invalidate(broadcast=False)
+
+
+event_bus.subscribe("cache_invalidate", _on_remote_invalidate)
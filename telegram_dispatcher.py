@@ -0,0 +1,227 @@
+# telegram_dispatcher.py
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramMigrateToChat, TelegramNotFound, TelegramRetryAfter
+)
+
+logger = logging.getLogger(__name__)
+
+# Ліміти Telegram Bot API: ~30 повідомлень/сек загалом, ~1/сек в один чат, ~20/хв у групу
+TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", "25"))
+TG_CHAT_RATE = 1.0
+TG_GROUP_RATE = 20 / 60
+TG_MAX_RETRIES = 3
+# Найдовша пауза TelegramRetryAfter, яку фонова задача чекає на місці (сек.); довші - невдача
+TG_MAX_RETRY_AFTER = float(os.environ.get("TG_MAX_RETRY_AFTER", "60"))
+
+ChatId = Union[int, str]
+
+# Результат відправки в один чат
+_SENT = "sent"
+# Повторювати марно: бот заблокований, чату не існує, запит відхилено
+_REJECTED = "rejected"
+# Тимчасова помилка (мережа, 5xx, вичерпані спроби після RetryAfter) - варто повторити пізніше
+_FAILED = "failed"
+_PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound, TelegramMigrateToChat)
+
+# Чи може поточна задача чекати ліміти і RetryAfter на місці. За замовчуванням - ні: сповіщення
+# надсилаються і з обробників HTTP-запитів, розсилка з них іде окремою фоновою задачею
+_waiting_allowed: ContextVar[bool] = ContextVar("tg_waiting_allowed", default=False)
+
+
+def allow_waiting():
+    """Викликати на початку фонового воркера: ліміти і RetryAfter (до TG_MAX_RETRY_AFTER) чекаємо в ньому ж."""
+    _waiting_allowed.set(True)
+
+
+class TokenBucket:
+    """Класичний token bucket: rate токенів на секунду, не більше capacity в запасі."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DeliveryStats:
+    """Затримка доставки (від постановки до успішної відправки) по типу повідомлення."""
+
+    def __init__(self, window: int = 500):
+        self.sent = 0
+        self.failed = 0
+        self.retry_after = 0
+        self._latencies = deque(maxlen=window)
+
+    def observe(self, latency: float):
+        self.sent += 1
+        self._latencies.append(latency)
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def pct(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retry_after": self.retry_after,
+            "latency_p50_ms": round(pct(0.50) * 1000, 1),
+            "latency_p95_ms": round(pct(0.95) * 1000, 1),
+            "latency_max_ms": round((latencies[-1] if latencies else 0.0) * 1000, 1),
+        }
+
+
+class TelegramDispatcher:
+    """
+    Паралельна розсилка в Telegram з урахуванням лімітів:
+    - спільний bucket на весь процес і окремий на кожен чат;
+    - TelegramRetryAfter - чекаємо вказаний час і пробуємо ще раз;
+    - поза фоновими воркерами (обробники запитів, бота) send/send_many лише ставлять розсилку
+      фоновій задачі: ні ліміти, ні паузи Telegram не затримують відповідь;
+    - однакові chat_id в одній розсилці об'єднуються.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_RATE)
+        self._chats: Dict[str, TokenBucket] = {}
+        self.stats: Dict[str, DeliveryStats] = {}
+        # Фонові розсилки: сильні посилання, щоб задачі не зібрав GC
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _chat_bucket(self, chat_id: ChatId) -> TokenBucket:
+        # ADMIN_CHAT_ID приходить і рядком, і числом - ключ один, інакше в чату два ліміти
+        key = str(chat_id)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) > 5000:
+                # Прибираємо чати, в які давно не писали (bucket уже повний)
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items() if now - b.updated < 60}
+            # Від'ємні ID - групи та канали
+            is_group = key.startswith("-")
+            bucket = TokenBucket(TG_GROUP_RATE if is_group else TG_CHAT_RATE, 1)
+            self._chats[key] = bucket
+        return bucket
+
+    async def send(self, bot: Optional[Bot], chat_id: ChatId, text: str, kind: str = "generic", **kwargs) -> bool:
+        return (await self.send_many(bot, [chat_id], text, kind=kind, **kwargs)) > 0
+
+    async def send_many(self, bot: Optional[Bot], chat_ids: Iterable[Optional[ChatId]], text: str,
+                        kind: str = "generic", **kwargs) -> int:
+        """
+        Надсилає text у всі чати паралельно. Повертає кількість успішних доставок,
+        поза фоновим воркером (див. allow_waiting) - кількість чатів, поставлених у фонову розсилку.
+        """
+        if bot is None:
+            return 0
+        unique_ids = self._unique(chat_ids)
+        if not _waiting_allowed.get():
+            self._spawn(self._send_background(bot, unique_ids, text, kind, kwargs))
+            return len(unique_ids)
+        results = await self._send_all(bot, unique_ids, text, kind, kwargs)
+        return sum(1 for result in results.values() if result == _SENT)
+
+    async def deliver(self, bot: Optional[Bot], chat_ids: Iterable[Optional[ChatId]], text: str,
+                      kind: str = "generic", **kwargs) -> List[ChatId]:
+        """
+        Як send_many, але повертає чати, куди не доставлено через тимчасову помилку, - їх можна
+        повторити пізніше (outbox). Заблокований бот чи неіснуючий чат до результату не потрапляють.
+        Чекає ліміти на місці - для фонових воркерів.
+        """
+        if bot is None:
+            return []
+        results = await self._send_all(bot, self._unique(chat_ids), text, kind, kwargs)
+        return [chat_id for chat_id, result in results.items() if result == _FAILED]
+
+    @staticmethod
+    def _unique(chat_ids: Iterable[Optional[ChatId]]) -> List[ChatId]:
+        unique_ids: List[ChatId] = []
+        seen = set()
+        for chat_id in chat_ids:
+            if chat_id is None or chat_id == "":
+                continue
+            key = str(chat_id)
+            if key in seen:
+                continue
+            seen.add(key)
+            unique_ids.append(chat_id)
+        return unique_ids
+
+    async def _send_background(self, bot: Bot, chat_ids: List[ChatId], text: str, kind: str, kwargs: dict):
+        allow_waiting()
+        await self._send_all(bot, chat_ids, text, kind, kwargs)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Telegram: помилка фонової розсилки: {task.exception()}", exc_info=task.exception())
+
+    async def _send_all(self, bot: Bot, chat_ids: List[ChatId], text: str, kind: str, kwargs: dict) -> Dict[ChatId, str]:
+        started = time.monotonic()
+        results = await asyncio.gather(*[self._send_one(bot, chat_id, text, kind, started, kwargs) for chat_id in chat_ids])
+        return dict(zip(chat_ids, results))
+
+    async def _send_one(self, bot: Bot, chat_id: ChatId, text: str, kind: str, started: float, kwargs: dict) -> str:
+        stats = self.stats.setdefault(kind, DeliveryStats())
+        for attempt in range(TG_MAX_RETRIES):
+            await self._chat_bucket(chat_id).acquire()
+            await self._global.acquire()
+            try:
+                await bot.send_message(chat_id, text, **kwargs)
+            except TelegramRetryAfter as e:
+                stats.retry_after += 1
+                if attempt == TG_MAX_RETRIES - 1 or e.retry_after > TG_MAX_RETRY_AFTER:
+                    break
+                logger.warning(f"Telegram: ліміт для {chat_id}, повтор через {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+                continue
+            except _PERMANENT_ERRORS as e:
+                stats.failed += 1
+                logger.warning(f"Telegram: '{kind}' в {chat_id} відхилено: {e}")
+                return _REJECTED
+            except Exception as e:
+                stats.failed += 1
+                logger.warning(f"Telegram: не вдалося надіслати '{kind}' в {chat_id}: {e}")
+                return _FAILED
+            stats.observe(time.monotonic() - started)
+            return _SENT
+        stats.failed += 1
+        logger.warning(f"Telegram: '{kind}' в {chat_id} не надіслано через ліміт")
+        return _FAILED
+
+    def metrics(self) -> dict:
+        return {kind: stats.snapshot() for kind, stats in self.stats.items()}
+
+
+# Глобальний екземпляр
+tg_dispatcher = TelegramDispatcher()
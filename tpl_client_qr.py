@@ -444,7 +444,7 @@ IN_HOUSE_MENU_HTML_TEMPLATE = """
 
     <script>
         const TABLE_ID = {table_id};
-        const MENU = {menu_data};
+        let MENU = {{ categories: [], products: [] }};
         let HISTORY = {history_data};
         let GRAND_TOTAL = {grand_total};
         let cart = {{}};
@@ -464,7 +464,7 @@ IN_HOUSE_MENU_HTML_TEMPLATE = """
                 }}
             }} catch (e) {{ cart = {{}}; }}
 
-            renderMenu();
+            loadMenu();
             updateCartView();
             initListeners();
             
@@ -576,6 +576,34 @@ IN_HOUSE_MENU_HTML_TEMPLATE = """
             }}
         }}
 
+        // --- MENU LOAD (умовний запит: при 304 беремо меню з localStorage) ---
+        async function loadMenu() {{
+            const CACHE_KEY = 'qrMenuCache';
+            let cached = null;
+            try {{ cached = JSON.parse(localStorage.getItem(CACHE_KEY)); }} catch (e) {{ cached = null; }}
+
+            const headers = {{}};
+            if (cached && cached.etag && cached.data) headers['If-None-Match'] = cached.etag;
+
+            try {{
+                const res = await fetch('/api/menu/restaurant', {{ headers, cache: 'no-store' }});
+                if (res.status === 304 && cached) {{
+                    MENU = cached.data;
+                }} else {{
+                    if (!res.ok) throw new Error("Failed");
+                    MENU = await res.json();
+                    const etag = res.headers.get('ETag');
+                    if (etag) {{
+                        try {{ localStorage.setItem(CACHE_KEY, JSON.stringify({{ etag: etag, data: MENU }})); }} catch (e) {{}}
+                    }}
+                }}
+            }} catch (e) {{
+                // Офлайн або помилка мережі: показуємо останню збережену версію
+                if (cached && cached.data) MENU = cached.data;
+            }}
+            renderMenu();
+        }}
+
         // --- MENU RENDER ---
         function renderMenu() {{
             const main = document.getElementById('menu');
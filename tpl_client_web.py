@@ -676,10 +676,26 @@ WEB_ORDER_HTML = """
             fetchMenu();
 
             async function fetchMenu() {{
+                // Умовний запит: при 304 беремо меню з localStorage
+                const CACHE_KEY = 'webMenuCache';
+                let cached = null;
+                try {{ cached = JSON.parse(localStorage.getItem(CACHE_KEY)); }} catch (e) {{ cached = null; }}
+
+                const headers = {{}};
+                if (cached && cached.etag && cached.data) headers['If-None-Match'] = cached.etag;
+
                 try {{
-                    const res = await fetch('/api/menu');
-                    if (!res.ok) throw new Error("Failed");
-                    menuData = await res.json();
+                    const res = await fetch('/api/menu', {{ headers, cache: 'no-store' }});
+                    if (res.status === 304 && cached) {{
+                        menuData = cached.data;
+                    }} else {{
+                        if (!res.ok) throw new Error("Failed");
+                        menuData = await res.json();
+                        const etag = res.headers.get('ETag');
+                        if (etag) {{
+                            try {{ localStorage.setItem(CACHE_KEY, JSON.stringify({{ etag: etag, data: menuData }})); }} catch (e) {{}}
+                        }}
+                    }}
                     renderMenu();
                     updateCartView();
                 }} catch (e) {{
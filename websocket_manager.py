@@ -1,65 +1,297 @@
 # websocket_manager.py
 
-from typing import List, Dict
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Iterable, Dict, Optional
 from fastapi import WebSocket
 import logging
 
+from event_bus import event_bus, BUS_RECONNECTED
+
 logger = logging.getLogger(__name__)
 
+# Максимум неотправленных сообщений на одно соединение (дальше - отключаем клиента)
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "100"))
+# Сколько секунд ждем отправки одного сообщения медленному клиенту
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "5"))
+
+
+def _with_seq(body: str, seq: int) -> str:
+    """Добавляет seq в уже сериализованный JSON-объект (без повторного json.dumps)."""
+    if body == "{}":
+        return f'{{"seq":{seq}}}'
+    return f'{body[:-1]},"seq":{seq}}}'
+
+
+class BroadcastStats:
+    """Метрики рассылки: задержка доставки (от постановки в очередь до отправки) и отключения."""
+
+    def __init__(self, window: int = 1000):
+        self.broadcasts: int = 0
+        self.messages_sent: int = 0
+        self.evicted_overflow: int = 0
+        self.evicted_timeout: int = 0
+        self.max_latency: float = 0.0
+        self._latencies = deque(maxlen=window)
+
+    def observe(self, latency: float):
+        self.messages_sent += 1
+        self._latencies.append(latency)
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def pct(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            "broadcasts": self.broadcasts,
+            "messages_sent": self.messages_sent,
+            "evicted_overflow": self.evicted_overflow,
+            "evicted_timeout": self.evicted_timeout,
+            "latency_p50_ms": round(pct(0.50) * 1000, 2),
+            "latency_p95_ms": round(pct(0.95) * 1000, 2),
+            "latency_max_ms": round(self.max_latency * 1000, 2),
+        }
+
+
+class ClientConnection:
+    """
+    Соединение с собственной ограниченной очередью и задачей-писателем.
+    Рассылка только кладет сообщение в очередь и не ждет медленных клиентов.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+
+    def start(self, manager: "ConnectionManager"):
+        self.writer = asyncio.create_task(self._write_loop(manager))
+
+    def stop(self):
+        if self.writer and not self.writer.done() and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
+    def enqueue(self, text: str) -> bool:
+        try:
+            self.queue.put_nowait((time.monotonic(), text))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write_loop(self, manager: "ConnectionManager"):
+        while True:
+            enqueued_at, text = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(text), WS_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                manager.stats.evicted_timeout += 1
+                logger.warning("WebSocket: клиент не принимает сообщения, отключаем (таймаут)")
+                await manager.evict(self)
+                return
+            except Exception:
+                await manager.evict(self)
+                return
+            manager.stats.observe(time.monotonic() - enqueued_at)
+
+
+class StaffSubscriber(ClientConnection):
+    """
+    Соединение сотрудника: ID, права роли и цеха (на момент подключения).
+    После смены роли/цехов актуальные данные подтянутся при переподключении PWA.
+    """
+
+    def __init__(self, websocket: WebSocket, employee_id: int, can_manage_orders: bool = False,
+                 workshop_ids: Optional[Iterable[int]] = None):
+        super().__init__(websocket)
+        self.employee_id = employee_id
+        self.can_manage_orders = can_manage_orders
+        self.workshop_ids = frozenset(workshop_ids or [])
+        # Порядковый номер событий этого соединения (при пропуске клиент делает полную пересинхронизацию)
+        self.seq: int = 0
+
+    @classmethod
+    def from_employee(cls, websocket: WebSocket, employee) -> "StaffSubscriber":
+        return cls(
+            websocket,
+            employee_id=employee.id,
+            can_manage_orders=bool(employee.role and employee.role.can_manage_orders),
+            workshop_ids=employee.assigned_workshop_ids,
+        )
+
+
+class TableSubscriber(ClientConnection):
+    """Соединение гостя за столиком (QR меню)."""
+
+    def __init__(self, websocket: WebSocket, table_id: int):
+        super().__init__(websocket)
+        self.table_id = table_id
+
+
+class StaffAudience:
+    """
+    Кому из персонала адресовано событие:
+    - managers: операторы/админы (can_manage_orders) - видят все заказы;
+    - employee_ids: конкретные сотрудники (официант, курьер, официанты столика);
+    - workshop_ids: цеха, в которых готовятся блюда заказа (кухня/бар).
+    """
+
+    def __init__(self, managers: bool = True, employee_ids: Optional[Iterable[int]] = None,
+                 workshop_ids: Optional[Iterable[int]] = None):
+        self.managers = managers
+        self.employee_ids = frozenset(i for i in (employee_ids or []) if i)
+        self.workshop_ids = frozenset(i for i in (workshop_ids or []) if i)
+
+    def to_dict(self) -> dict:
+        return {"managers": self.managers, "employee_ids": list(self.employee_ids), "workshop_ids": list(self.workshop_ids)}
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> Optional["StaffAudience"]:
+        if data is None:
+            return None
+        return cls(data.get("managers", True), data.get("employee_ids"), data.get("workshop_ids"))
+
+    def includes(self, sub: StaffSubscriber) -> bool:
+        if self.managers and sub.can_manage_orders:
+            return True
+        if sub.employee_id in self.employee_ids:
+            return True
+        return not self.workshop_ids.isdisjoint(sub.workshop_ids)
+
+
 class ConnectionManager:
     def __init__(self):
-        # Соединения персонала (все сотрудники получают уведомления о заказах)
-        self.staff_connections: List[WebSocket] = []
+        # Соединения персонала (ключ - websocket)
+        self.staff_connections: Dict[WebSocket, StaffSubscriber] = {}
         # Соединения столиков (ключ - table_id)
-        self.table_connections: Dict[int, List[WebSocket]] = {}
+        self.table_connections: Dict[int, Dict[WebSocket, TableSubscriber]] = {}
+        self.stats = BroadcastStats()
+        # Задачи отключения: храним ссылки, иначе event loop может собрать их сборщиком мусора
+        self._evictions: set = set()
 
-    async def connect_staff(self, websocket: WebSocket):
+    async def connect_staff(self, websocket: WebSocket, employee) -> StaffSubscriber:
         await websocket.accept()
-        self.staff_connections.append(websocket)
+        subscriber = StaffSubscriber.from_employee(websocket, employee)
+        # Клиент запоминает текущий номер и сверяет с ним следующие события
+        subscriber.enqueue(json.dumps({"type": "sync", "seq": subscriber.seq}))
+        subscriber.start(self)
+        self.staff_connections[websocket] = subscriber
         # logger.info("Staff WebSocket connected")
+        return subscriber
 
     def disconnect_staff(self, websocket: WebSocket):
-        if websocket in self.staff_connections:
-            self.staff_connections.remove(websocket)
+        subscriber = self.staff_connections.pop(websocket, None)
+        if subscriber:
+            subscriber.stop()
 
     async def connect_table(self, websocket: WebSocket, table_id: int):
         await websocket.accept()
-        if table_id not in self.table_connections:
-            self.table_connections[table_id] = []
-        self.table_connections[table_id].append(websocket)
+        subscriber = TableSubscriber(websocket, table_id)
+        subscriber.start(self)
+        self.table_connections.setdefault(table_id, {})[websocket] = subscriber
         # logger.info(f"Table #{table_id} WebSocket connected")
 
     def disconnect_table(self, websocket: WebSocket, table_id: int):
         if table_id in self.table_connections:
-            if websocket in self.table_connections[table_id]:
-                self.table_connections[table_id].remove(websocket)
+            subscriber = self.table_connections[table_id].pop(websocket, None)
+            if subscriber:
+                subscriber.stop()
             if not self.table_connections[table_id]:
                 del self.table_connections[table_id]
 
-    async def broadcast_staff(self, message: dict):
-        """Отправляет сообщение всему персоналу"""
-        to_remove = []
-        for connection in self.staff_connections:
-            try:
-                await connection.send_json(message)
-            except Exception:
-                to_remove.append(connection)
-        
-        for dead_conn in to_remove:
-            self.disconnect_staff(dead_conn)
+    async def evict(self, connection: ClientConnection):
+        """Отключает медленного или отвалившегося клиента."""
+        if isinstance(connection, StaffSubscriber):
+            self.disconnect_staff(connection.websocket)
+        elif isinstance(connection, TableSubscriber):
+            self.disconnect_table(connection.websocket, connection.table_id)
+        connection.stop()
+        try:
+            # 1013 (Try Again Later): PWA переподключится и пересинхронизируется
+            await asyncio.wait_for(connection.websocket.close(code=1013), WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    def metrics(self) -> dict:
+        data = self.stats.snapshot()
+        data["staff_connections"] = len(self.staff_connections)
+        data["table_connections"] = sum(len(conns) for conns in self.table_connections.values())
+        return data
+
+    def _enqueue_or_evict(self, connection: ClientConnection, text: str):
+        if not connection.enqueue(text):
+            self.stats.evicted_overflow += 1
+            logger.warning("WebSocket: очередь клиента переполнена, отключаем")
+            task = asyncio.create_task(self.evict(connection))
+            self._evictions.add(task)
+            task.add_done_callback(self._eviction_done)
+
+    def _eviction_done(self, task: asyncio.Task):
+        self._evictions.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"WebSocket: ошибка отключения клиента: {task.exception()}", exc_info=task.exception())
+
+    async def broadcast_staff(self, message: dict, audience: Optional[StaffAudience] = None):
+        """
+        Отправляет сообщение персоналу этого воркера и, через event_bus, остальных воркеров.
+        audience=None - всем сотрудникам.
+        """
+        self._deliver_staff(message, audience)
+        audience_data = audience.to_dict() if audience else None
+        payload = {"message": message, "audience": audience_data}
+        if not event_bus.fits("ws_staff", payload):
+            # Дельта большого заказа не пролезает в NOTIFY: другим воркерам - только ссылка,
+            # клиент по флагу refetch перечитывает вкладку целиком
+            reference = {k: message[k] for k in ("type", "order_id", "message", "new_status", "area") if k in message}
+            reference["refetch"] = True
+            payload = {"message": reference, "audience": audience_data}
+            if not event_bus.fits("ws_staff", payload):
+                payload = {"message": {"type": message.get("type"), "order_id": message.get("order_id"), "refetch": True}, "audience": audience_data}
+        await event_bus.publish("ws_staff", payload)
 
     async def broadcast_table(self, table_id: int, message: dict):
-        """Отправляет сообщение конкретному столику"""
+        """Отправляет сообщение конкретному столику (на всех воркерах)"""
+        self._deliver_table(table_id, message)
+        await event_bus.publish("ws_table", {"table_id": table_id, "message": message})
+
+    def _deliver_staff(self, message: dict, audience: Optional[StaffAudience]):
+        # Сообщение сериализуется один раз (seq у каждого соединения свой), отправляют задачи-писатели
+        self.stats.broadcasts += 1
+        body = json.dumps(message, ensure_ascii=False)
+        for subscriber in list(self.staff_connections.values()):
+            if audience is not None and not audience.includes(subscriber):
+                continue
+            subscriber.seq += 1
+            self._enqueue_or_evict(subscriber, _with_seq(body, subscriber.seq))
+
+    def _deliver_table(self, table_id: int, message: dict):
         if table_id in self.table_connections:
-            to_remove = []
-            for connection in self.table_connections[table_id]:
-                try:
-                    await connection.send_json(message)
-                except Exception:
-                    to_remove.append(connection)
-            
-            for dead_conn in to_remove:
-                self.disconnect_table(dead_conn, table_id)
+            self.stats.broadcasts += 1
+            body = json.dumps(message, ensure_ascii=False)
+            for subscriber in list(self.table_connections[table_id].values()):
+                self._enqueue_or_evict(subscriber, body)
+
+    def _on_remote_staff(self, payload: dict):
+        self._deliver_staff(payload["message"], StaffAudience.from_dict(payload.get("audience")))
+
+    def _on_remote_table(self, payload: dict):
+        self._deliver_table(int(payload["table_id"]), payload["message"])
+
+    def _on_bus_reconnected(self, payload: dict):
+        # Пока шина была отключена, события других воркеров не доходили - персонал перечитывает данные
+        if self.staff_connections:
+            self._deliver_staff({"type": "refetch", "refetch": True}, None)
 
 # Глобальный экземпляр
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
+event_bus.subscribe("ws_staff", manager._on_remote_staff)
+event_bus.subscribe("ws_table", manager._on_remote_table)
+event_bus.subscribe(BUS_RECONNECTED, manager._on_bus_reconnected)